@@ -2,14 +2,21 @@
 import argparse
 import logging
 import logging.config
-import pandas as pd
+import shutil
+from functools import partial
 from pathlib import Path
 
-from data.util.dataframe import get_group, normalise_bps
-from features.descriptive import demographics, flowchart, reference_values
+from data.util.cache import ResultCache, frame_hash
+from data.util.dataframe import HEALTH_COLUMNS, get_group, normalise_bps
+from data.util.schema import apply_schema
+from data.util.store import load_dataset
+from data.util import tasks
+from features.descriptive import (demographics, flowchart, reference_index,
+                                  reference_values)
 from features.comparative import smoking
 from models.linear import univariate, multivariate
-from visualization import violin, regression, percentile
+from models.clustering import decision_tree, kmeans, knn
+from visualization import violin, regression, percentile, render
 
 runs = [
     "descriptive", "comparative", "regression", "clustering", "visualisation"
@@ -19,6 +26,18 @@ demo_params = [
     'age', 'height', 'weight', 'bp_tlv', 'pack_years',
     'fev1', 'fev1_pp', 'fvc', 'fev1_fvc', 'bp_tcount', 'tac'
 ]
+univariate_vars = [
+    'height', 'age', 'weight', 'bmi', 'pack_years', 'bp_tcount',
+    'bp_wap_avg', 'bp_la_avg', 'bp_pi10', 'fev1', 'fev1_fvc', 'fev1_pp',
+    'fvc'
+]
+# Phenotypes predicted by the decision trees, the healthy label only varies
+# when both groups are analysed
+tree_targets = {
+    "healthy": ["smoking_status"],
+    "unhealthy": ["smoking_status", "GOLD_stage"],
+    "all": ["smoking_status", "GOLD_stage", "healthy"],
+}
 # Whether to scale all parameters to [0, 1] before plotting/regression
 min_max_params = False
 
@@ -27,91 +46,246 @@ logging.config.fileConfig(src_dir / "logging.conf")
 logger = logging.getLogger("BronchialParameters")
 
 
+class StageFilter(logging.Filter):
+    """
+    Prefix log messages with the stage currently running in this process.
+    """
+    stage = None
+
+    def filter(self, record):
+        if self.stage is not None:
+            record.msg = f"[{self.stage}] {record.msg}"
+        return True
+
+
+stage_filter = StageFilter()
+logger.addFilter(stage_filter)
+
+# Frames available to the analyses run in this process and the result cache,
+# set by _init_worker
+_frames = {}
+_cache = None
+
+
+def _init_worker(frames, cache=None):
+    global _cache
+    render.init_worker()
+    _frames.update(frames)
+    _cache = cache
+
+
+def _run_task(task):
+    stage_filter.stage = task.group
+    try:
+        logger.debug(task.name)
+        data = _frames[task.frame]
+        if _cache is None:
+            task.func(data)
+        elif hasattr(task.func.func, "key"):
+            # The analysis names what its results depend on
+            key = task.func.func.key(data, **task.func.keywords)
+            _cache.run(task.func, data, key)
+        else:
+            # Key on the columns the analysis reads, so its results are
+            # reused whichever other analyses were loaded alongside it
+            columns = tasks.declared_columns([task.func])
+            columns = list(data) if columns is None else [
+                col for col in columns if col in data
+            ]
+            _cache.run(task.func, data, frame_hash(data.loc[:, columns]))
+    finally:
+        stage_filter.stage = None
+
+
+def nomogram_figures(args, bps: list, out_paths: dict) -> list:
+    """
+    The nomogram figures, if requested with --nomograms and they can be
+    drawn: pynomo needs TeX, and the fits they are drawn from are written
+    by the regression run.
+    """
+    if not args.nomograms:
+        return []
+    if shutil.which("tex") is None:
+        logger.warning("TeX not found, the nomograms are not drawn")
+        return []
+    strata = out_paths[runs[2]] / "multivariate_strata.csv"
+    if runs[2] not in args.to_run and not strata.exists():
+        logger.warning(f"{strata} not found, run the regression analysis "
+                       "to draw the nomograms")
+        return []
+    # pynomo is only imported when the nomograms are drawn
+    from visualization import nomograms
+    return nomograms.figures(bps, out_paths[runs[4]], strata)
+
+
 def main(args):
-    data_all = pd.read_csv(args.in_file, low_memory=False)
     bps = args.param_list.split(",")
+    # demographics_all.csv describes the demographics, the health columns
+    # and the airway parameters analysed
+    described = demo_params + ["bmi"] + HEALTH_COLUMNS + bps
     main_out_dir = Path(args.out_directory)
 
     # Only use healthy participants if specified
-    if args.health_stat == "healthy":
-        data = get_group(data_all, "healthy")
-        main_out_dir = main_out_dir / "healthy"
-    elif args.health_stat == "unhealthy":
-        data = get_group(data_all, "unhealthy")
-        main_out_dir = main_out_dir / "unhealthy"
-    elif args.health_stat == "all":
-        data = get_group(data_all, "all")
-        main_out_dir = main_out_dir / "all"
+    if args.health_stat in ["healthy", "unhealthy", "all"]:
+        main_out_dir = main_out_dir / args.health_stat
     else:
-        raise ValueError("Invalid health status: " + args.heath_stat)
+        raise ValueError("Invalid health status: " + args.health_stat)
 
     main_out_dir = main_out_dir / args.group_by
 
     # Normalise parameters if specified (height is default)
     if args.normalised:
-        data = normalise_bps(data, bps)
         main_out_dir = main_out_dir / "normalised"
     else:
         main_out_dir = main_out_dir / "not-normalised"
 
-    run_funcs = {
-        runs[0]:
-        lambda: (
-            demographics.calc_demographics(data.copy(deep=True), demo_params, out_path,
-                                           args.group_by),
-            flowchart.make_chart(data_all.copy(deep=True), out_path),
-            # reference_values.create_table(data.copy(deep=True), bps, out_path, args.group_by),
-
-        ),
-        runs[1]:
-        lambda: (smoking.compare(data.copy(deep=True), bps, out_path)),
-        runs[2]:
-        lambda: (
-            univariate.fit_analyse(data.copy(deep=True), bps, "height",
-                                   out_path, min_max_params),
-            univariate.fit_analyse(data.copy(deep=True), bps, "age",
-                                   out_path, min_max_params),
-            univariate.fit_analyse(data.copy(deep=True), bps, "weight",
-                                   out_path, min_max_params),
-            univariate.fit_analyse(data.copy(deep=True), bps, "bmi", out_path, min_max_params),
-            univariate.fit_analyse(data.copy(deep=True), bps, "pack_years",
-                                   out_path, min_max_params),
-            univariate.fit_analyse(data.copy(deep=True), bps, "bp_tcount",
-                                   out_path, min_max_params),
-            univariate.fit_analyse(data.copy(deep=True), bps, "bp_wap_avg",
-                                   out_path, min_max_params),
-            univariate.fit_analyse(data.copy(deep=True), bps, "bp_la_avg",
-                                   out_path, min_max_params),
-            univariate.fit_analyse(data.copy(deep=True), bps, "bp_pi10",
-                                   out_path, min_max_params),
-            univariate.fit_analyse(data.copy(deep=True), bps, "fev1",
-                                   out_path, min_max_params),
-            univariate.fit_analyse(data.copy(deep=True), bps, "fev1_fvc",
-                                   out_path, min_max_params),
-            univariate.fit_analyse(data.copy(deep=True), bps, "fev1_pp",
-                                   out_path, min_max_params),
-            univariate.fit_analyse(data.copy(deep=True), bps, "fvc",
-                                   out_path, min_max_params),
-            multivariate.fit_analyse(data.copy(deep=True), ["fev1_pp", "fev1_fvc"], out_path,
-                                     True),
-        ),
-        runs[3]:
-        lambda: (),
-        runs[4]:
-        lambda: (
-            # percentile.make_plots(data.copy(deep=True), bps, out_path),
-            violin.make_plots(data.copy(deep=True), bps, out_path),
-            regression.make_plots(data.copy(deep=True), bps, out_path, min_max_params),
-        ),
+    out_paths = {run: main_out_dir / run for run in runs}
+
+    # Each run is a group of tasks. A task names the frame it analyses and
+    # holds a partial binding every other argument, so it can be sent to a
+    # worker without pickling the cohort. Analyses receive the cohort itself
+    # rather than a copy, none of them modify their input.
+    analyses = {
+        runs[0]: [
+            ("data",
+             partial(demographics.calc_demographics, params=demo_params,
+                     out_dir=out_paths[runs[0]], split_by=args.group_by,
+                     described=described, shards=args.shards)),
+            ("data_all",
+             partial(flowchart.make_chart, out_path=out_paths[runs[0]])),
+            # ("data",
+            #  partial(reference_values.create_table, bps=bps,
+            #          out_path=out_paths[runs[0]], group_by=args.group_by)),
+            ("data",
+             partial(reference_index.create_index, bps=bps,
+                     out_path=out_paths[runs[0]])),
+        ],
+        runs[1]: [
+            ("data",
+             partial(smoking.compare, parameters=bps,
+                     out_path=out_paths[runs[1]])),
+        ],
+        runs[2]: [
+            # All univariate fits are computed together in one batched pass
+            ("data",
+             partial(univariate.fit_analyse_batch, bps=bps,
+                     i_vars=univariate_vars, out_path=out_paths[runs[2]],
+                     min_max_params=min_max_params, shards=args.shards)),
+            ("data",
+             partial(multivariate.fit_analyse, bps=["fev1_pp", "fev1_fvc"],
+                     out_path=out_paths[runs[2]], min_max_params=True,
+                     shards=args.shards)),
+            ("data",
+             partial(multivariate.fit_strata, bps=bps,
+                     out_path=out_paths[runs[2]])),
+        ],
+        runs[3]: [
+            ("data", partial(knn.classify, out_path=out_paths[runs[3]])),
+            # Streams its rows from in_file instead of the loaded frame
+            ("data",
+             partial(kmeans.cluster, out_path=out_paths[runs[3]],
+                     source=args.in_file, health_stat=args.health_stat,
+                     normalise=bps if args.normalised else None,
+                     n_clusters=args.clusters, seed=args.seed)),
+        ] + [
+            ("data",
+             partial(decision_tree.cross_validate, target=target,
+                     out_path=out_paths[runs[3]]))
+            for target in tree_targets[args.health_stat]
+        ],
+        # Every figure is its own call
+        runs[4]: [
+            ("data", figure) for figure in (
+                # percentile.figures(bps, out_paths[runs[4]]) +
+                violin.figures(bps, out_paths[runs[4]]) +
+                regression.figures(bps, out_paths[runs[4]], min_max_params) +
+                nomogram_figures(args, bps, out_paths))
+        ],
     }
 
+    # With --update in_file is a batch of new scans, merged into the
+    # accumulators saved with the outputs of the analyses that support it,
+    # keyed by the analysis each update replaces
+    updates = {
+        demographics.calc_demographics:
+            partial(demographics.update_demographics, params=demo_params,
+                    out_dir=out_paths[runs[0]], split_by=args.group_by,
+                    described=described),
+        univariate.fit_analyse_batch:
+            partial(univariate.update_fits, bps=bps, i_vars=univariate_vars,
+                    out_path=out_paths[runs[2]],
+                    min_max_params=min_max_params),
+        multivariate.fit_analyse:
+            partial(multivariate.update_fits, bps=["fev1_pp", "fev1_fvc"],
+                    out_path=out_paths[runs[2]], min_max_params=True),
+    }
+    if args.update:
+        for run in args.to_run:
+            for frame, func in analyses[run]:
+                if func.func not in updates:
+                    logger.warning(f"{tasks.Task(run, frame, func).name} "
+                                   "needs the whole cohort, it is not "
+                                   "updated")
+        analyses = {
+            run: [(frame, updates[func.func]) for frame, func in analyses[run]
+                  if func.func in updates]
+            for run in runs
+        }
+
+    # Every task reads the dataset, so all of them rerun when it changes,
+    # and the frames, so they rerun when other bps are normalised. Updates
+    # always run, their outputs depend on every batch so far.
+    graph = [
+        tasks.Task(run, frame, func, inputs=[args.in_file],
+                   context=bps if args.normalised else None)
+        for run in args.to_run for frame, func in analyses[run]
+    ]
+    todo = tasks.plan(graph, force=args.no_cache or args.update)
+
+    if args.dry_run:
+        for task in tasks.topological_order(graph):
+            status = "run" if task in todo else "up to date"
+            print(f"{status:<10}  {task.name}")
+        return
+    if not todo:
+        logger.info("All outputs are up to date")
+        return
+
+    # Only load the columns read by the tasks to run
+    columns = tasks.declared_columns([task.func for task in todo])
+    if columns is not None:
+        columns = HEALTH_COLUMNS + columns
+        if args.normalised:
+            columns += ["height"] + bps
+    data_all = apply_schema(load_dataset(args.in_file, columns))
+    data = get_group(data_all, args.health_stat)
+    if args.normalised:
+        data = normalise_bps(data, bps)
 
     # Run the analysis based on the desired run
+    frames = {"data": data, "data_all": data_all}
+    for run in args.to_run:
+        out_paths[run].mkdir(parents=True, exist_ok=True)
+
+    # Unchanged analyses reuse the artifacts of a previous run
+    cache = None
+    if not args.no_cache and not args.update:
+        cache_dir = args.cache_dir or Path(args.out_directory) / ".cache"
+        cache = ResultCache(cache_dir, args.cache_size * 2**20)
+
     for run in args.to_run:
-        logger.info(f"Running {run} analysis...")
-        out_path = main_out_dir / run
-        out_path.mkdir(parents=True, exist_ok=True)
-        run_funcs[run]()
+        count = sum(task.group == run for task in todo)
+        if count:
+            logger.info(f"Running {run} analysis ({count} tasks)...")
+    # Workers get the frames once at start-up, tasks only carry their args
+    tasks.run(todo,
+              _run_task,
+              jobs=args.jobs,
+              initializer=_init_worker,
+              initargs=(frames, cache))
+
+    if cache is not None:
+        cache.evict()
 
 
 if __name__ == "__main__":
@@ -141,5 +315,56 @@ if __name__ == "__main__":
     parser.add_argument("--normalised",
                         action="store_true",
                         help="Normalise parameters")
+    parser.add_argument("--clusters",
+                        type=int,
+                        default=4,
+                        help="Number of k-means clusters. Default: 4.")
+    parser.add_argument("--seed",
+                        type=int,
+                        default=0,
+                        help="Seed of the k-means clustering, the same seed "
+                        "gives the same clusters. Default: 0.")
+    parser.add_argument("--nomograms",
+                        action="store_true",
+                        help="Also draw the nomograms of the per-stratum "
+                        "fits in the visualisation run, needs TeX.")
+    parser.add_argument("--jobs",
+                        type=int,
+                        default=1,
+                        help="Worker processes for independent analyses. "
+                        "Default: 1 (serial).")
+    parser.add_argument("--shards",
+                        type=int,
+                        default=1,
+                        help="Split the participants into this many hash "
+                        "shards, computing the demographics and regressions "
+                        "from statistics merged across shards processed in "
+                        "parallel. Default: 1 (whole cohort in memory).")
+    parser.add_argument("--update",
+                        action="store_true",
+                        help="Treat in_file as a batch of new scans: merge "
+                        "its statistics into the accumulators saved in "
+                        "out_directory and regenerate the demographics and "
+                        "regression tables from them, without reading the "
+                        "earlier scans. The first update starts the "
+                        "accumulators.")
+    parser.add_argument("--no-cache",
+                        dest="no_cache",
+                        action="store_true",
+                        help="Recompute every analysis, ignoring cached results.")
+    parser.add_argument("--cache_dir",
+                        type=Path,
+                        default=None,
+                        help="Result cache location. "
+                        "Default: <out_directory>/.cache.")
+    parser.add_argument("--cache_size",
+                        type=int,
+                        default=500,
+                        help="Result cache size limit in MB. Default: 500.")
+    parser.add_argument("--dry-run",
+                        dest="dry_run",
+                        action="store_true",
+                        help="List the tasks and whether they would run, "
+                        "without running them.")
     args = parser.parse_args()
     main(args)
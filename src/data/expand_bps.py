@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from data.util.store import write_frame
+
+# Airway generations reported per bronchial parameter
+GENERATIONS = 9
+
+
+def parse_generations(df: pd.DataFrame, bp_cols: list) -> np.ndarray:
+    """
+    Parse semicolon delimited per-generation values into a float array.
+
+    Every column is split and converted in Arrow kernels over all its cells
+    at once, without a Python call per cell. Missing or empty generations
+    are NaN and generations past the ninth are ignored.
+
+    Parameters:
+    df (pd.DataFrame): Data holding the semicolon delimited columns.
+    bp_cols (list): Names of the columns to parse.
+
+    Returns:
+    np.ndarray: (participants, len(bp_cols), GENERATIONS) float array.
+    """
+    values = np.full((len(df), len(bp_cols), GENERATIONS), np.nan)
+    for i, bp in enumerate(bp_cols):
+        cells = pa.Array.from_pandas(df[bp])
+        # Columns holding a single generation are read as numbers
+        if not pa.types.is_string(cells.type):
+            cells = cells.cast(pa.string())
+        fields = pc.split_pattern(cells, ";")
+        text = pc.utf8_trim_whitespace(fields.flatten())
+        numbers = pc.if_else(pc.equal(text, ""), None, text).cast(pa.float64())
+        # Row and generation of every field, from the list offsets
+        rows = pc.list_parent_indices(fields).to_numpy()
+        offsets = fields.offsets.to_numpy()
+        gens = np.arange(len(text)) - offsets[rows]
+        keep = gens < GENERATIONS
+        values[rows[keep], i, gens[keep]] = numbers.to_numpy(
+            zero_copy_only=False)[keep]
+    return values
+
+
+def expand_bps(df: pd.DataFrame, bp_cols: list) -> pd.DataFrame:
+    """
+    Replace each semicolon delimited bronchial parameter column with one float
+    column per generation, named {bp}_0 to {bp}_8.
+
+    Parameters:
+    df (pd.DataFrame): Segmentation data with one row per participant.
+    bp_cols (list): Names of the semicolon delimited columns.
+
+    Returns:
+    pd.DataFrame: The other columns followed by the expanded columns, on the
+                  same rows as the input.
+    """
+    values = parse_generations(df, bp_cols)
+    columns = [f"{bp}_{gen}" for bp in bp_cols for gen in range(GENERATIONS)]
+    expanded = pd.DataFrame(values.reshape(len(df), -1),
+                            index=df.index,
+                            columns=columns)
+    return pd.concat([df.drop(columns=bp_cols), expanded], axis=1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Expand the per-generation bronchial parameters.")
+    parser.add_argument("in_file", type=Path, help="Segmentation csv.")
+    parser.add_argument("out_file", type=Path, help="Expanded feather destination.")
+    parser.add_argument("--bp_cols",
+                        type=str,
+                        default="bp_wap,bp_la,bp_wt,bp_ir,bp_or",
+                        help="Comma separated list of columns to expand.")
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.in_file, low_memory=False)
+    df = df.rename(columns={"participant_id": "patientID"})
+    write_frame(expand_bps(df, args.bp_cols.split(",")), args.out_file)
@@ -5,23 +5,26 @@ from pathlib import Path
 import numpy as np
 import pandas as pd
 
-df = pd.read_csv(sys.stdin, index_col=0)
+from data.util.constants import (PARTICIPANT_SOURCES, SMOKING_SOURCES,
+                                 FREQUENCY_SOURCES, DIAGNOSIS_SOURCES,
+                                 SYMPTOM_SOURCES, SPIROMETRY_SOURCES)
+from data.util.dataframe import coalesce_columns, derive_smoking_status
+from data.util.schema import (AGE_5YR_BINS, AGE_5YR_LABELS,
+                              AGE_10YR_BINS, AGE_10YR_LABELS,
+                              PACK_YEAR_LABELS, apply_schema)
+from data.util.store import read_frame, write_frame
+
+# The compact dtypes from the start, e.g. float32 per-generation parameters,
+# the labels and answers derived below are cast before saving
+df = apply_schema(read_frame(sys.argv[1]))
 outpath = Path("./data/interim/")
 
 # ------ PARTICIPANT CHARACTERISTICS
-# Fill in missing sex values, drop the other columns
-df['gender'].fillna(df['gender_first'].fillna(df['gender_first2']),
-                    inplace=True)
-df['gender'] = df['gender'].str.title()
+# Fill in missing sex, age, weight and length values, drop the other columns
 df['age_at_scan'].replace('#NUM!', np.nan, inplace=True)
-df['age_at_scan'].fillna(df['age'], inplace=True)
+df = coalesce_columns(df, PARTICIPANT_SOURCES)
+df['gender'] = df['gender'].str.title()
 df['age_at_scan'] = df['age_at_scan'].astype(float)
-df.drop(['age'], axis=1, inplace=True)
-df['weight_at_scan'].fillna(df['bodyweight_kg_all_m_1_max2'].fillna(
-    df['bodyweight_kg_all_m_1_max'].fillna(df['bodyweight_current_adu_q_1'])),
-                            inplace=True)
-df['length_at_scan'].fillna(df['bodylength_cm_all_m_1_max2'], inplace=True)
-df['length_at_scan'].fillna(df['bodylength_cm_all_m_1_max'], inplace=True)
 df['length_at_scan'] = df['length_at_scan'] / 100
 
 df = df.rename(
@@ -35,83 +38,25 @@ df = df.rename(
 # Calculate BMI
 df['bmi'] = df['weight'] / (df['height'])**2
 
-df.drop([
-    'gender_first', 'gender_first2', 'bodyweight_kg_all_m_1_max2',
-    'bodyweight_kg_all_m_1_max', 'bodyweight_current_adu_q_1',
-    'bodylength_cm_all_m_1_max2', 'bodylength_cm_all_m_1_max'
-],
-        axis=1,
-        inplace=True)
-
-# Calc mean BPs
-df['bp_wap_avg'] = df[['bp_wap_3', 'bp_wap_4', 'bp_wap_5']].mean(axis=1)
-df['bp_la_avg'] = df[['bp_la_3', 'bp_la_4', 'bp_la_5']].mean(axis=1)
-df['bp_wt_avg'] = df[['bp_wt_3', 'bp_wt_4', 'bp_wt_5']].mean(axis=1)
-df['bp_ir_avg'] = df[['bp_ir_3', 'bp_ir_4', 'bp_ir_5']].mean(axis=1)
-df['bp_or_avg'] = df[['bp_or_3', 'bp_or_4', 'bp_or_5']].mean(axis=1)
+# Calc mean BPs, in float64 as the statistics are computed on them
+for bp in ['bp_wap', 'bp_la', 'bp_wt', 'bp_ir', 'bp_or']:
+    df[f'{bp}_avg'] = df[[f'{bp}_3', f'{bp}_4', f'{bp}_5']].astype(
+        float).mean(axis=1)
 
 # Create age categories
-age_label_5 = [
-    '45-50', '50-55', '55-60', '60-65', '65-70', '70-75', '75-80',
-    '80+'
-]
-age_cut_5 = np.linspace(45, 80, 8)
-age_cut_5 = np.append(age_cut_5, 100)
-
 df['age_5yr'] = pd.cut(df['age'],
-                       bins=age_cut_5,
-                       labels=age_label_5,
+                       bins=AGE_5YR_BINS,
+                       labels=AGE_5YR_LABELS,
                        right=False)
 
-age_label_10 = ['45-54', '55-64', '65-74', '75-84', '85+']
-age_cut_10 = np.linspace(45, 85, 5)
-age_cut_10 = np.append(age_cut_10, 100)
-
 df['age_10yr'] = pd.cut(df['age'],
-                        bins=age_cut_10,
-                        labels=age_label_10,
+                        bins=AGE_10YR_BINS,
+                        labels=AGE_10YR_LABELS,
                         right=False)
 
 # ------ SMOKING
 # Smoking merge and fill
-df['never_smoker'] = df['never_smoker_adu_c_12'].fillna(
-    df['never_smoker_adu_c_1'].fillna(df['never_smoker_adu_c_12_2']))
-
-df['ever_smoker'] = df['ever_smoker_adu_c_22'].fillna(
-    df['ever_smoker_adu_c_2'].fillna(df['ever_smoker_adu_c_22_2'].fillna(
-        df['ever_smoker_adu_c_22_3'].fillna(df['ever_smoker_adu_c_22_4']))))
-
-df['current_smoker'] = df['current_smoker_adu_c_22'].fillna(
-    df['current_smoker_adu_c_2'].fillna(df['current_smoker_adu_c_22_2'].fillna(
-        df['current_smoker_adu_c_22_3'].fillna(
-            df['current_smoker_adu_c_22_4']))))
-
-df['ex_smoker'] = df['ex_smoker_adu_c_22'].fillna(
-    df['ex_smoker_adu_c_2'].fillna(df['ex_smoker_adu_c_22_2'].fillna(
-        df['ex_smoker_adu_c_22_3'].fillna(df['ex_smoker_adu_c_22_4']))))
-
-df['pack_years'] = df['packyears_cumulative_adu_c_22'].fillna(
-    df['packyears_cumulative_adu_c_2'].fillna(
-        df['packyears_cumulative_adu_c_22_2'].fillna(
-            df['packyears_cumulative_adu_c_22_3'].fillna(
-                df['packyears_cumulative_adu_c_22_4']))))
-
-df['smoking_end-age'] = df['smoking_endage_adu_c_22'].fillna(
-    df['smoking_endage_adu_c_2'].fillna(df['smoking_endage_adu_c_22_2'].fillna(
-        df['smoking_endage_adu_c_22_3'].fillna(
-            df['smoking_endage_adu_c_22_4']))))
-
-df['smoking_start-age'] = df['smoking_startage_adu_c_22'].fillna(
-    df['smoking_startage_adu_c_2'].fillna(
-        df['smoking_startage_adu_c_22_2'].fillna(
-            df['smoking_startage_adu_c_22_3'].fillna(
-                df['smoking_startage_adu_c_22_4']))))
-
-df['smoking_duration'] = df['smoking_duration_adu_c_22'].fillna(
-    df['smoking_duration_adu_c_2'].fillna(
-        df['smoking_duration_adu_c_22_2'].fillna(
-            df['smoking_duration_adu_c_22_3'].fillna(
-                df['smoking_duration_adu_c_22_4']))))
+df = coalesce_columns(df, SMOKING_SOURCES)
 
 # Calculate missing pack years
 duration = df['smoking_end-age'].fillna(df['age']) - df['smoking_start-age']
@@ -138,102 +83,46 @@ df['max_other_freq'] = df[[
 df['total_freq_calc'] = df['max_cig_freq'] + df['max_ciga_freq'] + df[
     'max_cigar_freq'] + df['max_other_freq']
 
-df['total_frequency'] = df['total_frequency_adu_c_12'].fillna(
-    df['total_frequency_adu_c_1'].fillna(df['total_freq_calc']))
+df = coalesce_columns(df, FREQUENCY_SOURCES)
 
 df.loc[df.total_frequency == 0, 'total_frequency'] = np.nan
 
 df['pack_years_calc'] = df['smoking_duration'] * df['total_frequency'] / 20
 df['pack_years'].fillna(df['pack_years_calc'], inplace=True)
 
-# Fill never smoker = False if any of the others is True
-df.loc[df.never_smoker.isna() & (~df.current_smoker.isna() & df.current_smoker)
-       | (df.ever_smoker.notna() & df.ever_smoker) |
-       (df.ex_smoker.notna() & df.ex_smoker), ['never_smoker']] = False
-
-# Fill never smoker = True if ALL the others are False
-try:
-    df.loc[(df.never_smoker.isna() & df.current_smoker.notna()
-            & df.ever_smoker.notna() & df.ex_smoker.notna()) &
-           (~df.current_smoker & ~df.ex_smoker & ~df.ever_smoker),
-           ['never_smoker']] = True
-except TypeError:
-    print("All values False for smoking status, filling Never Smoker as True")
-    df.loc[(df.never_smoker.isna() & df.current_smoker.notna()
-            & df.ever_smoker.notna() & df.ex_smoker.notna()),
-           ['never_smoker']] = True
-
-
-# Create "smoking_status" variable for easier separation
-def get_smoking_status(row):
-    if row["current_smoker"] is True:
-        return "current_smoker"
-    if row["ex_smoker"] is True:
-        return "ex_smoker"
-    if row["never_smoker"] is True:
-        return "never_smoker"
-    else:
-        return None
-
-
-df["smoking_status"] = df.apply(get_smoking_status, axis=1)
+# Resolve never/ex/current smoker into smoking_status for easier separation
+df = derive_smoking_status(df)
 
 # Split pack-years to categories
-py_labels = ['0', '1-10', '10-20', '20+']
 py_categories = [-5, 0, 10, 20, 100]
 
 df['pack_year_categories'] = pd.cut(df['pack_years'],
                                     bins=py_categories,
-                                    labels=py_labels,
+                                    labels=PACK_YEAR_LABELS,
                                     right=False)
 df['pack_year_categories'].fillna("0", inplace=True)
 
 df.drop([
-    'ever_smoker_adu_c_2', 'ever_smoker_adu_c_22', 'ever_smoker_adu_c_22_2',
-    'ever_smoker_adu_c_22_3', 'ever_smoker_adu_c_22_4', 'never_smoker_adu_c_1',
-    'never_smoker_adu_c_12', 'never_smoker_adu_c_12_2',
-    'current_smoker_adu_c_2', 'current_smoker_adu_c_22',
-    'current_smoker_adu_c_22_2', 'current_smoker_adu_c_22_3',
-    'current_smoker_adu_c_22_4', 'ex_smoker_adu_c_2', 'ex_smoker_adu_c_22',
-    'ex_smoker_adu_c_22_2', 'ex_smoker_adu_c_22_3', 'ex_smoker_adu_c_22_4',
-    'packyears_cumulative_adu_c_2', 'packyears_cumulative_adu_c_22',
-    'packyears_cumulative_adu_c_22_2', 'packyears_cumulative_adu_c_22_3',
-    'packyears_cumulative_adu_c_22_4', 'smoking_endage_adu_c_2',
-    'smoking_endage_adu_c_22', 'smoking_endage_adu_c_22_2',
-    'smoking_endage_adu_c_22_3', 'smoking_endage_adu_c_22_4',
-    'smoking_duration_adu_c_2', 'smoking_duration_adu_c_22',
-    'smoking_duration_adu_c_22_2', 'smoking_duration_adu_c_22_3',
-    'smoking_duration_adu_c_22_4', 'cigarettes_frequency_adu_q_1',
-    'cigarettes_frequency_adu_q_1_a', 'cigarettes_frequency_adu_c_2',
-    'cigars_frequency_adu_q_1_a', 'cigars_frequency_adu_q_1',
-    'cigars_frequency_adu_c_2', 'cigarillos_frequency_adu_q_1_a',
-    'cigarillos_frequency_adu_q_1', 'cigarillos_frequency_adu_c_2',
-    'pipetobacco_frequency_adu_q_1_a', 'pipetobacco_frequency_adu_q_1',
-    'pipetobacco_frequency_adu_c_2', 'total_frequency_adu_c_1',
-    'total_frequency_adu_c_12', 'smoking_startage_adu_c_2',
-    'smoking_startage_adu_c_22', 'smoking_startage_adu_c_22_2',
-    'smoking_startage_adu_c_22_3', 'smoking_startage_adu_c_22_4',
+    'cigarettes_frequency_adu_q_1', 'cigarettes_frequency_adu_q_1_a',
+    'cigarettes_frequency_adu_c_2', 'cigars_frequency_adu_q_1_a',
+    'cigars_frequency_adu_q_1', 'cigars_frequency_adu_c_2',
+    'cigarillos_frequency_adu_q_1_a', 'cigarillos_frequency_adu_q_1',
+    'cigarillos_frequency_adu_c_2', 'pipetobacco_frequency_adu_q_1_a',
+    'pipetobacco_frequency_adu_q_1', 'pipetobacco_frequency_adu_c_2',
     'max_other_freq', 'max_cigar_freq', 'max_ciga_freq', 'max_cig_freq',
-    'total_freq_calc', 'pack_years_calc'
+    'pack_years_calc'
 ],
         axis=1,
         inplace=True)
 
 # ------ RESPIRATORY DISEASE
-df['copd_diagnosis'] = df['copd_presence_adu_q_2'].fillna(
-    df['copd_presence_adu_q_1'].fillna(
-        df['spirometry_copd_all_q_1_max'].fillna(df['elon_copd_adu_q_13'])))
+df = coalesce_columns(df, DIAGNOSIS_SOURCES)
 
-df['asthma_diagnosis'] = df['asthma_diagnosis_adu_q_1'].fillna(
-    df['spirometry_astma_all_q_1_max'].fillna(
-        df['spirometry_astma_all_q_1_max2'].fillna(
-            df['elon_asthma_adu_q_06'])))
+# Answer codes 1 (yes) and 2 (no), any other code is unanswered
+answers = {1: True, 2: False}
+df['copd_diagnosis'] = df['copd_diagnosis'].map(answers).astype('boolean')
 
-df['cancer_type'] = df['cancer_type_adu_q_1'].fillna(df['cancer_type_adu_q_2'])
-
-df['copd_diagnosis'].replace([1, 2], ['True', 'False'], inplace=True)
-
-df['asthma_diagnosis'].replace([1, 2], ['True', 'False'], inplace=True)
+df['asthma_diagnosis'] = df['asthma_diagnosis'].map(answers).astype('boolean')
 
 df['breathing_problems_adu_q_1'].replace([1, 2], ['BREATHING', 'False'],
                                          inplace=True)
@@ -246,42 +135,15 @@ df['wheezing_presence_adu_q_1'].replace([1, 2], ['WHEEZE', 'False'],
 
 df['elon_wheeze_adu_q_01'].replace([1, 2], ['WHEEZE', 'False'], inplace=True)
 
-df['resp_other'] = df['wheezing_presence_adu_q_1'].fillna(
-    df['elon_wheeze_adu_q_01'].fillna(df['coughing_presence_adu_q_1'].fillna(
-        df['breathing_problems_adu_q_1'])))
-
-df.drop([
-    'copd_presence_adu_q_1', 'copd_presence_adu_q_2',
-    'spirometry_copd_all_q_1_max', 'spirometry_astma_all_q_1_max',
-    'spirometry_astma_all_q_1_max2', 'elon_copd_adu_q_13',
-    'elon_asthma_adu_q_06', 'asthma_diagnosis_adu_q_1', 'cancer_type_adu_q_1',
-    'cancer_type_adu_q_2', 'breathing_problems_adu_q_1',
-    'coughing_presence_adu_q_1', 'wheezing_presence_adu_q_1',
-    'elon_wheeze_adu_q_01'
-],
-        inplace=True,
-        axis=1)
+df = coalesce_columns(df, SYMPTOM_SOURCES)
 
 # ------ SPIROMETRY
-df['fev1'] = df['spirometry_fev1_all_m_1_max2'].fillna(
-    df['spirometry_fev1_all_m_1_max'])
-
-df['fvc'] = df['spirometry_fvc_all_m_1_max2'].fillna(
-    df['spirometry_fvc_all_m_1_max'])
-
-df['fev1_pp'] = df['fev1_percpredicted_all_c_1_max2'].fillna(
-    df['fev1_percpredicted_all_c_1_max'])
-
-df['fev1fvc_lln'] = df['fev1fvc_lowerlimit_all_c_1_max2'].fillna(
-    df['fev1fvc_lowerlimit_all_c_1_max'])
+df = coalesce_columns(df, SPIROMETRY_SOURCES)
 
 df['fev1_fvc'] = df.fev1 / df.fvc
 
+# Unused lower limits
 df.drop([
-    'spirometry_fev1_all_m_1_max2', 'spirometry_fev1_all_m_1_max',
-    'spirometry_fvc_all_m_1_max', 'spirometry_fvc_all_m_1_max2',
-    'fev1_percpredicted_all_c_1_max2', 'fev1_percpredicted_all_c_1_max',
-    'fev1fvc_lowerlimit_all_c_1_max2', 'fev1fvc_lowerlimit_all_c_1_max',
     'fev1_lowerlimit_all_c_1_max2', 'fev1_lowerlimit_all_c_1_max',
     'fvc_lowerlimit_all_c_1_max2', 'fvc_lowerlimit_all_c_1_max'
 ],
@@ -310,5 +172,6 @@ df.loc[df.bp_segmental_score == -1, 'bp_segmental_score'] = np.nan
 df.loc[df.bp_subsegmental_score == -1, 'bp_subsegmental_score'] = np.nan
 
 # ------ SAVE DF
-df = df.round(3)
-df.to_csv(str(outpath / "bp_db_all.csv"))
+# Cast the labels and answers derived above
+df = apply_schema(df.round(3))
+write_frame(df, outpath / "bp_db_all.feather")
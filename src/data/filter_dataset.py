@@ -1,10 +1,19 @@
 #!/usr/bin/env python
 
-import sys
+import argparse
 from pathlib import Path
-import pandas as pd
 
-df = pd.read_csv(sys.stdin, index_col=0)
+from data.util.schema import apply_schema
+from data.util.store import read_frame, write_frame
+
+parser = argparse.ArgumentParser(description="Filter the merged dataset.")
+parser.add_argument("in_file", type=Path, help="Merged feather file.")
+parser.add_argument("--csv",
+                    action="store_true",
+                    help="Also export the final dataset as csv.")
+args = parser.parse_args()
+
+df = apply_schema(read_frame(args.in_file))
 df = df[~df.index.duplicated(keep="first")]
 outpath = Path("./data/processed/")
 print(df.bp_pi10.describe())
@@ -21,7 +30,10 @@ sizes["screened"] = sizes["total"] - sizes["error"] - len(df)
 sizes["missing-shx"] = len(df[df.smoking_status.isna()])
 df = df.dropna(subset=["smoking_status"])
 # ------ SAVE DF
-df.to_csv(str(outpath / "final_bp_db.csv"))
+# patientID is stored as a column, as analyse.py reads it
+write_frame(df.reset_index(), outpath / "final_bp_db.feather")
+if args.csv:
+    df.to_csv(str(outpath / "final_bp_db.csv"))
 
 print(f"Removed:\n {sizes}")
 
@@ -14,38 +14,36 @@ SEG_CSV=final_bp_list.csv
 VAR_FILTER=$(VPATH)variable_filter_list.txt
 
 # Interim Data
-CSV_FILES=$(patsubst %.sav,$(DINT)%.csv,$(SPSS_FILES))
-SPLT_CSV=$(DINT)formatted_bp_data.csv
-MRG_CSV=$(DINT)data_merged.csv
+SAV_FILES=$(patsubst %.sav,$(DINT)%.feather,$(SPSS_FILES))
+SPLT_BPS=$(DINT)formatted_bp_data.feather
 FILT_TAC=$(VPATH)filtered_tac.csv
-BP_FILT_CSV=$(DINT)bp_db_filtered.csv
-BP_ALL_CSV=$(DINT)bp_db_all.csv
+BP_FILT=$(DINT)bp_db_filtered.feather
+BP_ALL=$(DINT)bp_db_all.feather
+
+# Also write the final dataset as csv
+EXPORT_CSV ?= false
+ifeq ($(EXPORT_CSV),true)
+	CSV_FLAG=--csv
+endif
 
 # Lists of Variables
 BP_COLS=bp_wap,bp_la,bp_wt,bp_ir,bp_or
-# Convert the list of variables in the variable_filter_list.txt file into a string
-DB_COLS := $(shell cat $(VAR_FILTER) | tr '\n' ',' | sed 's/,$$//')
 
 all: $(BP_FINAL)
 	echo "Done"
 
-$(BP_FINAL): $(BP_FILT_CSV)
-	< $< ./src/data/fill_and_merge.py
-	< $(BP_ALL_CSV) ./src/data/filter_dataset.py
-
-$(BP_FILT_CSV): $(MRG_CSV)
-	< $< csvcut -c $(DB_COLS) > $@
+$(BP_FINAL): $(BP_FILT)
+	./src/data/fill_and_merge.py $<
+	./src/data/filter_dataset.py $(BP_ALL) $(CSV_FLAG)
 
-# Merge all CSV files into one using the patientID as an index
-$(MRG_CSV): $(SPLT_CSV) $(CSV_FILES) $(IMA_CSV) $(FILT_TAC)
-	csvjoin --left -c patientID $^ > $@
+# Left join all sources on patientID, keeping the variables in VAR_FILTER
+$(BP_FILT): $(SPLT_BPS) $(SAV_FILES) $(IMA_CSV) $(FILT_TAC) $(VAR_FILTER)
+	./src/data/merge_sources.py $@ $(VAR_FILTER) $(filter-out $(VAR_FILTER),$^)
 
 # Expand the semicolon delim'd bps and change participant_id to patientID
-$(SPLT_CSV): $(SEG_CSV)
-	csvjoin <(csvcut -C $(BP_COLS) $< | sed 's/participant_id/patientID/') <(csvcut -c $(BP_COLS) $< | awk -f ./src/data/expand_bps.awk) > $@
-
-# Convert the SPSS files into CSV files
-$(CSV_FILES): $(DINT)%.csv : %.sav
-	pspp-convert $< $@_nonan.csv
-	# Replace $$5, $$6, $$7 with nan
-	sed 's/\$$[0-9]//g' $@_nonan.csv | csvsort -c patientID > $@
+$(SPLT_BPS): $(SEG_CSV)
+	./src/data/expand_bps.py $< $@ --bp_cols $(BP_COLS)
+
+# Read the filtered variables of the SPSS files into feather, in parallel
+$(SAV_FILES) &: $(SPSS_FILES) $(VAR_FILTER)
+	./src/data/read_spss.py $(DINT) $(VAR_FILTER) $(filter %.sav,$^)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+import argparse
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+
+from data.util.store import FEATHER_SUFFIX, write_frame
+
+KEY = "patientID"
+
+
+def read_variable_list(path: Path) -> list:
+    """
+    Read the names of the variables to keep, one per line.
+    """
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def patient_key(ids: pd.Series) -> pd.Series:
+    """
+    Normalise patient IDs so the same participant matches across sources,
+    whether a file stored the ID as an integer, a float or text.
+    """
+    try:
+        return pd.to_numeric(ids).astype("Int64")
+    except (ValueError, TypeError):
+        return ids.astype(str)
+
+
+def read_header(source: Path) -> list:
+    """
+    Read the column names of a csv or feather source.
+    """
+    if Path(source).suffix == FEATHER_SUFFIX:
+        with pa.memory_map(str(source), "r") as f:
+            return pa.ipc.open_file(f).schema.names
+    return list(pd.read_csv(source, nrows=0).columns)
+
+
+def read_source(source: Path, columns: list) -> pd.DataFrame:
+    """
+    Read the given columns of a csv or feather source.
+    """
+    if Path(source).suffix == FEATHER_SUFFIX:
+        return pd.read_feather(source, columns=columns)
+    return pd.read_csv(source, usecols=columns, low_memory=False)
+
+
+def plan_columns(sources: list, variables: list) -> dict:
+    """
+    Assign every requested variable to the first source containing it, as
+    selecting it from the joined table would.
+
+    Parameters:
+    sources (list): Paths of the csv or feather sources, in join order.
+    variables (list): Names of the variables to keep.
+
+    Returns:
+    dict: The columns to read from each source, in variable list order.
+
+    Raises:
+    ValueError: If a variable is not found in any source.
+    """
+    wanted = [var for var in variables if var != KEY]
+    plan = {}
+    for source in sources:
+        header = read_header(source)
+        if KEY not in header:
+            raise ValueError(f"{source} has no {KEY} column")
+        plan[source] = [var for var in wanted if var in header]
+        wanted = [var for var in wanted if var not in header]
+    if wanted:
+        raise ValueError(f"Variables not found in any source: {wanted}")
+    return plan
+
+
+def merge_sources(sources: list, variables: list) -> pd.DataFrame:
+    """
+    Left join csv or feather sources on patientID, keeping only the listed variables.
+
+    Each source is parsed once with only its planned columns, then joined
+    on its patientID index onto the first source.
+
+    Parameters:
+    sources (list): Paths of the sources. The first is the left table.
+    variables (list): Names of the variables to keep.
+
+    Returns:
+    pd.DataFrame: The merged data indexed by patientID, with the columns in
+                  variable list order.
+    """
+    plan = plan_columns(sources, variables)
+    merged = None
+    for source, columns in plan.items():
+        df = read_source(source, [KEY] + columns)
+        df[KEY] = patient_key(df[KEY])
+        df = df.set_index(KEY)
+        merged = df if merged is None else merged.join(df, how="left")
+    order = [var for var in variables if var != KEY]
+    return merged[order]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Merge the source files on patientID.")
+    parser.add_argument("out_file", type=Path, help="Merged feather destination.")
+    parser.add_argument("var_filter",
+                        type=Path,
+                        help="File listing the variables to keep.")
+    parser.add_argument("sources",
+                        type=Path,
+                        nargs="+",
+                        help="Source csv or feather files, the first is the left table.")
+    args = parser.parse_args()
+
+    df = merge_sources(args.sources, read_variable_list(args.var_filter))
+    write_frame(df, args.out_file)
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+import argparse
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyreadstat
+
+from data.merge_sources import KEY, read_variable_list
+
+logger = logging.getLogger("BronchialParameters")
+
+
+def project_columns(sav_path: Path, variables: list) -> list:
+    """
+    Select the listed variables present in an SPSS file from its metadata,
+    without reading any of its data.
+
+    Parameters:
+    sav_path (Path): The SPSS file.
+    variables (list): Names of the variables to keep.
+
+    Returns:
+    list: patientID followed by the listed variables found in the file.
+
+    Raises:
+    ValueError: If the file has no patientID variable.
+    """
+    _, meta = pyreadstat.read_sav(str(sav_path), metadataonly=True)
+    if KEY not in meta.column_names:
+        raise ValueError(f"{sav_path} has no {KEY} variable")
+    header = set(meta.column_names)
+    return [KEY] + [var for var in variables if var != KEY and var in header]
+
+
+def read_spss(sav_path: Path, variables: list) -> pd.DataFrame:
+    """
+    Read the listed variables of an SPSS file, sorted by patientID.
+
+    User defined missing value codes are read as NaN by pyreadstat and empty
+    strings are set to NaN, as an empty csv field would be.
+
+    Parameters:
+    sav_path (Path): The SPSS file.
+    variables (list): Names of the variables to keep.
+
+    Returns:
+    pd.DataFrame: The typed data with a default index.
+    """
+    columns = project_columns(sav_path, variables)
+    df, _ = pyreadstat.read_sav(str(sav_path),
+                                usecols=columns,
+                                user_missing=False)
+    strings = df.columns[df.dtypes == object]
+    df[strings] = df[strings].replace("", np.nan)
+    return df[columns].sort_values(KEY, kind="stable", ignore_index=True)
+
+
+def convert(sav_path: Path, out_dir: Path, variables: list) -> Path:
+    """
+    Write the listed variables of an SPSS file to out_dir as feather.
+    """
+    out_file = out_dir / Path(sav_path).with_suffix(".feather").name
+    df = read_spss(sav_path, variables)
+    df.to_feather(out_file, compression="uncompressed")
+    logger.info(f"Read {df.shape[1]} variables of {sav_path} into {out_file}")
+    return out_file
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Read the listed variables of SPSS files into feather.")
+    parser.add_argument("out_dir", type=Path, help="Output directory.")
+    parser.add_argument("var_filter",
+                        type=Path,
+                        help="File listing the variables to keep.")
+    parser.add_argument("sav_files", type=Path, nargs="+", help="SPSS files.")
+    parser.add_argument("--jobs",
+                        type=int,
+                        default=os.cpu_count(),
+                        help="Number of files read in parallel.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    variables = read_variable_list(args.var_filter)
+    args.out_dir.mkdir(parents=True, exist_ok=True)
+    workers = max(1, min(args.jobs, len(args.sav_files)))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for _ in pool.map(
+                partial(convert, out_dir=args.out_dir, variables=variables),
+                args.sav_files):
+            pass
@@ -0,0 +1,143 @@
+import hashlib
+import inspect
+import logging
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+import pandas as pd
+
+logger = logging.getLogger("BronchialParameters")
+
+# Keyword arguments naming the directory an analysis writes its artifacts to
+OUT_KEYS = ("out_path", "out_dir")
+TMP_PREFIX = ".tmp-"
+
+
+def frame_hash(df: pd.DataFrame) -> str:
+    """
+    Hash the contents of a DataFrame, including its index, column names and
+    dtypes.
+
+    Parameters:
+    df (pd.DataFrame): The DataFrame to hash.
+
+    Returns:
+    str: The sha256 hex digest of the DataFrame.
+    """
+    digest = hashlib.sha256()
+    digest.update(repr(list(zip(df.columns, df.dtypes.astype(str)))).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+    return digest.hexdigest()
+
+
+def file_hash(path: Path, chunk_size: int = 1 << 20) -> str:
+    """
+    Hash the contents of a file, reading it in chunks.
+
+    Parameters:
+    path (Path): The file to hash.
+    chunk_size (int): Bytes read at a time.
+
+    Returns:
+    str: The sha256 hex digest of the file.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _out_key(func) -> str:
+    for key in OUT_KEYS:
+        if key in func.keywords:
+            return key
+    raise ValueError(f"{func.func.__name__} has no output directory argument")
+
+
+def _dir_size(path: Path) -> int:
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+
+
+class ResultCache:
+    """
+    Content-addressed store of the artifacts written by an analysis.
+
+    An analysis is a functools.partial taking the data as its only positional
+    argument and writing its files under an out_path (or out_dir) keyword.
+    Its key hashes the data, the function's name and module source, and every
+    other keyword argument, so a change to any of them is a miss. Changes to
+    modules the function calls into are not part of the key.
+    """
+
+    def __init__(self, cache_dir: Path, max_bytes: int):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def key(self, func, data_hash: str) -> str:
+        target = func.func
+        out_key = _out_key(func)
+        args = sorted((k, v) for k, v in func.keywords.items() if k != out_key)
+        digest = hashlib.sha256()
+        digest.update(data_hash.encode())
+        digest.update(Path(inspect.getfile(target)).read_bytes())
+        digest.update(
+            repr((target.__module__, target.__qualname__, func.args,
+                  args)).encode())
+        return digest.hexdigest()
+
+    def run(self, func, data: pd.DataFrame, data_hash: str):
+        """
+        Copy the cached artifacts of func into its output directory, or run
+        func and cache what it writes.
+        """
+        out_key = _out_key(func)
+        out_dir = Path(func.keywords[out_key])
+        entry = self.cache_dir / self.key(func, data_hash)
+
+        if entry.is_dir():
+            try:
+                # Plain copies, so the restored files are newer than the inputs
+                shutil.copytree(entry,
+                                out_dir,
+                                copy_function=shutil.copy,
+                                dirs_exist_ok=True)
+                os.utime(entry)
+                logger.info(f"Reusing cached {func.func.__name__} results")
+                return
+            except FileNotFoundError:
+                # Evicted while being read, recompute it
+                pass
+
+        # Write into a scratch directory so exactly this call's files are
+        # cached, then publish the entry with an atomic rename
+        tmp_dir = Path(tempfile.mkdtemp(prefix=TMP_PREFIX, dir=self.cache_dir))
+        try:
+            func(data, **{out_key: tmp_dir})
+            shutil.copytree(tmp_dir, out_dir, dirs_exist_ok=True)
+            try:
+                os.rename(tmp_dir, entry)
+            except OSError:
+                # Another process cached the same entry first
+                pass
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits in
+        max_bytes.
+        """
+        entries = [(entry.stat().st_mtime, _dir_size(entry), entry)
+                   for entry in self.cache_dir.iterdir()
+                   if entry.is_dir() and not entry.name.startswith(TMP_PREFIX)]
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+            logger.debug(f"Evicted {entry.name} from the result cache")
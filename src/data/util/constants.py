@@ -1,2 +1,96 @@
 SCANS_PROCESSED = 12041 # Number of scans that were processed with AirFlow
 MISSING_SHX = 47 # Number of scans that were missing smoking history
+
+# Columns filled from the first non-missing value of an ordered list of source
+# columns (see dataframe.coalesce_columns). Sources are dropped once merged, so
+# a new questionnaire wave only needs its columns added here.
+PARTICIPANT_SOURCES = {
+    'gender': ['gender', 'gender_first', 'gender_first2'],
+    'age_at_scan': ['age_at_scan', 'age'],
+    'weight_at_scan': [
+        'weight_at_scan', 'bodyweight_kg_all_m_1_max2',
+        'bodyweight_kg_all_m_1_max', 'bodyweight_current_adu_q_1'
+    ],
+    'length_at_scan': [
+        'length_at_scan', 'bodylength_cm_all_m_1_max2',
+        'bodylength_cm_all_m_1_max'
+    ],
+}
+
+SMOKING_SOURCES = {
+    'never_smoker': [
+        'never_smoker_adu_c_12', 'never_smoker_adu_c_1',
+        'never_smoker_adu_c_12_2'
+    ],
+    'ever_smoker': [
+        'ever_smoker_adu_c_22', 'ever_smoker_adu_c_2', 'ever_smoker_adu_c_22_2',
+        'ever_smoker_adu_c_22_3', 'ever_smoker_adu_c_22_4'
+    ],
+    'current_smoker': [
+        'current_smoker_adu_c_22', 'current_smoker_adu_c_2',
+        'current_smoker_adu_c_22_2', 'current_smoker_adu_c_22_3',
+        'current_smoker_adu_c_22_4'
+    ],
+    'ex_smoker': [
+        'ex_smoker_adu_c_22', 'ex_smoker_adu_c_2', 'ex_smoker_adu_c_22_2',
+        'ex_smoker_adu_c_22_3', 'ex_smoker_adu_c_22_4'
+    ],
+    'pack_years': [
+        'packyears_cumulative_adu_c_22', 'packyears_cumulative_adu_c_2',
+        'packyears_cumulative_adu_c_22_2', 'packyears_cumulative_adu_c_22_3',
+        'packyears_cumulative_adu_c_22_4'
+    ],
+    'smoking_end-age': [
+        'smoking_endage_adu_c_22', 'smoking_endage_adu_c_2',
+        'smoking_endage_adu_c_22_2', 'smoking_endage_adu_c_22_3',
+        'smoking_endage_adu_c_22_4'
+    ],
+    'smoking_start-age': [
+        'smoking_startage_adu_c_22', 'smoking_startage_adu_c_2',
+        'smoking_startage_adu_c_22_2', 'smoking_startage_adu_c_22_3',
+        'smoking_startage_adu_c_22_4'
+    ],
+    'smoking_duration': [
+        'smoking_duration_adu_c_22', 'smoking_duration_adu_c_2',
+        'smoking_duration_adu_c_22_2', 'smoking_duration_adu_c_22_3',
+        'smoking_duration_adu_c_22_4'
+    ],
+}
+
+# Reported frequency, falling back to the sum of the per-product maxima
+FREQUENCY_SOURCES = {
+    'total_frequency': [
+        'total_frequency_adu_c_12', 'total_frequency_adu_c_1',
+        'total_freq_calc'
+    ],
+}
+
+DIAGNOSIS_SOURCES = {
+    'copd_diagnosis': [
+        'copd_presence_adu_q_2', 'copd_presence_adu_q_1',
+        'spirometry_copd_all_q_1_max', 'elon_copd_adu_q_13'
+    ],
+    'asthma_diagnosis': [
+        'asthma_diagnosis_adu_q_1', 'spirometry_astma_all_q_1_max',
+        'spirometry_astma_all_q_1_max2', 'elon_asthma_adu_q_06'
+    ],
+    'cancer_type': ['cancer_type_adu_q_1', 'cancer_type_adu_q_2'],
+}
+
+SYMPTOM_SOURCES = {
+    'resp_other': [
+        'wheezing_presence_adu_q_1', 'elon_wheeze_adu_q_01',
+        'coughing_presence_adu_q_1', 'breathing_problems_adu_q_1'
+    ],
+}
+
+SPIROMETRY_SOURCES = {
+    'fev1': ['spirometry_fev1_all_m_1_max2', 'spirometry_fev1_all_m_1_max'],
+    'fvc': ['spirometry_fvc_all_m_1_max2', 'spirometry_fvc_all_m_1_max'],
+    'fev1_pp': [
+        'fev1_percpredicted_all_c_1_max2', 'fev1_percpredicted_all_c_1_max'
+    ],
+    'fev1fvc_lln': [
+        'fev1fvc_lowerlimit_all_c_1_max2', 'fev1fvc_lowerlimit_all_c_1_max'
+    ],
+}
@@ -1,5 +1,11 @@
+import numpy as np
 import pandas as pd
 
+from .schema import CATEGORIES
+
+# Columns get_group needs to tell healthy participants apart
+HEALTH_COLUMNS = ["GOLD_stage", "copd_diagnosis", "asthma_diagnosis", "cancer_type"]
+
 
 def get_group(df, group: str="healthy"):
     """
@@ -14,22 +20,25 @@ def get_group(df, group: str="healthy"):
                       individuals who meet the filter criteria
     """
 
+    # Unanswered diagnoses are missing from nullable booleans, not False,
+    # so the combined mask is filled before it is used for indexing
     healthy_mask = (
         (df.GOLD_stage == "0")
         & (df.copd_diagnosis == False)
         & (df.asthma_diagnosis == False)
         & (df.cancer_type != "LONGKANKER")
         & (df.cancer_type != "BORST LONG")
-    )
+    ).fillna(False).astype(bool)
 
     if group == "healthy":
         df_group = df[healthy_mask]
     elif group == "unhealthy":
         df_group = df[~healthy_mask]
     elif group == "all":
-        df["healthy"] = healthy_mask
-        df["healthy"].replace({True: "healthy", False: "unhealthy"}, inplace=True)
-        df_group = df
+        # Shallow copy so the label column is not added to the caller's frame
+        df_group = df.copy(deep=False)
+        df_group["healthy"] = healthy_mask.map(
+            {True: "healthy", False: "unhealthy"}).astype(CATEGORIES["healthy"])
     else:
         raise ValueError("Invalid group name: " + group)
 
@@ -51,18 +60,97 @@ def normalise_bps(df: pd.DataFrame, bps: list, norm_to: str = "height") -> pd.Da
     Returns
     -------
     pandas.DataFrame
-        A new pandas dataframe with the normalized bps data.
+        A new pandas dataframe with the normalized bps data. Columns other
+        than bps are shared with the input, which is left unchanged.
     """
     # Calculate the normalization factor
     norm_factor = df[norm_to]
 
-    # Normalize the bps data
+    # Normalize the bps data, replacing whole columns so the input is untouched
+    df = df.copy(deep=False)
     for bp in bps:
         df[bp] = df[bp] / norm_factor
 
     return df
 
 
+def coalesce_columns(df: pd.DataFrame, spec: dict,
+                     drop: bool = True) -> pd.DataFrame:
+    """
+    Fill each target column with the first non-missing value across an
+    ordered list of source columns, as a chain of nested fillna calls.
+
+    Parameters:
+    df (pandas.DataFrame): The DataFrame containing the source columns
+    spec (dict): Maps each target column to its source columns, in order of
+                 preference. A target may list itself first to keep its own
+                 values where present
+    drop (bool): Whether to drop the source columns that are not themselves
+                 targets. Default: True
+
+    Returns:
+    pandas.DataFrame: A new DataFrame with the coalesced columns. Other
+                      columns are shared with the input, which is left
+                      unchanged
+    """
+    df = df.copy(deep=False)
+    for target, sources in spec.items():
+        # Backfill across the block of sources, the first column then holds
+        # the first non-missing value
+        df[target] = df[sources].bfill(axis=1).iloc[:, 0]
+
+    if drop:
+        merged = {source for sources in spec.values()
+                  for source in sources} - set(spec)
+        df = df.drop(columns=[col for col in df.columns if col in merged])
+
+    return df
+
+
+def derive_smoking_status(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Resolve the never/ever/current/ex smoker answers into one
+    smoking_status label, with masks on nullable booleans instead of a
+    per-row apply. Unanswered questions stay <NA>.
+
+    Parameters:
+    df (pandas.DataFrame): The DataFrame containing the never_smoker,
+                           ever_smoker, current_smoker and ex_smoker answers
+
+    Returns:
+    pandas.DataFrame: A new DataFrame with the answers as nullable booleans,
+                      never_smoker filled in where the other answers settle
+                      it, and the "current_smoker", "ex_smoker" or
+                      "never_smoker" label in smoking_status, None if
+                      unknown. The input is left unchanged
+    """
+    df = df.copy(deep=False)
+    smoking_flags = ['never_smoker', 'ever_smoker', 'current_smoker',
+                     'ex_smoker']
+    df[smoking_flags] = df[smoking_flags].astype("boolean")
+    current = df.current_smoker.fillna(False)
+    ever = df.ever_smoker.fillna(False)
+    ex = df.ex_smoker.fillna(False)
+
+    # Fill never smoker = False if any of the others is True
+    smoked = (df.never_smoker.isna() & current) | ever | ex
+    df['never_smoker'] = df.never_smoker.mask(smoked, False)
+
+    # Fill never smoker = True if ALL the others are answered and False
+    answered = df[['current_smoker', 'ever_smoker',
+                   'ex_smoker']].notna().all(axis=1)
+    df['never_smoker'] = df.never_smoker.mask(
+        df.never_smoker.isna() & answered, True)
+
+    df["smoking_status"] = np.select(
+        [current.to_numpy(dtype=bool), ex.to_numpy(dtype=bool),
+         df.never_smoker.fillna(False).to_numpy(dtype=bool)],
+        ["current_smoker", "ex_smoker", "never_smoker"],
+        default=None)
+
+    return df
+
+
 def prettify_names(name: str) -> str:
     """
     This function takes a str of names as input and returns a new str with the names prettified.
@@ -100,6 +188,7 @@ def min_max_scale(data: pd.DataFrame, params: list) -> pd.DataFrame:
 
     Returns:
     pd.DataFrame: The normalized input data with the same dimensions as the input data.
+                  Unscaled columns are shared with the input, which is left unchanged.
 
     Raises:
     TypeError: If any of the input parameters' data types are not as expected.
@@ -117,6 +206,7 @@ def min_max_scale(data: pd.DataFrame, params: list) -> pd.DataFrame:
     for param in params:
         if param not in data.columns:
             raise ValueError("Invalid parameter name: " + param)
+    data = data.copy(deep=False)
     for param in params:
         data[param] = (data[param] - data[param].min()) / (
             data[param].max() - data[param].min()
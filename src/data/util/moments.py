@@ -0,0 +1,344 @@
+import hashlib
+import json
+import logging
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger("BronchialParameters")
+
+
+class Moments:
+    """
+    Count, sum and co-moments (centred sums of squares and cross-products)
+    of d variables, for any number of samples at once: n has the shape of
+    the samples, total that shape plus (d,) and comoment plus (d, d).
+
+    The moments of two disjoint samples merge exactly into those of their
+    union (Chan, Golub and LeVeque), so they can be computed on shards of
+    the data and combined in any order. Means, variances, covariances and
+    least-squares fits follow from the merged moments.
+    """
+
+    def __init__(self, n, total, comoment):
+        self.n = np.asarray(n, dtype=float)
+        self.total = np.asarray(total, dtype=float)
+        self.comoment = np.asarray(comoment, dtype=float)
+
+    @classmethod
+    def of(cls, values: np.ndarray) -> "Moments":
+        """
+        Moments of the rows of values, an (m, d) array without missing values.
+        """
+        values = np.asarray(values, dtype=float)
+        if values.ndim == 1:
+            values = values[:, None]
+        total = values.sum(axis=0)
+        centred = values - total / max(len(values), 1)
+        return cls(len(values), total, centred.T @ centred)
+
+    @property
+    def mean(self) -> np.ndarray:
+        """
+        Mean of each variable, NaN for empty samples.
+        """
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return self.total / self.n[..., None]
+
+    def merge(self, other: "Moments") -> "Moments":
+        n = self.n + other.n
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cross = np.where(n > 0, self.n * other.n / n, 0.0)[..., None]
+            delta = np.where(cross > 0, other.mean - self.mean, 0.0)
+        return Moments(
+            n, self.total + other.total, self.comoment + other.comoment +
+            cross[..., None] * delta[..., :, None] * delta[..., None, :])
+
+    def affine(self, shift, scale) -> "Moments":
+        """
+        Moments of (x - shift) / scale, shift and scale broadcasting against
+        total.
+        """
+        scale = np.broadcast_to(np.asarray(scale, dtype=float),
+                                self.total.shape)
+        return Moments(self.n, (self.total - self.n[..., None] * shift) / scale,
+                       self.comoment / (scale[..., :, None] * scale[..., None, :]))
+
+    def select(self, columns) -> "Moments":
+        """
+        Moments of the variables at the indices columns, in that order.
+        """
+        columns = np.asarray(columns, dtype=int)
+        return Moments(self.n, self.total[..., columns],
+                       self.comoment[..., columns[:, None], columns])
+
+    @property
+    def var(self) -> np.ndarray:
+        """
+        Sample variance of each variable, NaN for fewer than two values.
+        """
+        squares = np.diagonal(self.comoment, axis1=-2, axis2=-1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(self.n[..., None] > 1,
+                            squares / (self.n[..., None] - 1), np.nan)
+
+    @property
+    def std(self) -> np.ndarray:
+        return np.sqrt(self.var)
+
+
+class Extent:
+    """
+    Minimum and maximum of each column, skipping missing values.
+    """
+
+    def __init__(self, low, high):
+        self.low = np.asarray(low, dtype=float)
+        self.high = np.asarray(high, dtype=float)
+
+    @classmethod
+    def of(cls, values: np.ndarray) -> "Extent":
+        values = np.asarray(values, dtype=float)
+        if values.ndim == 1:
+            values = values[:, None]
+        present = ~np.isnan(values)
+        return cls(np.where(present, values, np.inf).min(axis=0, initial=np.inf),
+                   np.where(present, values, -np.inf).max(axis=0,
+                                                          initial=-np.inf))
+
+    def merge(self, other: "Extent") -> "Extent":
+        return Extent(np.minimum(self.low, other.low),
+                      np.maximum(self.high, other.high))
+
+
+class SortedValues:
+    """
+    The values of a sample, for exact quantiles, as sorted runs. Merging two
+    samples only joins their lists of runs: the runs are never merged into
+    one, a quantile bisects them for the values it falls between. Saved
+    runs are memory mapped on load and not written again, saved holds
+    where each run is saved, None for new runs, see save_statistics.
+    """
+
+    def __init__(self, runs=(), saved=None):
+        saved = [None] * len(runs) if saved is None else list(saved)
+        kept = [i for i, run in enumerate(runs) if len(run)]
+        self.runs = [runs[i] for i in kept]
+        self.saved = [saved[i] for i in kept]
+
+    @classmethod
+    def of(cls, values: np.ndarray) -> "SortedValues":
+        values = np.asarray(values, dtype=float)
+        return cls([np.sort(values[~np.isnan(values)])])
+
+    def merge(self, other: "SortedValues") -> "SortedValues":
+        return SortedValues(self.runs + other.runs, self.saved + other.saved)
+
+    def __len__(self) -> int:
+        return sum(len(run) for run in self.runs)
+
+    def _rank(self, value: float, side: str) -> int:
+        # Number of values below value, or up to it for side "right"
+        return sum(int(np.searchsorted(run, value, side)) for run in self.runs)
+
+    def order_statistic(self, k: int) -> float:
+        """
+        The k-th smallest value, counting from 0.
+        """
+        if not 0 <= k < len(self):
+            raise IndexError(f"No value of rank {k} in {len(self)} values")
+        # The k-th value v sits in some run, where it is the only value with
+        # fewer than k + 1 values below it and more than k up to it
+        for run in self.runs:
+            low, high = 0, len(run)
+            while low < high:
+                middle = (low + high) // 2
+                value = run[middle]
+                if self._rank(value, "right") <= k:
+                    low = middle + 1
+                elif self._rank(value, "left") > k:
+                    high = middle
+                else:
+                    return float(value)
+
+    def quantile(self, q) -> np.ndarray:
+        """
+        Quantiles with linear interpolation, as pandas' quantile.
+        """
+        n = len(self)
+        if not n:
+            return np.full(np.shape(q), np.nan)
+        position = np.asarray(q, dtype=float) * (n - 1)
+        below = np.floor(position).astype(int)
+        fraction = position - below
+        low = np.vectorize(self.order_statistic, otypes=[float])(below)
+        high = np.vectorize(self.order_statistic, otypes=[float])(
+            np.minimum(below + 1, n - 1))
+        # Interpolated from the nearer end, as numpy's quantile does
+        diff = high - low
+        return np.where(fraction >= 0.5, high - diff * (1 - fraction),
+                        low + diff * fraction)
+
+
+def merge(a, b):
+    """
+    Merge two statistics of disjoint samples: Moments, Extent, SortedValues
+    or dicts of them, merged key by key.
+    """
+    if isinstance(a, dict):
+        return {
+            key: merge(a[key], b[key]) if key in a and key in b else
+            a.get(key, b.get(key))
+            for key in {**a, **b}
+        }
+    return a.merge(b)
+
+
+# Version of the layout of saved statistics, checked on load
+STATISTICS_VERSION = 2
+STATISTICS = {cls.__name__: cls for cls in (Moments, Extent, SortedValues)}
+
+
+def runs_dir(path) -> Path:
+    """
+    The directory the sorted runs of the statistics saved at path are in.
+    """
+    path = Path(path)
+    return path.with_name(f"{path.stem}_runs")
+
+
+def save_statistics(path, stats: dict, meta: dict = None):
+    """
+    Save nested dicts of statistics as an uncompressed npz file. The runs of
+    SortedValues not saved before are written together to one npy file in
+    runs_dir(path), named by its contents, and the npz file only records
+    where each run is: saving merged statistics costs the size of the new
+    runs, not of all of them.
+
+    Parameters:
+    path (Path): The file to write.
+    stats (dict): Statistics, keyed by strings or None at every level.
+    meta (dict): JSON serialisable data saved alongside.
+
+    Returns:
+    None
+    """
+    arrays, layout, sorted_values = {}, [], []
+
+    def flatten(node, keys):
+        if isinstance(node, dict):
+            for key, value in node.items():
+                flatten(value, keys + [key])
+            return
+        layout.append([keys, type(node).__name__])
+        if isinstance(node, SortedValues):
+            sorted_values.append((len(layout) - 1, node))
+            return
+        for name, value in vars(node).items():
+            arrays[f"{len(layout) - 1}_{name}"] = value
+
+    flatten(stats, [])
+    new = [run for _, node in sorted_values
+           for run, saved in zip(node.runs, node.saved) if saved is None]
+    if new:
+        values = np.concatenate(new)
+        name = f"{hashlib.sha256(values.tobytes()).hexdigest()}.npy"
+        runs_dir(path).mkdir(exist_ok=True)
+        np.save(runs_dir(path) / name, values)
+        start = 0
+        for _, node in sorted_values:
+            for j, run in enumerate(node.runs):
+                if node.saved[j] is None:
+                    node.saved[j] = (name, start, start + len(run))
+                    start += len(run)
+    for i, node in sorted_values:
+        arrays[f"{i}_files"] = np.array(
+            [name for name, _, _ in node.saved], dtype=str)
+        arrays[f"{i}_bounds"] = np.array(
+            [(start, stop) for _, start, stop in node.saved],
+            dtype=np.int64).reshape(-1, 2)
+    np.savez(path,
+             version=np.array(STATISTICS_VERSION),
+             layout=np.array(json.dumps(layout)),
+             meta=np.array(json.dumps(meta or {})),
+             **arrays)
+
+
+def load_statistics(path) -> tuple:
+    """
+    Load statistics saved with save_statistics.
+
+    Returns:
+    tuple: The nested dict of statistics and the meta dict.
+
+    Raises:
+    ValueError: If the file has another version.
+    """
+    with np.load(path, allow_pickle=False) as npz:
+        arrays = {name: npz[name] for name in npz.files}
+    version = int(arrays["version"])
+    if version != STATISTICS_VERSION:
+        raise ValueError(f"{path} holds version {version} statistics, "
+                         f"expected version {STATISTICS_VERSION}")
+    stats, files = {}, {}
+    for i, (keys, kind) in enumerate(json.loads(str(arrays["layout"]))):
+        prefix = f"{i}_"
+        values = {
+            name[len(prefix):]: value
+            for name, value in arrays.items() if name.startswith(prefix)
+        }
+        if kind == SortedValues.__name__:
+            saved = [(str(name), int(start), int(stop)) for name, (start, stop)
+                     in zip(values.pop("files"), values.pop("bounds"))]
+            for name, _, _ in saved:
+                if name not in files:
+                    files[name] = np.load(runs_dir(path) / name,
+                                          mmap_mode="r")
+            values["runs"] = [files[name][start:stop]
+                              for name, start, stop in saved]
+            values["saved"] = saved
+        node = STATISTICS[kind](**values)
+        parent = stats
+        for key in keys[:-1]:
+            parent = parent.setdefault(key, {})
+        parent[keys[-1]] = node
+    return stats, json.loads(str(arrays["meta"]))
+
+
+def accumulate(path, layout: dict, batch_hash: str, compute) -> tuple:
+    """
+    Merge the statistics of a batch of new rows into the accumulators saved
+    at path, starting them with the first batch. A batch already merged is
+    skipped, so a repeated update does not count its rows twice.
+
+    Parameters:
+    path (Path): The npz file of the accumulators.
+    layout (dict): What the statistics are of, e.g. the parameters, which
+                   must match the saved accumulators.
+    batch_hash (str): Hash of the batch.
+    compute (callable): Takes the saved statistics and returns those of
+                        the batch.
+
+    Returns:
+    tuple: The merged statistics and the meta data of the accumulators:
+           the layout, the hashes of the merged batches and data_hash, a
+           hash of all of them.
+
+    Raises:
+    ValueError: If the accumulators at path have another layout.
+    """
+    stats, meta = {}, {"layout": layout, "batches": [], "data_hash": ""}
+    if Path(path).exists():
+        stats, meta = load_statistics(path)
+        if meta["layout"] != layout:
+            raise ValueError(f"{path} accumulates the statistics of other "
+                             "variables, remove it to start over")
+    if batch_hash in meta["batches"]:
+        logger.warning(f"Batch already merged into {path}, skipped")
+        return stats, meta
+    stats = merge(stats, compute(stats))
+    meta["batches"].append(batch_hash)
+    meta["data_hash"] = hashlib.sha256(
+        (meta["data_hash"] + batch_hash).encode()).hexdigest()
+    save_statistics(path, stats, meta)
+    return stats, meta
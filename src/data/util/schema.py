@@ -0,0 +1,93 @@
+import logging
+import re
+
+import pandas as pd
+from pandas.api.types import CategoricalDtype
+
+logger = logging.getLogger("BronchialParameters")
+
+# Category labels, in order
+AGE_5YR_LABELS = [
+    '45-50', '50-55', '55-60', '60-65', '65-70', '70-75', '75-80', '80+'
+]
+AGE_10YR_LABELS = ['45-54', '55-64', '65-74', '75-84', '85+']
+PACK_YEAR_LABELS = ['0', '1-10', '10-20', '20+']
+SMOKING_LABELS = ['never_smoker', 'ex_smoker', 'current_smoker']
+GOLD_LABELS = ['0', 'GOLD-1', 'GOLD-2', 'GOLD-3', 'GOLD-4']
+# Edges of the age categories, closed on the left, the last one open ended
+AGE_5YR_BINS = [45, 50, 55, 60, 65, 70, 75, 80, 100]
+AGE_10YR_BINS = [45, 55, 65, 75, 85, 100]
+
+CATEGORIES = {
+    # Alphabetical, so Female stays the reference level of the models
+    'sex': CategoricalDtype(['Female', 'Male']),
+    'smoking_status': CategoricalDtype(SMOKING_LABELS, ordered=True),
+    'GOLD_stage': CategoricalDtype(GOLD_LABELS, ordered=True),
+    'cancer_type': 'category',
+    'healthy': CategoricalDtype(['healthy', 'unhealthy']),
+    'age_5yr': CategoricalDtype(AGE_5YR_LABELS, ordered=True),
+    'age_10yr': CategoricalDtype(AGE_10YR_LABELS, ordered=True),
+    'pack_year_categories': CategoricalDtype(PACK_YEAR_LABELS, ordered=True),
+}
+
+BOOLEANS = [
+    'copd_diagnosis', 'asthma_diagnosis', 'never_smoker', 'ever_smoker',
+    'current_smoker', 'ex_smoker'
+]
+
+# Per-generation bronchial parameters (bp_wt_0 ... bp_wt_8) are reported to
+# 3 decimals, well within the 7 significant digits of float32. The summary
+# parameters derived from them stay float64 as the statistics are computed
+# on those.
+GENERATION_COLUMN = re.compile(r"^bp_[a-z]+_\d$")
+
+
+def schema_dtypes(columns) -> dict:
+    """
+    Return the compact dtype of each of the given columns covered by the
+    schema.
+
+    Parameters:
+    columns (Iterable): Column names.
+
+    Returns:
+    dict: Column name to dtype, for the columns in the schema.
+    """
+    dtypes = {}
+    for col in columns:
+        if col in CATEGORIES:
+            dtypes[col] = CATEGORIES[col]
+        elif col in BOOLEANS:
+            dtypes[col] = 'boolean'
+        elif GENERATION_COLUMN.match(col):
+            dtypes[col] = 'float32'
+    return dtypes
+
+
+def apply_schema(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Cast the columns of the bronchial parameter dataset to their compact
+    dtypes: ordered categoricals for the labels, nullable booleans for the
+    yes/no answers and float32 for the per-generation parameters.
+
+    Columns not in the schema are left as they are. Labels outside a
+    column's categories become NaN, with a warning naming them.
+
+    Parameters:
+    df (pd.DataFrame): The dataset, as loaded or about to be saved.
+
+    Returns:
+    pd.DataFrame: The dataset with the schema dtypes.
+    """
+    dtypes = schema_dtypes(df.columns)
+    if not dtypes:
+        return df
+    for col, dtype in dtypes.items():
+        if not isinstance(dtype, CategoricalDtype):
+            continue
+        values = df[col]
+        unknown = values[values.notna() & ~values.isin(dtype.categories)]
+        if len(unknown):
+            logger.warning(f"{col} labels not in the schema read as missing: "
+                           f"{sorted(map(str, unknown.unique()))}")
+    return df.astype(dtypes, copy=False)
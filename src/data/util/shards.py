@@ -0,0 +1,86 @@
+import hashlib
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import reduce
+
+import numpy as np
+import pandas as pd
+
+from .moments import merge
+
+logger = logging.getLogger("BronchialParameters")
+
+# Column participants are assigned to shards by
+SHARD_KEY = "patientID"
+
+
+def shard_ids(data: pd.DataFrame, n_shards: int) -> np.ndarray:
+    """
+    Return the shard of every row, from a hash of its participant.
+
+    The hash does not depend on the process or machine, so every scan of a
+    participant lands in the same shard wherever it is computed.
+
+    Parameters:
+    data (pd.DataFrame): The rows, with a patientID column.
+    n_shards (int): The number of shards.
+
+    Returns:
+    np.ndarray: (n,) shard numbers in [0, n_shards).
+    """
+    ids = pd.util.hash_pandas_object(data[SHARD_KEY].astype(str), index=False)
+    return (ids.to_numpy() % np.uint64(n_shards)).astype(int)
+
+
+def split(data: pd.DataFrame, n_shards: int) -> list:
+    """
+    Split data into n_shards frames of whole participants, in row order.
+    """
+    ids = shard_ids(data, n_shards)
+    return [data[ids == shard] for shard in range(n_shards)]
+
+
+def map_shards(data: pd.DataFrame, mapper, n_shards: int,
+               jobs: int = None) -> list:
+    """
+    Apply mapper to every shard of data, each in a worker process.
+
+    mapper only ever sees its own shard and returns statistics that merge
+    with those of the other shards, so shards can be processed anywhere.
+    Called from a worker process, e.g. a task of analyse.py --jobs, the
+    shards are mapped in that process rather than in a pool of its own.
+
+    Parameters:
+    data (pd.DataFrame): The rows to split.
+    mapper (callable): Module level function or partial taking one shard.
+    n_shards (int): The number of shards.
+    jobs (int): Worker processes. Default: one per shard, up to one per CPU.
+
+    Returns:
+    list: The result of mapper for every shard, in shard order.
+    """
+    frames = split(data, n_shards)
+    jobs = jobs or min(n_shards, os.cpu_count() or 1)
+    if multiprocessing.parent_process() is not None:
+        jobs = 1
+    logger.debug(f"Mapping {mapper} over {n_shards} shards, {jobs} workers")
+    if jobs == 1:
+        return [mapper(frame) for frame in frames]
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        return list(pool.map(mapper, frames))
+
+
+def merge_shards(results: list):
+    """
+    Merge the statistics of every shard into those of the whole data.
+    """
+    return reduce(merge, results)
+
+
+def combine_hashes(hashes: list) -> str:
+    """
+    Hash of the data from the hashes of its shards, in shard order.
+    """
+    return hashlib.sha256("".join(hashes).encode()).hexdigest()
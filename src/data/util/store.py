@@ -0,0 +1,200 @@
+import logging
+from pathlib import Path
+
+import pandas as pd
+
+from .cache import file_hash
+
+logger = logging.getLogger("BronchialParameters")
+
+FEATHER_SUFFIX = ".feather"
+# Schema metadata key holding the hash of the csv a cache was built from
+HASH_KEY = b"source_sha256"
+CACHE_SUFFIX = ".cache" + FEATHER_SUFFIX
+
+
+def write_frame(df: pd.DataFrame, path: Path) -> Path:
+    """
+    Write a DataFrame, including its index, to an uncompressed Arrow IPC
+    (feather v2) file that later stages can memory-map.
+
+    Parameters:
+    df (pd.DataFrame): The data to write.
+    path (Path): Destination file.
+
+    Returns:
+    Path: The written file.
+    """
+    import pyarrow as pa
+    import pyarrow.feather as feather
+
+    table = pa.Table.from_pandas(df)
+    feather.write_feather(table, str(path), compression="uncompressed")
+    return Path(path)
+
+
+def read_frame(path: Path, columns: list = None) -> pd.DataFrame:
+    """
+    Read a DataFrame written by write_frame through a memory map, so the
+    Arrow buffers are not copied in from disk before conversion.
+
+    Parameters:
+    path (Path): The feather file.
+    columns (list): Optional subset of columns to read.
+
+    Returns:
+    pd.DataFrame: The stored data, with its index restored.
+    """
+    import pyarrow.feather as feather
+
+    table = feather.read_table(str(path), columns=columns, memory_map=True)
+    return table.to_pandas()
+
+
+def _present(names: list, columns: list) -> list:
+    # Requested columns the file has, in file order. Missing ones are left
+    # out so they fail where they are used, as with a full load.
+    if columns is None:
+        return None
+    wanted = set(columns)
+    return [name for name in names if name in wanted]
+
+
+def cache_path(csv_path: Path) -> Path:
+    """
+    Return the location of the columnar cache of a csv file.
+    """
+    csv_path = Path(csv_path)
+    return csv_path.with_name(csv_path.name + CACHE_SUFFIX)
+
+
+def write_cache(df: pd.DataFrame, csv_path: Path) -> Path:
+    """
+    Write the frame parsed from a csv file to its uncompressed feather
+    cache, tagged with the sha256 of the csv so a stale cache is never read.
+
+    Parameters:
+    df (pd.DataFrame): The csv as parsed by load_dataset.
+    csv_path (Path): The csv file.
+
+    Returns:
+    Path: The cache file, or None if the data cannot be stored in Arrow.
+    """
+    import pyarrow as pa
+    import pyarrow.feather as feather
+
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError) as error:
+        logger.warning(f"Could not cache {csv_path}: {error}")
+        return None
+    metadata = dict(table.schema.metadata or {})
+    metadata[HASH_KEY] = file_hash(csv_path).encode()
+    out_file = cache_path(csv_path)
+    feather.write_feather(table.replace_schema_metadata(metadata),
+                          str(out_file), compression="uncompressed")
+    return out_file
+
+
+def _read_cache(csv_path: Path, columns: list = None):
+    # The cached csv, None if there is no cache or it is stale
+    import pyarrow as pa
+
+    cache_file = cache_path(csv_path)
+    if not cache_file.exists():
+        return None
+    with pa.memory_map(str(cache_file), "r") as source:
+        reader = pa.ipc.open_file(source)
+        metadata = reader.schema.metadata or {}
+        if metadata.get(HASH_KEY, b"").decode() != file_hash(csv_path):
+            logger.info(f"Cache {cache_file} is stale, ignoring")
+            return None
+        columns = _present(reader.schema.names, columns)
+    return read_frame(cache_file, columns)
+
+
+def load_dataset(path: Path, columns: list = None) -> pd.DataFrame:
+    """
+    Load a dataset from a feather file, through a memory map, or a csv.
+
+    A csv is parsed once: the parsed frame is cached as feather next to it,
+    see write_cache, and read from there while the hash of the csv matches.
+    Only the requested columns are read. Requested columns the file does not
+    have are skipped.
+
+    Parameters:
+    path (Path): The csv or feather file to load.
+    columns (list): Columns to read. Default: all.
+
+    Returns:
+    pd.DataFrame: The loaded dataset.
+    """
+    if Path(path).suffix == FEATHER_SUFFIX:
+        if columns is not None:
+            import pyarrow as pa
+            with pa.memory_map(str(path), "r") as source:
+                names = pa.ipc.open_file(source).schema.names
+            columns = _present(names, columns)
+        return read_frame(path, columns)
+    df = _read_cache(path, columns)
+    if df is not None:
+        logger.debug(f"Loaded {path} from {cache_path(path)}")
+        return df
+    df = pd.read_csv(path, low_memory=False)
+    write_cache(df, path)
+    if columns is None:
+        return df
+    return df[_present(list(df), columns)]
+
+
+def iter_chunks(path: Path, chunk_size: int, columns: list = None,
+                dtype: dict = None):
+    """
+    Yield the rows of a csv, Parquet or feather file as DataFrames of at most
+    chunk_size rows, reading one chunk at a time so memory stays bounded
+    whatever the size of the file.
+
+    Parameters:
+    path (Path): The csv, parquet or feather file.
+    chunk_size (int): Rows per chunk.
+    columns (list): Columns to read, missing ones are skipped. Default: all.
+    dtype (dict): Dtypes of csv columns, so they do not depend on the values
+                  of each chunk. Ignored for the typed file formats.
+
+    Yields:
+    pd.DataFrame: The next chunk.
+
+    Raises:
+    ValueError: If the file type is not supported.
+    """
+    path = Path(path)
+    if path.suffix == ".csv":
+        usecols = None
+        if columns is not None:
+            wanted = set(columns)
+            usecols = lambda name: name in wanted
+        yield from pd.read_csv(path, chunksize=chunk_size, usecols=usecols,
+                               dtype=dtype, low_memory=False)
+    elif path.suffix == ".parquet":
+        import pyarrow.parquet as pq
+
+        parquet = pq.ParquetFile(path)
+        columns = _present(parquet.schema_arrow.names, columns)
+        for batch in parquet.iter_batches(batch_size=chunk_size,
+                                          columns=columns):
+            yield batch.to_pandas()
+    elif path.suffix == FEATHER_SUFFIX:
+        import pyarrow as pa
+
+        with pa.memory_map(str(path), "r") as source:
+            reader = pa.ipc.open_file(source)
+            columns = _present(reader.schema.names, columns)
+            for i in range(reader.num_record_batches):
+                batch = reader.get_batch(i)
+                if columns is not None:
+                    batch = batch.select(columns)
+                for start in range(0, batch.num_rows, chunk_size):
+                    yield batch.slice(start, chunk_size).to_pandas()
+    else:
+        raise ValueError(f"Cannot read {path}: not a csv, parquet or "
+                         f"{FEATHER_SUFFIX} file")
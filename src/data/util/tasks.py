@@ -0,0 +1,281 @@
+import hashlib
+import inspect
+import logging
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+logger = logging.getLogger("BronchialParameters")
+
+
+def reads(columns):
+    """
+    Declare the columns an analysis reads from its data, so that only those
+    need to be loaded.
+
+    Parameters:
+    columns (callable): Takes the keyword arguments the analysis is called
+                        with and returns the names of the columns it reads,
+                        or None if it reads every column.
+
+    Returns:
+    callable: Decorator storing columns on the analysis as its .columns
+              attribute.
+    """
+    def decorate(func):
+        func.columns = columns
+        return func
+    return decorate
+
+
+def writes(outputs):
+    """
+    Declare the files an analysis writes, so the scheduler can tell whether
+    they are up to date.
+
+    Parameters:
+    outputs (callable): Takes the keyword arguments the analysis is called
+                        with and returns the paths of the files it writes.
+
+    Returns:
+    callable: Decorator storing outputs on the analysis as its .outputs
+              attribute.
+    """
+    def decorate(func):
+        func.outputs = outputs
+        return func
+    return decorate
+
+
+def needs(inputs):
+    """
+    Declare the files an analysis reads besides its data, such as the
+    outputs of another analysis, so it runs after the task writing them and
+    again when they change.
+
+    Parameters:
+    inputs (callable): Takes the keyword arguments the analysis is called
+                       with and returns the paths of the files it reads.
+
+    Returns:
+    callable: Decorator storing inputs on the analysis as its .needs
+              attribute.
+    """
+    def decorate(func):
+        func.needs = inputs
+        return func
+    return decorate
+
+
+def keyed(key):
+    """
+    Declare what the results of an analysis depend on, when that is less
+    than the columns it reads, so cached results are reused as long as it
+    is unchanged.
+
+    Parameters:
+    key (callable): Takes the data and the keyword arguments the analysis is
+                    called with and returns a string identifying its results.
+
+    Returns:
+    callable: Decorator storing key on the analysis as its .key attribute.
+    """
+    def decorate(func):
+        func.key = key
+        return func
+    return decorate
+
+
+def declared_columns(funcs: list) -> list:
+    """
+    Return the union of the columns read by a list of analyses.
+
+    Parameters:
+    funcs (list): functools.partials of analyses declared with reads, binding
+                  every argument but the data.
+
+    Returns:
+    list: Column names, in order of first use, or None if an analysis reads
+          every column.
+    """
+    columns = {}
+    for func in funcs:
+        read = func.func.columns(**func.keywords)
+        if read is None:
+            return None
+        columns.update(dict.fromkeys(read))
+    return list(columns)
+
+
+class Task:
+    """
+    One analysis call in the task graph.
+
+    The task applies func, a functools.partial binding every argument but
+    the data, to the frame called frame. Its outputs are the files func
+    declares with writes. Its inputs are the given files, those func
+    declares with needs. A task depends on every task writing one of its
+    inputs, and on the tasks named in after.
+
+    Next to its outputs a task keeps a stamp, hashing the keyword arguments
+    of func, the source of func's module and context, anything else the
+    outputs depend on such as how the frame was prepared. The outputs are
+    redone when the stamp changes.
+    """
+
+    def __init__(self, group: str, frame: str, func, inputs: list = (),
+                 after: list = (), context=None):
+        self.group = group
+        self.frame = frame
+        self.func = func
+        needed = getattr(func.func, "needs", lambda **_: [])(**func.keywords)
+        self.inputs = [Path(path) for path in list(inputs) + list(needed)]
+        self.after = list(after)
+        self.context = context
+
+    @property
+    def name(self) -> str:
+        target = self.func.func
+        module = target.__module__.rsplit(".", 1)[-1]
+        args = ", ".join(f"{key}={value}"
+                         for key, value in self.func.keywords.items()
+                         if isinstance(value, str))
+        return f"{self.group}/{module}.{target.__name__}({args})"
+
+    @property
+    def outputs(self) -> list:
+        return [Path(path) for path in self.func.func.outputs(**self.func.keywords)]
+
+    @property
+    def stamp_path(self) -> Path:
+        first = self.outputs[0]
+        return first.with_name(f".{first.name}.stamp")
+
+    def stamp(self) -> str:
+        digest = hashlib.sha256()
+        digest.update(Path(inspect.getfile(self.func.func)).read_bytes())
+        digest.update(repr((sorted(self.func.keywords.items()),
+                            self.context)).encode())
+        return digest.hexdigest()
+
+    def write_stamp(self):
+        self.stamp_path.write_text(self.stamp())
+
+    def is_stale(self) -> bool:
+        """
+        True if an output is missing or older than an input, as in make, or
+        if the stamp differs from the one written when the outputs were.
+        """
+        outputs = self.outputs
+        if not outputs or not all(path.exists() for path in outputs):
+            return True
+        stamp = self.stamp_path
+        if not stamp.exists() or stamp.read_text() != self.stamp():
+            return True
+        if not all(path.exists() for path in self.inputs):
+            return True
+        newest_input = max((path.stat().st_mtime for path in self.inputs),
+                           default=0.0)
+        return min(path.stat().st_mtime for path in outputs) < newest_input
+
+
+def _edges(tasks: list) -> dict:
+    # Map each task to the tasks it depends on
+    writers = {path: task for task in tasks for path in task.outputs}
+    names = {task.name: task for task in tasks}
+    return {
+        task: {writers[path] for path in task.inputs if path in writers} |
+        {names[name] for name in task.after if name in names}
+        for task in tasks
+    }
+
+
+def topological_order(tasks: list) -> list:
+    """
+    Order tasks so each one comes after the tasks it depends on, keeping
+    the given order otherwise.
+
+    Raises:
+    ValueError: If the dependencies form a cycle.
+    """
+    edges = _edges(tasks)
+    order, done, visiting = [], set(), set()
+
+    def visit(task):
+        if task in done:
+            return
+        if task in visiting:
+            raise ValueError(f"Dependency cycle through {task.name}")
+        visiting.add(task)
+        for dep in edges[task]:
+            visit(dep)
+        visiting.discard(task)
+        done.add(task)
+        order.append(task)
+
+    for task in tasks:
+        visit(task)
+    return order
+
+
+def plan(tasks: list, force: bool = False) -> list:
+    """
+    Select the tasks to run: those with missing or stale outputs and the
+    tasks depending on them, or every task if force is set.
+
+    Returns:
+    list: The tasks to run, in topological order.
+    """
+    edges = _edges(tasks)
+    selected = set()
+    for task in topological_order(tasks):
+        if force or task.is_stale() or edges[task] & selected:
+            selected.add(task)
+    return [task for task in topological_order(tasks) if task in selected]
+
+
+def run(tasks: list, runner, jobs: int = 1, initializer=None, initargs=()):
+    """
+    Run tasks in dependency order, calling runner(task) for each and then
+    writing its stamp.
+
+    With one job the tasks run here in topological order. Otherwise every
+    task whose dependencies have finished is submitted to a process pool,
+    so independent tasks run in parallel.
+
+    Parameters:
+    tasks (list): The tasks to run, usually the result of plan.
+    runner (callable): Module level function running one task.
+    jobs (int): Number of worker processes.
+    initializer (callable): Called once in each process before any task.
+    initargs (tuple): Arguments for initializer.
+
+    Returns:
+    None
+    """
+    order = topological_order(tasks)
+    if jobs == 1:
+        if initializer is not None:
+            initializer(*initargs)
+        for task in order:
+            runner(task)
+            task.write_stamp()
+        return
+
+    # Dependencies outside the selection are already up to date
+    waiting = {task: deps & set(order) for task, deps in _edges(order).items()}
+    with ProcessPoolExecutor(max_workers=jobs,
+                             initializer=initializer,
+                             initargs=initargs) as pool:
+        running = {}
+        while waiting or running:
+            for task in [task for task, deps in waiting.items() if not deps]:
+                del waiting[task]
+                running[pool.submit(runner, task)] = task
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                task = running.pop(future)
+                # Re-raise a failure before starting anything that needs it
+                future.result()
+                task.write_stamp()
+                for deps in waiting.values():
+                    deps.discard(task)
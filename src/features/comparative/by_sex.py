@@ -4,7 +4,11 @@ import pandas as pd
 from scipy import stats
 from statsmodels.stats.multicomp import pairwise_tukeyhsd
 
+from data.util.tasks import reads, writes
 
+
+@reads(lambda parameters, **_: ["sex", "smoking_status"] + parameters)
+@writes(lambda out_path, **_: [out_path / "sex_differences.csv"])
 def compare(data, parameters, out_path):
     # Function to perform one-way ANOVA and Tukey's test
     def _perform_anova_and_tukey(data, parameter):
@@ -9,7 +9,7 @@ import statsmodels.api as sm
 from scipy.stats import pearsonr
 import matplotlib.pyplot as plt
 
-from src.data.subgroup import get_healthy
+from data.subgroup import get_healthy
 
 # Define command line arguments
 parser = argparse.ArgumentParser()
@@ -1,11 +1,46 @@
 #!/usr/bin/env python3
 import pandas as pd
 import numpy as np
-from scipy.stats import ttest_ind, t
+from scipy.stats import ttest_ind, ttest_ind_from_stats, t
+from functools import partial
 from pathlib import Path
 
+from data.util.cache import frame_hash
+from data.util.moments import Extent, Moments, SortedValues, accumulate
+from data.util.shards import SHARD_KEY, map_shards, merge_shards
+from data.util.tasks import reads, writes
 
-def calc_demographics(data, params, out_dir, split_by):
+SEXES = ["Male", "Female"]
+# Rows of demographics_all.csv, as pandas' describe
+DESCRIBE = ["count", "mean", "std", "min", "25%", "50%", "75%", "max"]
+
+
+def _described(data: pd.DataFrame, described: list = None) -> list:
+    # The columns of demographics_all.csv: the numeric ones pandas' describe
+    # selects, of the described columns if given, in the dataset's order
+    numeric = list(data.select_dtypes("number").columns)
+    if described is None:
+        return numeric
+    return [col for col in numeric if col in described]
+
+
+def _reads(params, split_by, described=None, shards=1, **_):
+    # Without described columns demographics_all.csv describes every
+    # numeric column of the dataset, so all of them are read
+    if described is None:
+        return None
+    return (["sex", split_by] + params + described +
+            ([SHARD_KEY] if shards > 1 else []))
+
+
+@reads(_reads)
+@writes(lambda out_dir, **_: [
+    out_dir / "demographics.csv", out_dir / "demographics_all.csv"])
+def calc_demographics(data, params, out_dir, split_by, described=None,
+                      shards=1):
+    if shards > 1:
+        return calc_demographics_sharded(data, params, out_dir, split_by,
+                                         described, shards)
 
     groups = data[split_by].dropna().unique().tolist()
 
@@ -77,7 +112,7 @@ def calc_demographics(data, params, out_dir, split_by):
     for group in ['all'] + groups:
         if group == 'all':
             descriptive_stats(data, group, result_dict)
-            data.describe().to_csv(
+            data[_described(data, described)].describe().to_csv(
                 str(out_dir / "demographics_all.csv"))
         else:
             descriptive_stats(data[data[split_by] == group], group,
@@ -87,3 +122,195 @@ def calc_demographics(data, params, out_dir, split_by):
     result_df = pd.DataFrame(result_dict)
     result_df.to_csv(str(out_dir / "demographics.csv"), index=False)
 
+
+def _count(data: pd.DataFrame) -> Moments:
+    # The moments of no variables only count the rows
+    return Moments.of(np.empty((len(data), 0)))
+
+
+def shard_statistics(data: pd.DataFrame, params: list, split_by: str,
+                     described: list) -> dict:
+    """
+    Compute the mergeable statistics of one shard behind demographics.csv:
+    per split_by group (and "all") the row counts, the first row label and,
+    per sex, the moments and sorted values of every parameter. For the
+    whole shard they are also computed for the columns of
+    demographics_all.csv.
+
+    Parameters:
+    data (pd.DataFrame): The rows of the shard.
+    params (list): The parameters to describe.
+    split_by (str): The column to group by.
+    described (list): The columns of demographics_all.csv.
+
+    Returns:
+    dict: group to statistics, merged across shards with merge_shards.
+    """
+    stats = {}
+    for group in ["all"] + data[split_by].dropna().unique().tolist():
+        frame = data if group == "all" else data[data[split_by] == group]
+        entry = {
+            "rows": _count(frame),
+            # Groups are listed in order of appearance
+            "first": Extent.of(frame.index[:1].to_numpy()),
+        }
+        # Both sexes together feed demographics_all.csv
+        for sex in SEXES + ([None] if group == "all" else []):
+            sex_frame = frame if sex is None else frame[frame["sex"] == sex]
+            entry[sex] = {"rows": _count(sex_frame)}
+            for var in params if sex is not None else described:
+                values = sex_frame[var].to_numpy(dtype=float, na_value=np.nan)
+                entry[sex][var] = {
+                    "moments": Moments.of(values[~np.isnan(values)]),
+                    "values": SortedValues.of(values),
+                }
+        stats[group] = entry
+    return stats
+
+
+def calc_demographics_sharded(data, params, out_dir, split_by, described,
+                              shards):
+    """
+    Write the same demographics.csv and demographics_all.csv as
+    calc_demographics from statistics computed per hash shard of
+    participants in parallel and merged: means and standard deviations from
+    the merged moments, t-tests from those, and ranges and quartiles from
+    the merged sorted values.
+
+    Parameters:
+    data (pd.DataFrame): The data frame to describe.
+    params (list): The parameters to describe.
+    out_dir (Path): The output directory.
+    split_by (str): The column to group by.
+    described (list): The columns of demographics_all.csv, every numeric
+        column if None.
+    shards (int): The number of shards.
+
+    Returns:
+    None
+    """
+    described = _described(data, described)
+    stats = merge_shards(
+        map_shards(data,
+                   partial(shard_statistics, params=params, split_by=split_by,
+                           described=described),
+                   shards))
+    write_demographics(stats, _groups(stats), params, described, out_dir)
+
+
+def _groups(stats: dict) -> list:
+    # The split_by groups, in order of appearance
+    return sorted((group for group in stats if group != "all"),
+                  key=lambda group: float(stats[group]["first"].low[0]))
+
+
+@reads(_reads)
+@writes(lambda out_dir, **_: [
+    out_dir / "demographics.csv", out_dir / "demographics_all.csv",
+    out_dir / "demographics_state.npz"])
+def update_demographics(data, params, out_dir, split_by, described=None):
+    """
+    Merge the statistics of a batch of new scans into the accumulators in
+    demographics_state.npz, and regenerate demographics.csv and
+    demographics_all.csv from them. The earlier scans are not read, the
+    first batch starts the accumulators and a batch already merged is
+    skipped. The update takes time linear in the batch: its sorted values
+    are saved as new runs, the earlier runs are memory mapped and only read
+    where the ranges and quartiles fall.
+
+    Parameters:
+    data (pd.DataFrame): The new scans.
+    params (list): The parameters to describe.
+    out_dir (Path): The output directory, holding the accumulators.
+    split_by (str): The column to group by.
+    described (list): The columns of demographics_all.csv, every numeric
+        column if None.
+
+    Returns:
+    None
+    """
+    described = _described(data, described)
+    batch_hash = frame_hash(data.loc[:, list(dict.fromkeys(
+        ["sex", split_by] + params + described))])
+
+    def compute(stats):
+        # Number the new rows after the merged ones, so the groups keep
+        # their order of appearance
+        seen = int(stats["all"]["rows"].n) if stats else 0
+        return shard_statistics(
+            data.set_axis(np.arange(seen, seen + len(data))), params,
+            split_by, described)
+
+    stats, _ = accumulate(out_dir / "demographics_state.npz",
+                          {"params": params, "split_by": split_by,
+                           "described": described},
+                          batch_hash, compute)
+    write_demographics(stats, _groups(stats), params, described, out_dir)
+
+
+def write_demographics(stats: dict, groups: list, params: list,
+                       described: list, out_dir):
+    """
+    Write demographics.csv and demographics_all.csv from merged statistics.
+
+    Parameters:
+    stats (dict): Statistics as computed by shard_statistics.
+    groups (list): The split_by groups, in order.
+    params (list): The described parameters.
+    described (list): The columns of demographics_all.csv.
+    out_dir (Path): The output directory.
+
+    Returns:
+    None
+    """
+    result_dict = {'Variable': ["Participants"] + params}
+    for group in ['all'] + groups:
+        entry = stats[group]
+        title = group.title()
+        total = entry["rows"].n
+        for sex in SEXES:
+            count = int(entry[sex]["rows"].n)
+            result_dict[f'{sex} Mean±SD {title}'] = [
+                f'{count} ({count/total*100:.1f})']
+        result_dict[f'p-val {title}'] = ['NA']
+        for sex in SEXES:
+            result_dict[f'{sex} 99% CI {title}'] = ['NA']
+            result_dict[f'{sex} 95% Range {title}'] = ['NA']
+
+        for var in params:
+            summary = {}
+            for sex in SEXES:
+                moments = entry[sex][var]["moments"]
+                mean, std, n = moments.mean[0], moments.std[0], moments.n
+                ci = t.interval(0.99, n - 1, loc=mean, scale=std / np.sqrt(n))
+                low, high = entry[sex][var]["values"].quantile([0.025, 0.975])
+                summary[sex] = mean, std, n
+                result_dict[f'{sex} Mean±SD {title}'].append(
+                    f'{mean:.3f}±{std:.3f}')
+                result_dict[f'{sex} 99% CI {title}'].append(
+                    f'{ci[0]:.3f}-{ci[1]:.3f}')
+                result_dict[f'{sex} 95% Range {title}'].append(
+                    f"[{low:.3f}-{high:.3f}]")
+            _, p_value = ttest_ind_from_stats(*summary["Male"],
+                                              *summary["Female"])
+            result_dict[f'p-val {title}'].append(f'{p_value:.4f}')
+
+    # Same column order as calc_demographics
+    columns = ['Variable']
+    for group in ['all'] + groups:
+        title = group.title()
+        columns += [f'Male Mean±SD {title}', f'Female Mean±SD {title}',
+                    f'p-val {title}', f'Male 99% CI {title}',
+                    f'Male 95% Range {title}', f'Female 99% CI {title}',
+                    f'Female 95% Range {title}']
+    pd.DataFrame(result_dict)[columns].to_csv(
+        str(out_dir / "demographics.csv"), index=False)
+
+    describe = {}
+    for var in described:
+        moments = stats["all"][None][var]["moments"]
+        values = stats["all"][None][var]["values"]
+        describe[var] = [moments.n, moments.mean[0], moments.std[0]] + list(
+            values.quantile([0.0, 0.25, 0.5, 0.75, 1.0]))
+    pd.DataFrame(describe, index=DESCRIBE).to_csv(
+        str(out_dir / "demographics_all.csv"))
@@ -1,14 +1,17 @@
 from pathlib import Path
 import pandas as pd
 from data.util.constants import SCANS_PROCESSED
+from data.util.dataframe import HEALTH_COLUMNS, get_group
+from data.util.tasks import reads, writes
 
 
+@reads(lambda **_: HEALTH_COLUMNS + [
+    "never_smoker", "ex_smoker", "current_smoker", "smoking_status"])
+@writes(lambda out_path, **_: [
+    out_path / "participant_flowchart.csv", out_path / "participant_flowchart.md"])
 def make_chart(data: pd.DataFrame, out_path: Path):
     data_spiro = data[data.GOLD_stage == '0']
-    data_resp = data_spiro[(data_spiro.copd_diagnosis == False)
-                       & (data_spiro.asthma_diagnosis == False)
-                       & (data_spiro.cancer_type != "LONGKANKER")
-                       & (data_spiro.cancer_type != "BORST LONG")]
+    data_resp = get_group(data_spiro, "healthy")
 
     counts = {
         "Processed": SCANS_PROCESSED,
@@ -16,9 +19,9 @@ def make_chart(data: pd.DataFrame, out_path: Path):
         "Abnormal Spirometry": (len(data) - len(data_spiro)),
         "Respiratory Disease": (len(data_spiro) - len(data_resp)),
         "Healthy": len(data_resp),
-        "Healthy Never-Smokers": len(data_resp[data_resp.never_smoker == True]),
-        "Healthy Ex-Smokers": len(data_resp[data_resp.ex_smoker == True]),
-        "Healthy Current-Smokers": len(data_resp[data_resp.current_smoker == True]),
+        "Healthy Never-Smokers": int((data_resp.never_smoker == True).sum()),
+        "Healthy Ex-Smokers": int((data_resp.ex_smoker == True).sum()),
+        "Healthy Current-Smokers": int((data_resp.current_smoker == True).sum()),
         "Healthy No-Status": len(data["smoking_status"].isnull())
     }
 
@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+from data.util.schema import CATEGORIES
+from data.util.tasks import reads, writes
+
+# Columns a reference stratum is keyed by, in the order of the stratum codes
+STRATA = ["sex", "age_5yr", "smoking_status"]
+INDEX_VERSION = 1
+
+
+def _levels(key: str) -> list:
+    return list(CATEGORIES[key].categories)
+
+
+class ReferenceIndex:
+    """
+    Sorted reference values of every bronchial parameter per stratum of sex,
+    age_5yr and smoking status, with the stratum means and standard
+    deviations.
+
+    The values of one parameter are stored as a single array, sorted within
+    each stratum, and offsets[s]:offsets[s + 1] is the slice of stratum s.
+    A percentile is a binary search in that slice and a z-score is closed
+    form, so queries never touch the cohort.
+    """
+
+    def __init__(self, levels: dict, values: dict, offsets: dict):
+        self.levels = levels
+        self.values = values
+        self.offsets = offsets
+        self.mean, self.std = {}, {}
+        for param in values:
+            counts = np.diff(offsets[param])
+            stratum = np.repeat(np.arange(len(counts)), counts)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                mean = np.bincount(stratum, values[param],
+                                   len(counts)) / counts
+                squares = np.bincount(stratum,
+                                      (values[param] - mean[stratum])**2,
+                                      len(counts))
+                self.mean[param] = mean
+                # Sample standard deviation, as pandas' std
+                self.std[param] = np.where(
+                    counts > 1, np.sqrt(squares / (counts - 1)), np.nan)
+
+    @property
+    def params(self) -> list:
+        return list(self.values)
+
+    def counts(self, param: str) -> np.ndarray:
+        return np.diff(self.offsets[param])
+
+    def stratum_codes(self, sex, age_5yr, smoking_status) -> np.ndarray:
+        """
+        Return the stratum code of every row, -1 for labels outside the index.
+
+        Parameters:
+        sex, age_5yr, smoking_status (array-like): The stratum labels.
+
+        Returns:
+        np.ndarray: (n,) integer stratum codes.
+        """
+        codes = np.zeros(len(sex), dtype=np.intp)
+        unknown = np.zeros(len(sex), dtype=bool)
+        for key, labels in zip(STRATA, (sex, age_5yr, smoking_status)):
+            level = pd.Categorical(np.asarray(labels, dtype=object),
+                                   categories=self.levels[key]).codes
+            unknown |= level < 0
+            codes = codes * len(self.levels[key]) + level
+        codes[unknown] = -1
+        return codes
+
+    def percentile(self, param: str, values, codes: np.ndarray) -> np.ndarray:
+        """
+        Percentile of every value within the reference values of its stratum.
+
+        Ties count half, so a value equal to the median of its stratum is at
+        the 50th percentile.
+
+        Parameters:
+        param (str): The bronchial parameter.
+        values (array-like): (n,) measurements, NaN for missing.
+        codes (np.ndarray): (n,) stratum codes from stratum_codes.
+
+        Returns:
+        np.ndarray: (n,) percentiles in [0, 100], NaN for missing values,
+                    unknown or empty strata.
+        """
+        values = np.asarray(values, dtype=float)
+        reference, offsets = self.values[param], self.offsets[param]
+        result = np.full(len(values), np.nan)
+        # One vectorised search per stratum present in the batch
+        order = np.argsort(codes, kind="stable")
+        present, starts = np.unique(codes[order], return_index=True)
+        for code, rows in zip(present, np.split(order, starts[1:])):
+            if code < 0:
+                continue
+            ref = reference[offsets[code]:offsets[code + 1]]
+            if not len(ref):
+                continue
+            x = values[rows]
+            below = np.searchsorted(ref, x, side="left")
+            upto = np.searchsorted(ref, x, side="right")
+            result[rows] = np.where(np.isnan(x), np.nan,
+                                    50.0 * (below + upto) / len(ref))
+        return result
+
+    def zscore(self, param: str, values, codes: np.ndarray) -> np.ndarray:
+        """
+        Standard score of every value against the mean and standard deviation
+        of its stratum.
+
+        Parameters:
+        param (str): The bronchial parameter.
+        values (array-like): (n,) measurements, NaN for missing.
+        codes (np.ndarray): (n,) stratum codes from stratum_codes.
+
+        Returns:
+        np.ndarray: (n,) z-scores, NaN for missing values or unknown strata.
+        """
+        values = np.asarray(values, dtype=float)
+        known = codes >= 0
+        mean = np.where(known, self.mean[param][codes], np.nan)
+        std = np.where(known, self.std[param][codes], np.nan)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return (values - mean) / std
+
+    def score(self, data: pd.DataFrame, params: list = None) -> pd.DataFrame:
+        """
+        Percentile and z-score of every parameter for every row of data.
+
+        Parameters:
+        data (pd.DataFrame): Rows with the STRATA columns and the parameters.
+        params (list): Parameters to score. Default: those of data in the
+                       index.
+
+        Returns:
+        pd.DataFrame: {param}_percentile and {param}_zscore columns, with
+                      the index of data.
+        """
+        if params is None:
+            params = [param for param in self.params if param in data]
+        codes = self.stratum_codes(*(data[key] for key in STRATA))
+        scores = {}
+        for param in params:
+            scores[f"{param}_percentile"] = self.percentile(
+                param, data[param], codes)
+            scores[f"{param}_zscore"] = self.zscore(param, data[param], codes)
+        return pd.DataFrame(scores, index=data.index)
+
+    def save(self, path: Path):
+        """
+        Save the index to an uncompressed npz file.
+        """
+        arrays = {"version": np.array(INDEX_VERSION)}
+        for key in STRATA:
+            arrays[f"levels_{key}"] = np.array(self.levels[key], dtype=str)
+        for param in self.params:
+            arrays[f"values_{param}"] = self.values[param]
+            arrays[f"offsets_{param}"] = self.offsets[param]
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path: Path) -> "ReferenceIndex":
+        """
+        Load an index saved by save.
+
+        Raises:
+        ValueError: If the file holds another version of the index.
+        """
+        with np.load(path, allow_pickle=False) as npz:
+            if int(npz["version"]) != INDEX_VERSION:
+                raise ValueError(f"{path} holds reference index version "
+                                 f"{int(npz['version'])}, "
+                                 f"expected {INDEX_VERSION}")
+            levels = {key: npz[f"levels_{key}"].tolist() for key in STRATA}
+            params = [name[len("values_"):] for name in npz.files
+                      if name.startswith("values_")]
+            values = {param: npz[f"values_{param}"] for param in params}
+            offsets = {param: npz[f"offsets_{param}"] for param in params}
+        return cls(levels, values, offsets)
+
+
+def build_index(data: pd.DataFrame, bps: list) -> ReferenceIndex:
+    """
+    Build the reference index of the given parameters from a reference
+    population.
+
+    Parameters:
+    data (pd.DataFrame): The reference population, with the STRATA columns.
+    bps (list): The parameters to index.
+
+    Returns:
+    ReferenceIndex: The index.
+    """
+    levels = {key: _levels(key) for key in STRATA}
+    index = ReferenceIndex(levels, {}, {})
+    codes = index.stratum_codes(*(data[key] for key in STRATA))
+    n_strata = int(np.prod([len(levels[key]) for key in STRATA]))
+    values, offsets = {}, {}
+    for param in bps:
+        x = data[param].to_numpy(dtype=float)
+        keep = (codes >= 0) & ~np.isnan(x)
+        # Sort by stratum, then by value within each stratum
+        order = np.lexsort((x[keep], codes[keep]))
+        values[param] = x[keep][order]
+        counts = np.bincount(codes[keep], minlength=n_strata)
+        offsets[param] = np.concatenate([[0], np.cumsum(counts)])
+    return ReferenceIndex(levels, values, offsets)
+
+
+@reads(lambda bps, **_: STRATA + bps)
+@writes(lambda out_path, **_: [out_path / "reference_index.npz"])
+def create_index(data: pd.DataFrame, bps: list, out_path: Path):
+    """
+    Build the reference index of bps from data and save it as
+    reference_index.npz, for scoring new measurements without the cohort.
+
+    Parameters:
+    data (pd.DataFrame): The reference population.
+    bps (list): The parameters to index.
+    out_path (Path): The output directory.
+
+    Returns:
+    None
+    """
+    build_index(data, bps).save(out_path / "reference_index.npz")
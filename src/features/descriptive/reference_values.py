@@ -3,7 +3,11 @@
 from pathlib import Path
 import pandas as pd
 
+from data.util.tasks import reads, writes
 
+
+@reads(lambda bps, group_by, **_: ["sex", group_by] + bps)
+@writes(lambda out_path, **_: [out_path / "reference_table.csv"])
 def create_table(data: pd.DataFrame, bps: list, out_path: Path, group_by: str):
     """
     Create a reference table for given data based on group by values and specified bps.
@@ -9,7 +9,7 @@ import scipy.stats as stats
 import statsmodels.api as sm
 from matplotlib.pyplot import text
 
-from src.data.subgroup import get_healthy
+from data.subgroup import get_healthy
 
 
 df = pd.read_csv(sys.stdin)
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+
+import re
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+# Version of the layout of the model artifacts, checked on load
+ARTIFACT_VERSION = 1
+# Treatment-coded column of a categorical variable, e.g. sex[T.Male]
+TREATMENT_TERM = re.compile(r"^(?P<var>.+)\[T\.(?P<level>.+)\]$")
+
+
+def save_artifact(path: Path, kind: str, arrays: dict, data_hash: str):
+    """
+    Save a fitted model as an uncompressed npz file.
+
+    Parameters:
+    path (Path): The file to write.
+    kind (str): The model type, which selects the loader.
+    arrays (dict): Name to array of everything the loader needs.
+    data_hash (str): Hash of the data the model was fitted on.
+
+    Returns:
+    None
+    """
+    np.savez(path,
+             version=np.array(ARTIFACT_VERSION),
+             kind=np.array(kind),
+             data_hash=np.array(data_hash),
+             **arrays)
+
+
+def load_artifact(path: Path):
+    """
+    Load a model saved with save_artifact.
+
+    Returns:
+    LinearModel or UnivariateModels: The predictor of the artifact's kind.
+
+    Raises:
+    ValueError: If the artifact has another version or an unknown kind.
+    """
+    with np.load(path, allow_pickle=False) as npz:
+        arrays = {name: npz[name] for name in npz.files}
+    version = int(arrays.pop("version"))
+    if version != ARTIFACT_VERSION:
+        raise ValueError(f"{path} is a version {version} model artifact, "
+                         f"expected version {ARTIFACT_VERSION}")
+    kind = str(arrays.pop("kind"))
+    if kind not in LOADERS:
+        raise ValueError(f"{path} holds an unknown model kind {kind}")
+    return LOADERS[kind](arrays)
+
+
+def _range(arrays: dict, var: str):
+    # Min-max range a variable was scaled with, None if it was not scaled
+    if f"min_{var}" in arrays:
+        return float(arrays[f"min_{var}"]), float(arrays[f"max_{var}"])
+    return None
+
+
+class LinearModel:
+    """
+    Ordinary least squares fit of one dependent variable, as saved by
+    multivariate.fit_analyse.
+
+    The design matrix is rebuilt from the term names: Intercept, numeric
+    variables, and var[T.level] indicators of the categorical variables
+    (treatment coding, the first level being the reference). Labels renamed
+    for the fit are renamed the same way, labels outside the levels of the
+    fit are missing values, not the reference.
+
+    name keys the scores of the model, the dependent variable unless the
+    loader of the artifact sets another.
+    """
+
+    kind = "ols"
+
+    def __init__(self, arrays: dict):
+        self.arrays = arrays
+        self.dependent = str(arrays["dependent"])
+        self.name = self.dependent
+        self.terms = arrays["terms"].tolist()
+        self.coef = arrays["coef"]
+        self.cov = arrays["cov"]
+        self.scale = float(arrays["scale"])
+        self.df_resid = float(arrays["df_resid"])
+        self.nobs = int(arrays["nobs"])
+        self.data_hash = str(arrays["data_hash"])
+        self.levels = {
+            name[len("levels_"):]: arrays[name].tolist()
+            for name in arrays if name.startswith("levels_")
+        }
+        self.relabel = {
+            name[len("relabel_"):]: dict(arrays[name].tolist())
+            for name in arrays if name.startswith("relabel_")
+        }
+
+    @property
+    def variables(self) -> list:
+        """
+        The columns the design matrix is built from.
+        """
+        variables = {}
+        for term in self.terms[1:]:
+            match = TREATMENT_TERM.match(term)
+            variables[match["var"] if match else term] = None
+        return list(variables)
+
+    def design(self, data: pd.DataFrame) -> np.ndarray:
+        """
+        Build the design matrix of data, NaN in the rows of missing values.
+        """
+        x = np.empty((len(data), len(self.terms)))
+        labels = {}
+        for j, term in enumerate(self.terms):
+            match = TREATMENT_TERM.match(term)
+            if term == "Intercept":
+                x[:, j] = 1.0
+            elif match:
+                var = match["var"]
+                if var not in labels:
+                    column = data[var].astype(object)
+                    column = column.where(column.isna(), column.astype(str))
+                    column = column.replace(self.relabel.get(var, {}))
+                    if var in self.levels:
+                        column = column.where(column.isin(self.levels[var]))
+                    labels[var] = column
+                column = labels[var]
+                x[:, j] = np.where(column.isna(), np.nan,
+                                   column == match["level"])
+            else:
+                x[:, j] = data[term].to_numpy(dtype=float)
+                scaled = _range(self.arrays, term)
+                if scaled is not None:
+                    low, high = scaled
+                    x[:, j] = (x[:, j] - low) / (high - low)
+        return x
+
+    def predict(self, data: pd.DataFrame) -> np.ndarray:
+        """
+        Predict the dependent variable, in its original units.
+        """
+        y = self.design(data) @ self.coef
+        scaled = _range(self.arrays, self.dependent)
+        if scaled is not None:
+            low, high = scaled
+            y = y * (high - low) + low
+        return y
+
+    def standard_error(self, data: pd.DataFrame) -> np.ndarray:
+        """
+        Standard error of the mean prediction, in the units of the fit.
+        """
+        x = self.design(data)
+        return np.sqrt(np.einsum("ij,jk,ik->i", x, self.cov, x))
+
+    @property
+    def residual_sd(self) -> float:
+        """
+        Residual standard deviation, in the original units.
+        """
+        sd = np.sqrt(self.scale)
+        scaled = _range(self.arrays, self.dependent)
+        if scaled is not None:
+            sd *= scaled[1] - scaled[0]
+        return sd
+
+
+class UnivariateModels:
+    """
+    Simple least squares fits bp = intercept + slope * var of every bp on
+    every independent variable per sex, as saved by
+    univariate.fit_analyse_batch. Every statistic is a (sex, var, bp) array.
+    """
+
+    kind = "univariate_ols"
+
+    def __init__(self, arrays: dict):
+        self.arrays = arrays
+        self.sexes = arrays["sexes"].tolist()
+        self.i_vars = arrays["i_vars"].tolist()
+        self.bps = arrays["bps"].tolist()
+        self.intercept = arrays["intercept"]
+        self.slope = arrays["slope"]
+        self.n = arrays["n"]
+        self.scale = arrays["scale"]
+        self.cov = arrays["cov"]
+        self.data_hash = str(arrays["data_hash"])
+
+    def predict(self, i_var: str, bp: str, x, sex) -> np.ndarray:
+        """
+        Predict bp from i_var for every row, in the original units.
+
+        Parameters:
+        i_var (str): The independent variable.
+        bp (str): The bronchial parameter.
+        x (array-like): (n,) values of i_var.
+        sex (array-like): (n,) sex of every row.
+
+        Returns:
+        np.ndarray: (n,) predictions, NaN for unknown sexes or missing x.
+        """
+        i, j = self.i_vars.index(i_var), self.bps.index(bp)
+        x = np.asarray(x, dtype=float)
+        scaled = _range(self.arrays, i_var)
+        if scaled is not None:
+            x = (x - scaled[0]) / (scaled[1] - scaled[0])
+        codes = pd.Categorical(np.asarray(sex, dtype=object),
+                               categories=self.sexes).codes
+        known = codes >= 0
+        intercept = np.where(known, self.intercept[codes, i, j], np.nan)
+        slope = np.where(known, self.slope[codes, i, j], np.nan)
+        y = intercept + slope * x
+        scaled = _range(self.arrays, bp)
+        if scaled is not None:
+            y = y * (scaled[1] - scaled[0]) + scaled[0]
+        return y
+
+    def residual_sd(self, i_var: str, bp: str, sex) -> np.ndarray:
+        """
+        Residual standard deviation of the fit of bp on i_var for the sex of
+        every row, in the original units, NaN for unknown sexes.
+        """
+        i, j = self.i_vars.index(i_var), self.bps.index(bp)
+        codes = pd.Categorical(np.asarray(sex, dtype=object),
+                               categories=self.sexes).codes
+        sd = np.where(codes >= 0, np.sqrt(self.scale[codes, i, j]), np.nan)
+        scaled = _range(self.arrays, bp)
+        if scaled is not None:
+            sd = sd * (scaled[1] - scaled[0])
+        return sd
+
+
+LOADERS = {model.kind: model for model in (LinearModel, UnivariateModels)}
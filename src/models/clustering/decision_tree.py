@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+
+import logging
+import time
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from sklearn.model_selection import StratifiedKFold
+
+from data.util.tasks import reads, writes
+
+logger = logging.getLogger("BronchialParameters")
+
+# Airway measures and covariates the trees split on
+tree_features = [
+    "bp_pi10", "bp_wt_avg", "bp_la_avg", "bp_wap_avg", "tac", "age",
+    "height", "weight", "bmi"
+]
+# Bin codes fit in a uint8, the last code is kept for missing values
+MAX_BINS = 255
+MISSING_BIN = MAX_BINS
+
+
+def bin_columns(x: np.ndarray, max_bins: int = MAX_BINS) -> np.ndarray:
+    """
+    Replace every column by the index of its quantile bin.
+
+    Each column is cut at up to max_bins - 1 of its quantiles, so split
+    search only has to consider the bin edges. Missing values get their
+    own bin, MISSING_BIN, which sorts after every other bin.
+
+    Parameters:
+    x (np.ndarray): (n, f) array of features, NaN for missing.
+    max_bins (int): Number of bins per column, at most 255.
+
+    Returns:
+    np.ndarray: (n, f) uint8 array of bin codes.
+    """
+    codes = np.full(x.shape, MISSING_BIN, dtype=np.uint8)
+    quantiles = np.linspace(0, 1, max_bins + 1)[1:-1]
+    for j in range(x.shape[1]):
+        present = ~np.isnan(x[:, j])
+        if not present.any():
+            continue
+        edges = np.unique(np.quantile(x[present, j], quantiles))
+        codes[present, j] = np.searchsorted(edges, x[present, j], side="right")
+    return codes
+
+
+def _histogram(codes: np.ndarray, y: np.ndarray, n_classes: int) -> np.ndarray:
+    # (features, bins, classes) counts of the rows of one node, in a single
+    # bincount over all features
+    n_features = codes.shape[1]
+    size = (MAX_BINS + 1) * n_classes
+    flat = (codes.astype(np.intp) * n_classes + y[:, None] +
+            np.arange(n_features) * size)
+    counts = np.bincount(flat.ravel(), minlength=n_features * size)
+    return counts.reshape(n_features, MAX_BINS + 1, n_classes)
+
+
+def _best_split(hist: np.ndarray, min_samples_leaf: int, features: np.ndarray):
+    # Score every threshold of every feature from the cumulative class counts,
+    # O(bins) per feature whatever the number of rows in the node
+    left = hist.cumsum(axis=1)[:, :-1]
+    total = hist.sum(axis=1)[:, None]
+    right = total - left
+    n_left = left.sum(axis=2)
+    n_right = right.sum(axis=2)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # Maximising this minimises the weighted Gini impurity of the children
+        score = ((left**2).sum(axis=2) / n_left +
+                 (right**2).sum(axis=2) / n_right)
+    valid = (n_left >= min_samples_leaf) & (n_right >= min_samples_leaf)
+    valid[~np.isin(np.arange(len(hist)), features)] = False
+    score = np.where(valid, score, -np.inf)
+    feature, threshold = np.unravel_index(np.argmax(score), score.shape)
+    return feature, threshold, score[feature, threshold]
+
+
+class HistTree:
+    """
+    Classification tree grown on binned features.
+
+    Node histograms hold the class counts per bin of every feature. Only the
+    smaller child of a split is histogrammed, the larger one is its parent's
+    histogram minus the smaller one's.
+    """
+
+    def __init__(self,
+                 max_depth: int = 8,
+                 min_samples_leaf: int = 20,
+                 max_features: int = None,
+                 seed: int = 0):
+        self.max_depth = max_depth
+        self.min_samples_leaf = min_samples_leaf
+        self.max_features = max_features
+        self.rng = np.random.default_rng(seed)
+
+    def fit(self, codes: np.ndarray, y: np.ndarray, n_classes: int):
+        """
+        Grow the tree.
+
+        Parameters:
+        codes (np.ndarray): (n, f) uint8 bin codes from bin_columns.
+        y (np.ndarray): (n,) integer class codes.
+        n_classes (int): Number of classes.
+
+        Returns:
+        HistTree: The fitted tree.
+        """
+        n_features = codes.shape[1]
+        self.feature, self.threshold = [], []
+        self.left, self.right, self.value = [], [], []
+        self.importance = np.zeros(n_features)
+
+        def add_node(counts):
+            self.feature.append(-1)
+            self.threshold.append(0)
+            self.left.append(-1)
+            self.right.append(-1)
+            self.value.append(counts)
+            return len(self.value) - 1
+
+        rows = np.arange(len(y))
+        hist = _histogram(codes, y, n_classes)
+        stack = [(add_node(hist[0].sum(axis=0)), rows, hist, 0)]
+        while stack:
+            node, rows, hist, depth = stack.pop()
+            counts = self.value[node]
+            if (depth == self.max_depth or len(rows) < 2 * self.min_samples_leaf
+                    or np.count_nonzero(counts) < 2):
+                continue
+            features = np.arange(n_features)
+            if self.max_features is not None:
+                features = self.rng.choice(n_features,
+                                           self.max_features,
+                                           replace=False)
+            feature, threshold, score = _best_split(hist,
+                                                    self.min_samples_leaf,
+                                                    features)
+            gain = score - (counts**2).sum() / len(rows)
+            if not np.isfinite(score) or gain <= 0:
+                continue
+
+            goes_left = codes[rows, feature] <= threshold
+            left_rows, right_rows = rows[goes_left], rows[~goes_left]
+            if len(left_rows) <= len(right_rows):
+                left_hist = _histogram(codes[left_rows], y[left_rows], n_classes)
+                right_hist = hist - left_hist
+            else:
+                right_hist = _histogram(codes[right_rows], y[right_rows],
+                                        n_classes)
+                left_hist = hist - right_hist
+
+            self.feature[node] = feature
+            self.threshold[node] = threshold
+            self.importance[feature] += gain
+            self.left[node] = add_node(left_hist[0].sum(axis=0))
+            self.right[node] = add_node(right_hist[0].sum(axis=0))
+            stack.append((self.left[node], left_rows, left_hist, depth + 1))
+            stack.append((self.right[node], right_rows, right_hist, depth + 1))
+
+        self.feature = np.array(self.feature)
+        self.threshold = np.array(self.threshold)
+        self.left = np.array(self.left)
+        self.right = np.array(self.right)
+        self.value = np.array(self.value, dtype=float)
+        self.value /= self.value.sum(axis=1, keepdims=True)
+        return self
+
+    def predict_proba(self, codes: np.ndarray) -> np.ndarray:
+        """
+        Return the class frequencies of the leaf every row falls in.
+        """
+        node = np.zeros(len(codes), dtype=np.intp)
+        rows = np.arange(len(codes))
+        while True:
+            internal = self.left[node] >= 0
+            if not internal.any():
+                return self.value[node]
+            at = node[internal]
+            goes_left = (codes[rows[internal], self.feature[at]] <=
+                         self.threshold[at])
+            node[internal] = np.where(goes_left, self.left[at], self.right[at])
+
+
+class HistForest:
+    """
+    Random forest of HistTrees: every tree is grown on a bootstrap sample
+    of the rows and picks each split among a random subset of the features.
+    All trees share the same bin codes.
+    """
+
+    def __init__(self,
+                 n_trees: int = 50,
+                 max_depth: int = 8,
+                 min_samples_leaf: int = 20,
+                 seed: int = 0):
+        self.n_trees = n_trees
+        self.max_depth = max_depth
+        self.min_samples_leaf = min_samples_leaf
+        self.seed = seed
+
+    def fit(self, codes: np.ndarray, y: np.ndarray, n_classes: int):
+        rng = np.random.default_rng(self.seed)
+        max_features = max(1, int(np.sqrt(codes.shape[1])))
+        self.trees = []
+        for i in range(self.n_trees):
+            sample = rng.integers(0, len(y), len(y))
+            tree = HistTree(self.max_depth, self.min_samples_leaf,
+                            max_features, seed=self.seed + i)
+            self.trees.append(tree.fit(codes[sample], y[sample], n_classes))
+        self.importance = np.mean([tree.importance for tree in self.trees],
+                                  axis=0)
+        return self
+
+    def predict_proba(self, codes: np.ndarray) -> np.ndarray:
+        return np.mean([tree.predict_proba(codes) for tree in self.trees],
+                       axis=0)
+
+
+def _balanced_accuracy(y: np.ndarray, predicted: np.ndarray) -> float:
+    return np.mean([(predicted[y == c] == c).mean() for c in np.unique(y)])
+
+
+@reads(lambda target, features=tree_features, **_: [target] + features)
+@writes(lambda target, out_path, **_: [
+    out_path / f"tree_{target}.csv",
+    out_path / f"tree_{target}_importance.csv"])
+def cross_validate(data: pd.DataFrame,
+                   target: str,
+                   out_path: Path,
+                   features: list = tree_features,
+                   folds: int = 5,
+                   seed: int = 0):
+    """
+    Cross-validate a histogram tree and forest predicting target from the
+    airway measures.
+
+    The features are binned once for the whole cohort (the bin edges do not
+    depend on the target), then every fold grows its models from the bins.
+
+    Parameters:
+    data (pd.DataFrame): The data frame to model.
+    target (str): The column to predict, e.g. smoking_status or GOLD_stage.
+    out_path (Path): The output directory where tree_{target}.csv and
+                     tree_{target}_importance.csv are saved.
+    features (list): The columns the trees split on.
+    folds (int): Number of stratified cross-validation folds.
+    seed (int): Seed of the fold split and of the forest.
+
+    Returns:
+    None
+    """
+    data = data.dropna(subset=[target])
+    y, classes = pd.factorize(data[target], sort=True)
+    results, importance = [], pd.DataFrame(index=features)
+
+    if len(classes) < 2 or np.bincount(y).min() < folds:
+        logger.warning(f"Too few classes or participants to predict {target}")
+    else:
+        codes = bin_columns(data[features].to_numpy(dtype=float))
+        splits = StratifiedKFold(folds, shuffle=True,
+                                 random_state=seed).split(codes, y)
+        models = {
+            "Tree": lambda: HistTree(seed=seed),
+            "Forest": lambda: HistForest(seed=seed),
+        }
+        scores = {name: [] for name in models}
+        start = time.perf_counter()
+        for train, test in splits:
+            for name, model in models.items():
+                fitted = model().fit(codes[train], y[train], len(classes))
+                predicted = fitted.predict_proba(codes[test]).argmax(axis=1)
+                scores[name].append(((predicted == y[test]).mean(),
+                                     _balanced_accuracy(y[test], predicted)))
+        logger.debug(f"{folds}-fold cross-validation of {target} took "
+                     f"{time.perf_counter() - start:.1f}s")
+
+        for name, fold_scores in scores.items():
+            accuracy, balanced = np.array(fold_scores).T
+            results.append({
+                "Model": name,
+                "Target": target,
+                "N": len(y),
+                "Classes": len(classes),
+                "Accuracy": accuracy.mean().round(4),
+                "Accuracy SD": accuracy.std().round(4),
+                "Balanced Accuracy": balanced.mean().round(4),
+                "Majority Baseline": (np.bincount(y).max() / len(y)).round(4),
+            })
+            fitted = models[name]().fit(codes, y, len(classes))
+            total = fitted.importance.sum() or 1.0
+            importance[name] = (fitted.importance / total).round(4)
+
+    pd.DataFrame(results).to_csv(out_path / f"tree_{target}.csv", index=False)
+    importance.to_csv(out_path / f"tree_{target}_importance.csv",
+                      index_label="Feature")
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+
+import logging
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from sklearn.cluster import MiniBatchKMeans
+
+from data.util.cache import file_hash
+from data.util.dataframe import HEALTH_COLUMNS, get_group, normalise_bps
+from data.util.schema import CATEGORIES, apply_schema
+from data.util.store import iter_chunks
+from data.util.tasks import keyed, reads, writes
+
+logger = logging.getLogger("BronchialParameters")
+
+# Per-generation airway profile the participants are clustered on
+profile_params = [
+    "bp_wt_3", "bp_wt_4", "bp_wt_5", "bp_la_3", "bp_la_4", "bp_la_5",
+    "bp_wap_3", "bp_wap_4", "bp_wap_5", "bp_pi10", "tac"
+]
+
+
+def group_chunks(source: Path, chunk_size: int, columns: list,
+                 health_stat: str, normalise: list = None):
+    """
+    Yield the participants of a health group from a csv or feather dataset,
+    one chunk of rows at a time, as analyse.py selects them from the whole
+    dataset.
+
+    Parameters:
+    source (Path): The csv or feather dataset.
+    chunk_size (int): Rows read per chunk.
+    columns (list): The columns to read, besides those of the group.
+    health_stat (str): The group, see get_group.
+    normalise (list): Columns to normalise by height, those not read are
+                      left out. Default: none.
+
+    Yields:
+    pd.DataFrame: The next chunk_size rows of the group, fewer at the end.
+    """
+    columns = HEALTH_COLUMNS + columns + (["height"] if normalise else [])
+    normalise = [col for col in normalise or [] if col in columns]
+    # Labels stay text whichever values a chunk happens to hold
+    labels = {col: str for col in CATEGORIES}
+    pending = []
+    for chunk in iter_chunks(source, chunk_size, columns, dtype=labels):
+        chunk = get_group(apply_schema(chunk), health_stat)
+        if normalise:
+            chunk = normalise_bps(chunk, normalise)
+        pending.append(chunk)
+        # Regroup the selected rows into full chunks, so the mini-batches do
+        # not depend on how the group is spread over the file
+        if sum(len(part) for part in pending) >= chunk_size:
+            rows = pd.concat(pending)
+            pending = [rows.iloc[chunk_size:]]
+            yield rows.iloc[:chunk_size]
+    rest = pd.concat(pending) if pending else []
+    if len(rest):
+        yield rest
+
+
+class StreamingScaler:
+    """
+    Column means and standard deviations accumulated over chunks, so the
+    features can be standardised without holding the cohort at once.
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.sum = 0.0
+        self.sum_sq = 0.0
+
+    def partial_fit(self, x: np.ndarray):
+        # Shifted by the first chunk's mean to keep the sums well conditioned
+        if self.n == 0:
+            self.shift = x.mean(axis=0)
+        x = x - self.shift
+        self.n += len(x)
+        self.sum = self.sum + x.sum(axis=0)
+        self.sum_sq = self.sum_sq + (x**2).sum(axis=0)
+        return self
+
+    @property
+    def mean(self) -> np.ndarray:
+        return self.shift + self.sum / self.n
+
+    @property
+    def std(self) -> np.ndarray:
+        var = self.sum_sq / self.n - (self.sum / self.n)**2
+        std = np.sqrt(np.maximum(var, 0.0))
+        return np.where(std > 0, std, 1.0)
+
+    def transform(self, x: np.ndarray) -> np.ndarray:
+        return (x - self.mean) / self.std
+
+
+def _features(chunk: pd.DataFrame, params: list):
+    # Rows with the whole profile, as a float array, and their participants
+    chunk = chunk.dropna(subset=params)
+    return chunk, chunk[params].to_numpy(dtype=float)
+
+
+def fit_streaming(chunks, params: list, n_clusters: int = 4,
+                  epochs: int = 3, batch_size: int = 1024, seed: int = 0):
+    """
+    Fit a mini-batch k-means over a stream of chunks.
+
+    The chunks are read epochs + 1 times: once to standardise the features,
+    then once per epoch of mini-batch updates. Only one chunk is held at a
+    time, so memory is bounded by the chunk size, not by the cohort.
+    Chunks with fewer complete rows than clusters are skipped until the
+    centroids are initialised.
+
+    Parameters:
+    chunks (callable): Returns a new iterator of DataFrame chunks per call.
+    params (list): The columns to cluster on.
+    n_clusters (int): Number of clusters.
+    epochs (int): Passes of mini-batch updates over the stream.
+    batch_size (int): Rows per mini-batch update.
+    seed (int): Seed of the centroid initialisation and of the mini-batch
+                sampling. None gives a different clustering on every run.
+
+    Returns:
+    tuple: The fitted StreamingScaler and sklearn MiniBatchKMeans.
+
+    Raises:
+    ValueError: If no chunk has n_clusters complete rows.
+    """
+    scaler = StreamingScaler()
+    for chunk in chunks():
+        _, x = _features(chunk, params)
+        if len(x):
+            scaler.partial_fit(x)
+
+    model = MiniBatchKMeans(n_clusters=n_clusters,
+                            batch_size=batch_size,
+                            n_init=3,
+                            random_state=seed)
+    for epoch in range(epochs):
+        for chunk in chunks():
+            _, x = _features(chunk, params)
+            # The first update picks the initial centroids among its rows
+            if len(x) < n_clusters and not hasattr(model, "cluster_centers_"):
+                continue
+            if len(x):
+                model.partial_fit(scaler.transform(x))
+    if not hasattr(model, "cluster_centers_"):
+        raise ValueError(f"No chunk has {n_clusters} participants with the "
+                         f"whole profile {params} to start the clustering")
+    logger.debug(f"Mini-batch k-means over {scaler.n} participants, "
+                 f"inertia {model.inertia_:.1f}")
+    return scaler, model
+
+
+# The rows are streamed from the dataset, not read from the loaded frame
+@reads(lambda **_: [])
+@keyed(lambda data, source, **_: file_hash(source))
+@writes(lambda out_path, **_: [
+    out_path / "kmeans_centroids.csv", out_path / "kmeans_assignments.csv"])
+def cluster(data: pd.DataFrame,
+            out_path: Path,
+            source: Path,
+            health_stat: str = "healthy",
+            normalise: list = None,
+            params: list = profile_params,
+            n_clusters: int = 4,
+            chunk_size: int = 2048,
+            seed: int = 0):
+    """
+    Cluster participants by their airway profile with a mini-batch k-means
+    streamed over chunks of the dataset file, so the cohort is never held
+    in memory.
+
+    Writes the centroids in the original units with the size of each
+    cluster to kmeans_centroids.csv, and the cluster of every participant
+    and its distance to the centroid (in standard deviations) to
+    kmeans_assignments.csv, one chunk at a time.
+
+    Parameters:
+    data (pd.DataFrame): Unused, the rows are read from source.
+    out_path (Path): The output directory where the CSV files are saved.
+    source (Path): The csv or feather dataset.
+    health_stat (str): The group of participants to cluster.
+    normalise (list): Columns to normalise by height. Default: none.
+    params (list): The columns to cluster on.
+    n_clusters (int): Number of clusters.
+    chunk_size (int): Rows read per chunk.
+    seed (int): Seed for a reproducible clustering, None for a random one.
+
+    Returns:
+    None
+
+    Raises:
+    ValueError: If no chunk has n_clusters complete rows.
+    """
+    def chunks():
+        return group_chunks(source, chunk_size, ["patientID"] + params,
+                            health_stat, normalise)
+
+    scaler, model = fit_streaming(chunks, params, n_clusters, seed=seed)
+
+    sizes = np.zeros(n_clusters, dtype=int)
+    assignments = out_path / "kmeans_assignments.csv"
+    header = True
+    for chunk in chunks():
+        chunk, x = _features(chunk, params)
+        if not len(x):
+            continue
+        distances = model.transform(scaler.transform(x))
+        labels = distances.argmin(axis=1)
+        sizes += np.bincount(labels, minlength=n_clusters)
+        pd.DataFrame({
+            "patientID": chunk["patientID"].to_numpy(),
+            "Cluster": labels,
+            "Distance": distances.min(axis=1).round(4),
+        }).to_csv(assignments, mode="w" if header else "a", header=header,
+                  index=False)
+        header = False
+
+    centroids = pd.DataFrame(model.cluster_centers_ * scaler.std + scaler.mean,
+                             columns=params).round(3)
+    centroids.insert(0, "N", sizes)
+    centroids.to_csv(out_path / "kmeans_centroids.csv", index_label="Cluster")
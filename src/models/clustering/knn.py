@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+import logging
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import KDTree
+
+from data.util.tasks import reads, writes
+
+logger = logging.getLogger("BronchialParameters")
+
+# Bronchial parameters spanning the feature space of the neighbour search
+knn_params = ["bp_pi10", "bp_wt_avg", "bp_la_avg", "bp_wap_avg", "tac"]
+
+
+def standardise(x: np.ndarray) -> np.ndarray:
+    """
+    Scale every column to zero mean and unit variance, so each parameter
+    weighs the same in the euclidean distance.
+    """
+    std = x.std(axis=0)
+    return (x - x.mean(axis=0)) / np.where(std > 0, std, 1.0)
+
+
+def neighbours(x: np.ndarray, k: int, leaf_size: int = 40) -> np.ndarray:
+    """
+    Find the k nearest neighbours of every row of x among the other rows.
+
+    A KD-tree is built once over x and queried for all rows in one batch,
+    which takes O(n log n) rather than the O(n^2) of comparing every pair.
+
+    Parameters:
+    x (np.ndarray): (n, d) array of standardised features.
+    k (int): Number of neighbours, less than n.
+    leaf_size (int): Leaf size of the KD-tree.
+
+    Returns:
+    np.ndarray: (n, k) array of neighbour row indices, nearest first.
+    """
+    tree = KDTree(x, leaf_size=leaf_size)
+    ind = tree.query(x, k=k + 1, return_distance=False)
+    is_self = ind == np.arange(len(x))[:, None]
+    # A duplicate of a row can be returned in its place, then the furthest
+    # neighbour is dropped instead
+    is_self[~is_self.any(axis=1), -1] = True
+    return ind[~is_self].reshape(len(x), k)
+
+
+def vote(labels: np.ndarray, ind: np.ndarray, n_classes: int) -> np.ndarray:
+    """
+    Predict each row's label as the most common label of its neighbours.
+    Ties go to the class with the lowest code.
+
+    Parameters:
+    labels (np.ndarray): (n,) integer class codes.
+    ind (np.ndarray): (n, k) neighbour row indices.
+    n_classes (int): Number of classes.
+
+    Returns:
+    np.ndarray: (n,) predicted class codes.
+    """
+    votes = (labels[ind][..., None] == np.arange(n_classes)).sum(axis=1)
+    return votes.argmax(axis=1)
+
+
+@reads(lambda params=knn_params, target="smoking_status", **_: [
+    "sex", target] + params)
+@writes(lambda out_path, target="smoking_status", **_: [
+    out_path / f"knn_{target}.csv"])
+def classify(data: pd.DataFrame,
+             out_path: Path,
+             params: list = knn_params,
+             target: str = "smoking_status",
+             k: int = 15):
+    """
+    Classify participants by a neighbour vote over the standardised bronchial
+    parameters and report how well the vote recovers the target, per sex.
+
+    Every participant is classified by its k nearest other participants
+    (leave-one-out), against the baseline of always predicting the most
+    common class.
+
+    Parameters:
+    data (pd.DataFrame): The data frame to classify.
+    out_path (Path): The output directory where knn_{target}.csv is saved.
+    params (list): The parameters spanning the feature space.
+    target (str): The column holding the class of each participant.
+    k (int): Number of neighbours voting.
+
+    Returns:
+    None
+    """
+    results = []
+    for sex in ["Male", "Female"]:
+        sex_data = data[data["sex"] == sex].dropna(subset=params + [target])
+        if len(sex_data) < 2:
+            logger.warning(f"Too few {sex} participants for a k-NN vote")
+            continue
+        codes, classes = pd.factorize(sex_data[target], sort=True)
+        n_neighbours = min(k, len(sex_data) - 1)
+        logger.debug(
+            f"{n_neighbours}-NN vote over {len(sex_data)} {sex} participants")
+
+        x = standardise(sex_data[params].to_numpy(dtype=float))
+        predicted = vote(codes, neighbours(x, n_neighbours), len(classes))
+
+        correct = predicted == codes
+        result = {
+            "Group": sex,
+            "Target": target,
+            "N": len(sex_data),
+            "k": n_neighbours,
+            "Accuracy": correct.mean().round(4),
+            "Majority Baseline": (np.bincount(codes).max() / len(codes)).round(4),
+        }
+        recalls = [correct[codes == i].mean() for i in range(len(classes))]
+        result["Balanced Accuracy"] = np.mean(recalls).round(4)
+        for i, label in enumerate(classes):
+            result[f"Recall {label}"] = recalls[i].round(4)
+        results.append(result)
+
+    pd.DataFrame(results).to_csv(out_path / f"knn_{target}.csv", index=False)
@@ -1,28 +1,159 @@
 #!/usr/bin/env python3
 
 import logging
+from functools import partial
+import numpy as np
+import pandas as pd
+import patsy
 import statsmodels.api as sm
+from scipy import stats
+
+from data.util.cache import frame_hash
+from data.util.moments import Extent, Moments, accumulate
+from data.util.schema import CATEGORIES, SMOKING_LABELS
+from data.util.shards import (SHARD_KEY, combine_hashes, map_shards,
+                              merge_shards)
+from data.util.tasks import reads, writes
+from models.artifacts import LinearModel, save_artifact
 
 logger = logging.getLogger("BronchialParameters")
 
+# Independent variables of every model
+independent_vars = [
+    "sex",
+    "age",
+    "height",
+    "weight",
+    "current_smoker",
+    "pack_year_categories",
+    "tac"
+]
+# Labels renamed in the model frame, saved with the models so the labels of
+# new data are read the same way
+relabelled = {"pack_year_categories": {"0": "0 pack-years"}}
+# Covariates of the per-stratum models the nomograms are drawn from
+nomogram_covariates = ["bmi", "age"]
+# Covariate range covered by the fits, as quantiles of each stratum
+covariate_range = (0.01, 0.99)
+
+
+def _suffix(min_max_params: bool) -> str:
+    return "_normalised" if min_max_params else ""
+
+
+def save_model(path, model, param: str, data_hash: str, ranges: dict = None):
+    """
+    Save a fitted statsmodels OLS model as an artifact LinearModel loads,
+    see save_fit.
+
+    Parameters:
+    path (Path): The npz file to write.
+    model: The fitted statsmodels regression results.
+    param (str): The dependent variable.
+    data_hash (str): Hash of the data the model was fitted on.
+    ranges (dict): Variable to (min, max), for min-max scaled models.
+
+    Returns:
+    None
+    """
+    design_info = model.model.data.design_info
+    levels = {
+        factor.name(): info.categories
+        for factor, info in design_info.factor_infos.items()
+        if info.type == "categorical"
+    }
+    fit = {
+        "coef": model.params.to_numpy(),
+        "cov": model.cov_params().to_numpy(),
+        "scale": model.scale,
+        "df_resid": model.df_resid,
+        "nobs": model.nobs,
+    }
+    save_fit(path, fit, param, model.model.exog_names, levels, data_hash,
+             ranges)
+
+
+def save_fit(path, fit: dict, param: str, terms: list, levels: dict,
+             data_hash: str, ranges: dict = None):
+    """
+    Save a least-squares fit as an artifact LinearModel loads: its terms,
+    coefficients, covariance matrix, residual scale, the levels of its
+    categorical variables with the labels renamed in the model frame and,
+    for scaled models, the ranges the variables were min-max scaled with.
+
+    Parameters:
+    path (Path): The npz file to write.
+    fit (dict): "coef", "cov", "scale", "df_resid" and "nobs" of the fit.
+    param (str): The dependent variable.
+    terms (list): The names of the columns of the design matrix.
+    levels (dict): Categorical variable to its levels.
+    data_hash (str): Hash of the data the model was fitted on.
+    ranges (dict): Variable to (min, max), for min-max scaled models.
+
+    Returns:
+    None
+    """
+    arrays = {
+        "dependent": np.array(param),
+        "terms": np.array(terms),
+        "coef": np.asarray(fit["coef"]),
+        "cov": np.asarray(fit["cov"]),
+        "scale": np.array(fit["scale"]),
+        "df_resid": np.array(fit["df_resid"]),
+        "nobs": np.array(int(fit["nobs"])),
+    }
+    for name, categories in levels.items():
+        arrays[f"levels_{name}"] = np.array(
+            [str(level) for level in categories])
+        if name in relabelled:
+            arrays[f"relabel_{name}"] = np.array(
+                list(relabelled[name].items()), dtype=str)
+    for var, (low, high) in (ranges or {}).items():
+        if var in terms or var == param:
+            arrays[f"min_{var}"] = np.array(float(low))
+            arrays[f"max_{var}"] = np.array(float(high))
+    save_artifact(path, LinearModel.kind, arrays, data_hash)
+
+
+def _model_frame(data, bps):
+    # Work on a projection of the model columns so the caller's data is
+    # never modified by the recoding and scaling below
+    data = data.loc[:, list(dict.fromkeys(independent_vars + bps))]
+    for col, labels in relabelled.items():
+        data[col] = data[col].replace(labels)
+    # patsy cannot read nullable booleans, give it objects with NaN for NA
+    for col in data.select_dtypes("boolean"):
+        data[col] = data[col].astype(object).where(data[col].notna(), np.nan)
+    return data
+
+
+def _numeric(data) -> list:
+    # The columns min-max scaled for normalised models
+    return [var for var in data
+            if data[var].dtype == int or data[var].dtype == float]
 
-def fit_analyse(data, bps, out_path, min_max_params=False):
-    data["pack_year_categories"] = data["pack_year_categories"].replace(
-        "0", "0 pack-years"
-    )
+
+@reads(lambda bps, shards=1, **_: independent_vars + bps +
+       ([SHARD_KEY] if shards > 1 else []))
+@writes(lambda bps, out_path, min_max_params=False, **_: [
+    out_path / f"multivariate_{kind}_{param}{_suffix(min_max_params)}.{ext}"
+    for param in bps for kind, ext in (("report", "txt"), ("model", "npz"))])
+def fit_analyse(data, bps, out_path, min_max_params=False, shards=1):
+    if shards > 1:
+        return fit_analyse_sharded(data, bps, out_path, min_max_params, shards)
+    data = _model_frame(data, bps)
+    data_hash = frame_hash(data)
+    # Levels no participant has would get all-zero dummy columns and make
+    # the design singular, patsy is only given the observed ones
+    for col in data.select_dtypes("category"):
+        data[col] = data[col].cat.remove_unused_categories()
+    # Ranges the numeric columns are min-max scaled from, saved with the
+    # models so they can be applied to new data
+    ranges = {
+        var: (data[var].min(), data[var].max()) for var in _numeric(data)
+    } if min_max_params else None
     # Perform multivariate linear regression for each dependent variable
     for param in bps:
-        # Extract independent variables
-        independent_vars = [
-            "sex",
-            "age",
-            "height",
-            "weight",
-            "current_smoker",
-            "pack_year_categories",
-            "tac"
-        ]
-
         # Normalising the data
         if min_max_params:
             for var in independent_vars:
@@ -47,3 +178,343 @@ def fit_analyse(data, bps, out_path, min_max_params=False):
         # Save the results to a text file
         with open(output_file, "w") as f:
             f.write(str(model.summary()))
+        save_model(
+            out_path / f"multivariate_model_{param}{_suffix(min_max_params)}.npz",
+            model, param, data_hash, ranges)
+
+
+def shard_moments(data, bps) -> dict:
+    """
+    Compute the mergeable statistics of one shard behind the multivariate
+    models: per bp the moments of the design matrix columns and the bp over
+    the complete rows, the extent of the numeric columns, the design and
+    the hash of the shard.
+    """
+    data = _model_frame(data, bps)
+    stats = {
+        "hash": frame_hash(data),
+        "extent": {
+            var: Extent.of(data[var].to_numpy(dtype=float))
+            for var in _numeric(data)
+        },
+        "design": {},
+    }
+    # The recoded booleans get fixed levels, so every shard has the same
+    # design columns whichever answers it holds
+    for col in data.select_dtypes(object):
+        data[col] = pd.Categorical(data[col], categories=[False, True])
+    for param in bps:
+        formula = param + " ~ " + " + ".join(independent_vars)
+        y, x = patsy.dmatrices(formula, data, NA_action="drop",
+                               return_type="dataframe")
+        levels = {
+            factor.name(): [str(level) for level in info.categories]
+            for factor, info in x.design_info.factor_infos.items()
+            if info.type == "categorical"
+        }
+        stats["design"][param] = [list(x.columns), levels]
+        stats[param] = Moments.of(
+            np.column_stack([x.to_numpy()[:, 1:], y.to_numpy()]))
+    return stats
+
+
+def _observed(terms: list, levels: dict, moments: Moments) -> tuple:
+    """
+    Drop the levels no complete row has from a design of shard_moments, as
+    their all-zero columns make it singular. The sum of a dummy column is
+    the count of its level, the reference level has the remaining rows. A
+    variable whose reference level is unobserved takes its first observed
+    level as reference, as fit_analyse does without the unused categories.
+
+    Returns:
+    tuple: The terms, the observed levels and the moments of the kept
+           columns and the bp.
+    """
+    keep = list(range(len(terms) - 1))
+    observed = {}
+    for var, names in levels.items():
+        columns = {level: terms.index(f"{var}[T.{level}]") - 1
+                   for level in names[1:]}
+        counts = {level: moments.total[i] for level, i in columns.items()}
+        counts[names[0]] = moments.n - sum(counts.values())
+        observed[var] = [level for level in names if counts[level] > 0.5]
+        for level, i in columns.items():
+            if level not in observed[var][1:]:
+                keep.remove(i)
+    return (terms[:1] + [terms[i + 1] for i in keep], observed,
+            moments.select(keep + [len(terms) - 1]))
+
+
+def ols_from_moments(moments: Moments) -> dict:
+    """
+    Fit y = Intercept + x . coef from the moments of (x, y), y the last
+    variable, as statsmodels' OLS does with the pseudo-inverse.
+
+    Returns:
+    dict: "coef" and "cov" of (Intercept, x), the residual "scale",
+          "df_model", "df_resid", "nobs", "ssr" and "centered_tss".
+
+    Raises:
+    ValueError: If the design matrix is rank deficient, where the
+                pseudo-inverse picks one of many fits.
+    """
+    n = float(moments.n)
+    mean_x, mean_y = moments.mean[:-1], moments.mean[-1]
+    c_xx = moments.comoment[:-1, :-1]
+    c_xy = moments.comoment[:-1, -1]
+    c_yy = moments.comoment[-1, -1]
+
+    rank = np.linalg.matrix_rank(c_xx) + 1
+    if rank < len(c_xx) + 1:
+        raise ValueError(f"The design matrix has rank {rank} for "
+                         f"{len(c_xx) + 1} columns, some are collinear")
+    inv = np.linalg.pinv(c_xx)
+    slopes = inv @ c_xy
+    ssr = max(c_yy - slopes @ c_xy, 0.0)
+    df_resid = n - rank
+    scale = ssr / df_resid
+    cov_slopes = scale * inv
+    cov = np.empty((len(slopes) + 1, len(slopes) + 1))
+    cov[0, 0] = scale / n + mean_x @ cov_slopes @ mean_x
+    cov[0, 1:] = cov[1:, 0] = -cov_slopes @ mean_x
+    cov[1:, 1:] = cov_slopes
+    return {
+        "coef": np.concatenate([[mean_y - mean_x @ slopes], slopes]),
+        "cov": cov,
+        "scale": scale,
+        "df_model": rank - 1.0,
+        "df_resid": df_resid,
+        "nobs": n,
+        "ssr": ssr,
+        "centered_tss": c_yy,
+    }
+
+
+def report(param: str, terms: list, fit: dict, source: str) -> str:
+    """
+    Summary of a fit from ols_from_moments, with the statistics of the
+    statsmodels summary that follow from the moments. The residual
+    diagnostics (omnibus, Durbin-Watson, Jarque-Bera) need the rows.
+    """
+    n, df_model, df_resid = fit["nobs"], fit["df_model"], fit["df_resid"]
+    rsquared = 1 - fit["ssr"] / fit["centered_tss"]
+    fvalue = (fit["centered_tss"] - fit["ssr"]) / df_model / fit["scale"]
+    llf = -n / 2 * (np.log(2 * np.pi) + np.log(fit["ssr"] / n) + 1)
+    se = np.sqrt(np.diag(fit["cov"]))
+    t_value = fit["coef"] / se
+    margin = stats.t.ppf(0.975, df_resid) * se
+    table = pd.DataFrame({
+        "coef": fit["coef"],
+        "std err": se,
+        "t": t_value,
+        "P>|t|": 2 * stats.t.sf(np.abs(t_value), df_resid),
+        "[0.025": fit["coef"] - margin,
+        "0.975]": fit["coef"] + margin,
+    }, index=terms)
+    header = [
+        ("Dep. Variable:", param),
+        ("Model:", "OLS"),
+        ("Method:", "Least Squares"),
+        ("Merged from:", source),
+        ("No. Observations:", int(n)),
+        ("Df Residuals:", int(df_resid)),
+        ("Df Model:", int(df_model)),
+        ("R-squared:", f"{rsquared:.3f}"),
+        ("Adj. R-squared:",
+         f"{1 - (n - 1) / df_resid * (1 - rsquared):.3f}"),
+        ("F-statistic:", f"{fvalue:.3f}"),
+        ("Prob (F-statistic):",
+         f"{stats.f.sf(fvalue, df_model, df_resid):.3g}"),
+        ("Log-Likelihood:", f"{llf:.2f}"),
+        ("AIC:", f"{-2 * llf + 2 * (df_model + 1):.1f}"),
+        ("BIC:", f"{-2 * llf + np.log(n) * (df_model + 1):.1f}"),
+    ]
+    # Same precision as the statsmodels summary
+    formats = {column: "{:.3f}".format for column in table}
+    formats["coef"] = "{:.4f}".format
+    lines = ["OLS Regression Results", "=" * 78]
+    lines += [f"{name:<24}{value}" for name, value in header]
+    lines += ["=" * 78, table.to_string(formatters=formats), "=" * 78]
+    return "\n".join(lines) + "\n"
+
+
+def fit_analyse_sharded(data, bps, out_path, min_max_params=False, shards=2):
+    """
+    Fit the same models as fit_analyse from the moments of their design
+    matrices, computed per hash shard of participants in parallel and
+    merged, see fit_merged.
+
+    Parameters:
+    data (pd.DataFrame): The data frame to fit.
+    bps (list): The dependent variables.
+    out_path (Path): The output directory.
+    min_max_params (bool): Scale the numeric variables to [0, 1].
+    shards (int): The number of shards.
+
+    Returns:
+    None
+
+    Raises:
+    ValueError: If the shards disagree on the design matrix.
+    """
+    results = map_shards(data, partial(shard_moments, bps=bps), shards)
+    data_hash = combine_hashes([result.pop("hash") for result in results])
+    designs = [result.pop("design") for result in results]
+    if any(design != designs[0] for design in designs[1:]):
+        raise ValueError("The shards have different design matrices")
+    fit_merged(merge_shards(results), designs[0], bps, out_path,
+               min_max_params, data_hash, f"{shards} shards")
+
+
+@reads(lambda bps, **_: independent_vars + bps)
+@writes(lambda bps, out_path, min_max_params=False, **_: [
+    out_path / f"multivariate_{kind}_{param}{_suffix(min_max_params)}.{ext}"
+    for param in bps for kind, ext in (("report", "txt"), ("model", "npz"))] +
+    [out_path / f"multivariate_state{_suffix(min_max_params)}.npz"])
+def update_fits(data, bps, out_path, min_max_params=False):
+    """
+    Merge the moments of the design matrices of a batch of new scans into
+    the accumulators in multivariate_state.npz, and refit the models of
+    fit_analyse from them. The earlier scans are not read, the first batch
+    starts the accumulators and a batch already merged is skipped.
+
+    Parameters:
+    data (pd.DataFrame): The new scans.
+    bps (list): The dependent variables.
+    out_path (Path): The output directory, holding the accumulators.
+    min_max_params (bool): Scale the numeric variables to [0, 1].
+
+    Returns:
+    None
+
+    Raises:
+    ValueError: If the batch has another design matrix than the
+                accumulators.
+    """
+    batch = shard_moments(data, bps)
+    batch_hash = batch.pop("hash")
+    design = batch.pop("design")
+    stats, meta = accumulate(
+        out_path / f"multivariate_state{_suffix(min_max_params)}.npz",
+        {"bps": bps, "design": design}, batch_hash, lambda _: batch)
+    fit_merged(stats, design, bps, out_path, min_max_params,
+               meta["data_hash"], f"{len(meta['batches'])} batches")
+
+
+def fit_merged(stats: dict, design: dict, bps: list, out_path,
+               min_max_params: bool, data_hash: str, source: str):
+    """
+    Fit the models of fit_analyse from merged statistics of shard_moments
+    and write their reports and artifacts. Min-max scaling is an affine map
+    of the merged moments, by the merged extents. Levels no complete row
+    has are left out of the design, see _observed.
+
+    Parameters:
+    stats (dict): The merged statistics.
+    design (dict): Each bp to the terms and levels of its design matrix.
+    bps (list): The dependent variables.
+    out_path (Path): The output directory.
+    min_max_params (bool): Scale the numeric variables to [0, 1].
+    data_hash (str): Hash of the data the models are fitted on.
+    source (str): What the statistics were merged from, for the reports.
+
+    Returns:
+    None
+
+    Raises:
+    ValueError: If the design matrix of a bp is rank deficient.
+    """
+    ranges = {
+        var: (extent.low[0], extent.high[0])
+        for var, extent in stats["extent"].items()
+    } if min_max_params else None
+    for param in bps:
+        terms, levels, moments = _observed(*design[param], stats[param])
+        if min_max_params:
+            # (x - min) / (max - min) of the numeric columns and param
+            columns = terms[1:] + [param]
+            low = [ranges[var][0] if var in ranges else 0.0 for var in columns]
+            span = [ranges[var][1] - ranges[var][0] if var in ranges else 1.0
+                    for var in columns]
+            moments = moments.affine(np.array(low), np.array(span))
+        fit = ols_from_moments(moments)
+        with open(out_path /
+                  f"multivariate_report_{param}{_suffix(min_max_params)}.txt",
+                  "w") as f:
+            f.write(report(param, terms, fit, source))
+        save_fit(
+            out_path / f"multivariate_model_{param}{_suffix(min_max_params)}.npz",
+            fit, param, terms, levels, data_hash, ranges)
+
+
+def stratum(data: pd.DataFrame, sex: str, smoking_status: str) -> pd.DataFrame:
+    """
+    Select the participants of one sex and smoking status.
+    """
+    return data[(data["sex"] == sex) &
+                (data["smoking_status"] == smoking_status)]
+
+
+def fit_stratum(data: pd.DataFrame, param: str,
+                covariates: list = nomogram_covariates) -> dict:
+    """
+    Fit param ~ covariates by ordinary least squares on one stratum.
+
+    Parameters:
+    data (pd.DataFrame): The participants of the stratum.
+    param (str): The dependent bronchial parameter.
+    covariates (list): The independent variables.
+
+    Returns:
+    dict: N, Intercept, one coefficient per covariate, the Residual SD and
+          the {covariate}_min and {covariate}_max of the range covered, or
+          None if the stratum is too small to fit.
+    """
+    data = data[[param] + covariates].dropna().astype(float)
+    if len(data) < len(covariates) + 2:
+        return None
+    model = sm.OLS(data[param], sm.add_constant(data[covariates])).fit()
+    fit = {"N": len(data), "Intercept": float(model.params["const"])}
+    for var in covariates:
+        fit[var] = float(model.params[var])
+    fit["Residual SD"] = float(np.sqrt(model.scale))
+    for var in covariates:
+        low, high = data[var].quantile(covariate_range)
+        fit[f"{var}_min"] = round(float(low), 3)
+        fit[f"{var}_max"] = round(float(high), 3)
+    return fit
+
+
+@reads(lambda bps, **_: ["sex", "smoking_status"] + nomogram_covariates + bps)
+@writes(lambda out_path, **_: [out_path / "multivariate_strata.csv"])
+def fit_strata(data: pd.DataFrame, bps: list, out_path):
+    """
+    Fit every bp on the nomogram covariates for each sex and smoking status,
+    and save the coefficients to multivariate_strata.csv.
+
+    Parameters:
+    data (pd.DataFrame): The data frame to fit.
+    bps (list): The dependent bronchial parameters.
+    out_path (Path): The output directory.
+
+    Returns:
+    None
+    """
+    results = []
+    for sex in CATEGORIES["sex"].categories:
+        for smoking_status in SMOKING_LABELS:
+            group = stratum(data, sex, smoking_status)
+            for param in bps:
+                fit = fit_stratum(group, param)
+                if fit is None:
+                    logger.warning(f"Too few {sex} {smoking_status} "
+                                   f"participants to fit {param}")
+                    continue
+                results.append({
+                    "Sex": sex,
+                    "Smoking Status": smoking_status,
+                    "Parameter": param,
+                    **fit
+                })
+    pd.DataFrame(results).to_csv(out_path / "multivariate_strata.csv",
+                                 index=False)
@@ -2,19 +2,396 @@
 
 import logging
 from pathlib import Path
+import numpy as np
 import pandas as pd
-from scipy.stats import pearsonr
-import statsmodels.api as sm
+from functools import partial
+from scipy import stats
+from data.util.cache import frame_hash
 from data.util.dataframe import min_max_scale
+from data.util.moments import Extent, Moments, accumulate
+from data.util.shards import (SHARD_KEY, combine_hashes, map_shards,
+                              merge_shards)
+from data.util.tasks import reads, writes
+from models.artifacts import UnivariateModels, save_artifact
 
 
 logger = logging.getLogger("BronchialParameters")
 
+# Columns scaled to [0, 1] (together with the bps) when min_max_params is set
+min_max_columns = ["age", "height", "weight", "fev1_fvc", "fev1_pp", "fev1", "fvc"]
+
+
+def _pairwise_sums(x: np.ndarray, y: np.ndarray) -> tuple:
+    # Counts, means and centred sums of squares and cross-products of every
+    # pair of columns over the rows where both are present
+    x_mask = ~np.isnan(x)
+    y_mask = ~np.isnan(y)
+    # Centre on the column means so the sums of squares stay well conditioned
+    x_shift = np.where(x_mask, x, 0.0).sum(axis=0) / np.maximum(x_mask.sum(axis=0), 1)
+    y_shift = np.where(y_mask, y, 0.0).sum(axis=0) / np.maximum(y_mask.sum(axis=0), 1)
+    x0 = np.where(x_mask, x - x_shift, 0.0)
+    y0 = np.where(y_mask, y - y_shift, 0.0)
+    xm = x_mask.astype(float)
+    ym = y_mask.astype(float)
+
+    n = xm.T @ ym
+    sum_x = x0.T @ ym
+    sum_y = xm.T @ y0
+    sum_xx = (x0 * x0).T @ ym
+    sum_yy = xm.T @ (y0 * y0)
+    sum_xy = x0.T @ y0
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean_x = sum_x / n
+        mean_y = sum_y / n
+        s_xx = sum_xx - sum_x * mean_x
+        s_yy = sum_yy - sum_y * mean_y
+        s_xy = sum_xy - sum_x * mean_y
+    return (n, mean_x + x_shift[:, None], mean_y + y_shift[None, :], s_xx,
+            s_yy, s_xy)
+
+
+def _ols(n, x_mean, y_mean, s_xx, s_yy, s_xy) -> dict:
+    # Simple least squares fits from their sufficient statistics
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope = s_xy / s_xx
+        intercept = y_mean - slope * x_mean
+        pearson = s_xy / np.sqrt(s_xx * s_yy)
+        rsquared = pearson**2
+        df_resid = n - 2
+        ss_model = slope * s_xy
+        ss_resid = np.maximum(s_yy - ss_model, 0.0)
+        fvalue = ss_model / (ss_resid / df_resid)
+        f_pvalue = stats.f.sf(fvalue, 1, df_resid)
+        t_value = slope / np.sqrt(ss_resid / df_resid / s_xx)
+        pvalue = 2 * stats.t.sf(np.abs(t_value), df_resid)
+        scale = ss_resid / df_resid
+        var_slope = scale / s_xx
+        cov = np.stack([
+            np.stack([scale / n + x_mean**2 * var_slope, -x_mean * var_slope],
+                     axis=-1),
+            np.stack([-x_mean * var_slope, var_slope], axis=-1),
+        ], axis=-2)
+
+    return {
+        "n": n,
+        "pearson": pearson,
+        "intercept": intercept,
+        "slope": slope,
+        "rsquared": rsquared,
+        "fvalue": fvalue,
+        "f_pvalue": f_pvalue,
+        "pvalue": pvalue,
+        "scale": scale,
+        "cov": cov,
+    }
+
+
+def batch_ols(x: np.ndarray, y: np.ndarray) -> dict:
+    """
+    Fit y = a + b * x for every pair of columns of x and y at once.
+
+    Each pair only uses the rows where both values are present, as with
+    dropna on the two columns. The fits are computed from pairwise
+    sufficient statistics (counts, sums, sums of squares and cross-products)
+    obtained with a handful of matrix products.
+
+    Parameters:
+    x (np.ndarray): (n, k) array of independent variables, NaN for missing.
+    y (np.ndarray): (n, p) array of dependent variables, NaN for missing.
+
+    Returns:
+    dict: (k, p) arrays "n", "pearson", "intercept", "slope", "rsquared",
+          "fvalue", "f_pvalue", "pvalue" (p-value of the slope), "scale"
+          (residual variance) and (k, p, 2, 2) "cov", the covariance
+          matrix of (intercept, slope).
+    """
+    return _ols(*_pairwise_sums(x, y))
+
+
+def pairwise_moments(x: np.ndarray, y: np.ndarray) -> Moments:
+    """
+    Compute the moments of every pair of columns of x and y, over the rows
+    where both values are present, as batch_ols does.
+
+    Parameters:
+    x (np.ndarray): (n, k) array of independent variables, NaN for missing.
+    y (np.ndarray): (n, p) array of dependent variables, NaN for missing.
+
+    Returns:
+    Moments: (k, p) moments of the pairs (x, y).
+    """
+    n, mean_x, mean_y, s_xx, s_yy, s_xy = _pairwise_sums(x, y)
+    # Pairs without rows keep zero moments so they merge with other shards
+    present = n > 0
+    total = np.stack([np.where(present, mean_x * n, 0.0),
+                      np.where(present, mean_y * n, 0.0)], axis=-1)
+    comoment = np.stack([np.stack([s_xx, s_xy], axis=-1),
+                         np.stack([s_xy, s_yy], axis=-1)], axis=-2)
+    return Moments(n, total, np.where(present[..., None, None], comoment, 0.0))
+
+
+def ols_from_moments(moments: Moments) -> dict:
+    """
+    Fit y = a + b * x for every pair of variables from their moments.
+
+    Parameters:
+    moments (Moments): Moments of (x, y) pairs, as from pairwise_moments.
+
+    Returns:
+    dict: Arrays of the shape of moments.n, see batch_ols.
+    """
+    return _ols(moments.n, moments.mean[..., 0], moments.mean[..., 1],
+                moments.comoment[..., 0, 0], moments.comoment[..., 1, 1],
+                moments.comoment[..., 0, 1])
+
+
+@reads(lambda bps, i_vars, min_max_params=False, shards=1, **_: ["sex"] +
+       i_vars + bps + (min_max_columns if min_max_params else []) +
+       ([SHARD_KEY] if shards > 1 else []))
+@writes(lambda i_vars, out_path, **_: [
+    out_path / f"univariate_analysis_wrt_{i_var}.csv" for i_var in i_vars] +
+    [out_path / "univariate_models.npz"])
+def fit_analyse_batch(data: pd.DataFrame,
+                      bps: list,
+                      i_vars: list,
+                      out_path: Path,
+                      min_max_params: bool = False,
+                      shards: int = 1):
+    """
+    Performs the univariate analysis of every bp against every independent
+    variable, per sex, in one batched least-squares pass.
+
+    Writes one univariate_analysis_wrt_{i_var}.csv per independent variable,
+    identical in layout to fit_analyse, and every fit to univariate_models.npz
+    for scoring new data.
+
+    Parameters:
+    data (pd.DataFrame): The data frame to perform the analysis on.
+    bps (list): The dependent parameters.
+    i_vars (list): The independent variables to calculate correlation against.
+    out_path (Path): The output directory where the CSV files will be saved.
+    min_max_params (bool): Scale the parameters to [0, 1] before fitting.
+    shards (int): Compute the moments of the fits per hash shard of
+                  participants in parallel and merge them, see
+                  fit_analyse_sharded.
+
+    Returns:
+    None
+
+    Raises:
+    None
+    """
+    if shards > 1:
+        return fit_analyse_sharded(data, bps, i_vars, out_path,
+                                   min_max_params, shards)
+
+    columns = list(dict.fromkeys(["sex"] + i_vars + bps))
+    data_hash = frame_hash(data.loc[:, columns])
+    ranges = {}
+    if min_max_params:
+        scaled = list(dict.fromkeys(min_max_columns + bps))
+        ranges = {var: (data[var].min(), data[var].max()) for var in scaled}
+        data = min_max_scale(data, scaled)
+
+    fits = {}
+    for sex in ["Male", "Female"]:
+        sex_data = data[data["sex"] == sex]
+        logger.debug(f"Calculating {len(bps)} x {len(i_vars)} fits for {sex}")
+        fits[sex] = batch_ols(sex_data[i_vars].to_numpy(dtype=float),
+                              sex_data[bps].to_numpy(dtype=float))
+    write_fits(fits, bps, i_vars, out_path, data_hash, ranges)
+
+
+def shard_moments(data: pd.DataFrame, bps: list, i_vars: list,
+                  scaled: list = ()) -> dict:
+    """
+    Compute the mergeable statistics of one shard behind the univariate
+    fits: per sex the pairwise moments of every independent variable and
+    bp, the extent of the scaled columns and the hash of the shard.
+    """
+    columns = list(dict.fromkeys(["sex"] + i_vars + bps))
+    stats = {
+        "hash": frame_hash(data.loc[:, columns]),
+        "extent": Extent.of(data[list(scaled)].to_numpy(dtype=float)),
+    }
+    for sex in ["Male", "Female"]:
+        sex_data = data[data["sex"] == sex]
+        stats[sex] = pairwise_moments(sex_data[i_vars].to_numpy(dtype=float),
+                                      sex_data[bps].to_numpy(dtype=float))
+    return stats
+
+
+def fit_analyse_sharded(data: pd.DataFrame,
+                        bps: list,
+                        i_vars: list,
+                        out_path: Path,
+                        min_max_params: bool = False,
+                        shards: int = 2):
+    """
+    Performs the same analysis as fit_analyse_batch from moments computed
+    per hash shard of participants in parallel and merged, see fit_merged.
+
+    Parameters:
+    data (pd.DataFrame): The data frame to perform the analysis on.
+    bps (list): The dependent parameters.
+    i_vars (list): The independent variables to calculate correlation against.
+    out_path (Path): The output directory where the CSV files will be saved.
+    min_max_params (bool): Scale the parameters to [0, 1] before fitting.
+    shards (int): The number of shards.
+
+    Returns:
+    None
+    """
+    scaled = list(dict.fromkeys(min_max_columns + bps)) if min_max_params else []
+    results = map_shards(
+        data, partial(shard_moments, bps=bps, i_vars=i_vars, scaled=scaled),
+        shards)
+    data_hash = combine_hashes([result.pop("hash") for result in results])
+    fit_merged(merge_shards(results), bps, i_vars, out_path, scaled,
+               data_hash)
+
+
+@reads(lambda bps, i_vars, min_max_params=False, **_: ["sex"] + i_vars +
+       bps + (min_max_columns if min_max_params else []))
+@writes(lambda i_vars, out_path, **_: [
+    out_path / f"univariate_analysis_wrt_{i_var}.csv" for i_var in i_vars] +
+    [out_path / "univariate_models.npz", out_path / "univariate_state.npz"])
+def update_fits(data: pd.DataFrame,
+                bps: list,
+                i_vars: list,
+                out_path: Path,
+                min_max_params: bool = False):
+    """
+    Merge the moments of a batch of new scans into the accumulators in
+    univariate_state.npz, and refit every model from them, writing the
+    same outputs as fit_analyse_batch. The earlier scans are not read, the
+    first batch starts the accumulators and a batch already merged is
+    skipped.
+
+    Parameters:
+    data (pd.DataFrame): The new scans.
+    bps (list): The dependent parameters.
+    i_vars (list): The independent variables to calculate correlation against.
+    out_path (Path): The output directory, holding the accumulators.
+    min_max_params (bool): Scale the parameters to [0, 1] before fitting.
+
+    Returns:
+    None
+    """
+    scaled = list(dict.fromkeys(min_max_columns + bps)) if min_max_params else []
+    columns = list(dict.fromkeys(["sex"] + i_vars + bps))
+
+    def compute(_):
+        batch = shard_moments(data, bps, i_vars, scaled)
+        del batch["hash"]
+        return batch
+
+    stats, meta = accumulate(
+        out_path / "univariate_state.npz",
+        {"bps": bps, "i_vars": i_vars, "scaled": scaled},
+        frame_hash(data.loc[:, columns]), compute)
+    fit_merged(stats, bps, i_vars, out_path, scaled, meta["data_hash"])
+
+
+def fit_merged(stats: dict, bps: list, i_vars: list, out_path: Path,
+               scaled: list, data_hash: str):
+    """
+    Fit every model from merged statistics of shard_moments and write the
+    outputs of fit_analyse_batch. Min-max scaling is an affine map of the
+    moments, by the merged extents.
+
+    Parameters:
+    stats (dict): The merged statistics.
+    bps (list): The dependent parameters.
+    i_vars (list): The independent variables.
+    out_path (Path): The output directory.
+    scaled (list): The min-max scaled columns, in the order of the extent.
+    data_hash (str): Hash of the data the models are fitted on.
+
+    Returns:
+    None
+    """
+    extent = stats["extent"]
+    ranges = {var: (extent.low[i], extent.high[i])
+              for i, var in enumerate(scaled)}
+    # (x - low) / (high - low) of the scaled variables, identity for others
+    low = {var: ranges[var][0] if var in ranges else 0.0 for var in i_vars + bps}
+    span = {var: ranges[var][1] - ranges[var][0] if var in ranges else 1.0
+            for var in i_vars + bps}
+    shift = np.stack(np.broadcast_arrays(
+        np.array([low[var] for var in i_vars])[:, None],
+        np.array([low[var] for var in bps])[None, :]), axis=-1)
+    scale = np.stack(np.broadcast_arrays(
+        np.array([span[var] for var in i_vars])[:, None],
+        np.array([span[var] for var in bps])[None, :]), axis=-1)
+
+    fits = {}
+    for sex in ["Male", "Female"]:
+        logger.debug(f"Calculating {len(bps)} x {len(i_vars)} fits for {sex} "
+                     f"from {int(stats[sex].n.max())} rows")
+        fits[sex] = ols_from_moments(stats[sex].affine(shift, scale))
+    write_fits(fits, bps, i_vars, out_path, data_hash, ranges)
+
+
+def write_fits(fits: dict, bps: list, i_vars: list, out_path: Path,
+               data_hash: str, ranges: dict):
+    """
+    Write the univariate_analysis_wrt_{i_var}.csv tables and
+    univariate_models.npz of the fits of every sex.
+
+    Parameters:
+    fits (dict): Sex to the (i_var, bp) fits, as from batch_ols.
+    bps (list): The dependent parameters.
+    i_vars (list): The independent variables.
+    out_path (Path): The output directory.
+    data_hash (str): Hash of the data the models were fitted on.
+    ranges (dict): Variable to the (min, max) it was scaled from.
+
+    Returns:
+    None
+    """
+    for i, i_var in enumerate(i_vars):
+        results = []
+        for sex, fit in fits.items():
+            for j, param in enumerate(bps):
+                results.append({
+                    "Group": f"{sex}",
+                    "Parameter": param,
+                    "Pearson Correlation": fit["pearson"][i, j].round(2),
+                    "Intercept": fit["intercept"][i, j].round(2),
+                    "Slope": fit["slope"][i, j].round(4),
+                    "R-squared": fit["rsquared"][i, j].round(2),
+                    "F-statistic": fit["fvalue"][i, j].round(2),
+                    "F p-value": fit["f_pvalue"][i, j].round(4),
+                    "P-value": fit["pvalue"][i, j].round(4).round(2),
+                })
+
+        # Output results to a CSV file
+        results_df = pd.DataFrame.from_dict(results)
+        results_df.to_csv((out_path / f"univariate_analysis_wrt_{i_var}.csv"),
+                          index=False)
+
+    arrays = {
+        "sexes": np.array(list(fits)),
+        "i_vars": np.array(i_vars),
+        "bps": np.array(bps),
+    }
+    for stat in ["intercept", "slope", "n", "scale", "cov"]:
+        arrays[stat] = np.stack([fit[stat] for fit in fits.values()])
+    for var, (low, high) in ranges.items():
+        arrays[f"min_{var}"] = np.array(float(low))
+        arrays[f"max_{var}"] = np.array(float(high))
+    save_artifact(out_path / "univariate_models.npz", UnivariateModels.kind,
+                  arrays, data_hash)
+
+
 def fit_analyse(data: pd.DataFrame,
                 bps: list,
                 i_var: str,
                 out_path: Path,
-                min_max_params: bool = False):
+                min_max_params: bool = False,
+                shards: int = 1):
     """
     This function performs univariate analysis on a given data frame.
 
@@ -23,6 +400,7 @@ def fit_analyse(data: pd.DataFrame,
     bps (list): A list of parameters to loop through and calculate Pearson's cc and R-squared.
     i_var (str): The independent variable to calculate correlation against.
     out_path (Path): The output file path where the results will be saved in CSV format.
+    shards (int): Number of hash shards of participants to compute the fits on.
 
     Returns:
     None
@@ -30,44 +408,4 @@ def fit_analyse(data: pd.DataFrame,
     Raises:
     None
     """
-
-    results = []
-
-    if min_max_params:
-        data = min_max_scale(data, ["age", "height", "weight", "fev1_fvc", "fev1_pp", "fev1", "fvc"] + bps)
-
-    for sex in ["Male", "Female"]:
-        sex_data = data[data["sex"] == sex].copy()
-
-        # Loop parameters and calculate Pearson's cc and R-squared
-        for param in bps:
-            data_param = sex_data.dropna(subset=[param, i_var])
-            logger.debug(f"Calculating {param} wrt {i_var} for {sex}")
-            X = data_param[i_var].to_numpy()
-            y = data_param[param].to_numpy()
-            pearson, _ = pearsonr(X, y)
-            model = sm.OLS(y, sm.add_constant(X)).fit()
-            rsquared = model.rsquared
-            pval = round(model.pvalues[1], 4)
-
-            # Create a dictionary to store results
-            result = {
-                "Group": f"{sex}",
-                "Parameter": param,
-                "Pearson Correlation": pearson.round(2),
-                "Intercept": model.params[0].round(2),
-                "Slope": model.params[1].round(4),
-                "R-squared": rsquared.round(2),
-                "F-statistic": model.fvalue.round(2),
-                "F p-value": model.f_pvalue.round(4),
-                "P-value": pval.round(2),
-            }
-            results.append(result)
-
-    # Create a pandas DataFrame from the results dictionary
-    results_df = pd.DataFrame.from_dict(results)
-    results_df = results_df
-
-    # Output results to a CSV file
-    results_df.to_csv((out_path / f"univariate_analysis_wrt_{i_var}.csv"),
-                      index=False)
+    fit_analyse_batch(data, bps, [i_var], out_path, min_max_params, shards)
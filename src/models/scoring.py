@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+
+import logging
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+from data.util.schema import (AGE_5YR_BINS, AGE_5YR_LABELS, CATEGORIES,
+                              SMOKING_LABELS)
+from features.descriptive.reference_index import ReferenceIndex
+from models.artifacts import UnivariateModels, load_artifact
+
+logger = logging.getLogger("BronchialParameters")
+
+# Artifacts the scorer loads from the models directory
+STRATA_MODELS = "multivariate_strata.csv"
+REFERENCE_INDEX = "reference_index.npz"
+LINEAR_PREFIX = "multivariate_model_"
+LINEAR_MODELS = f"{LINEAR_PREFIX}*.npz"
+UNIVARIATE_MODELS = "univariate_models.npz"
+# Residual z-scores beyond this are outside the central 90% of the healthy
+# reference population
+Z_LIMIT = 1.645
+
+
+class StrataModel:
+    """
+    Reference equations bp = Intercept + coefficients . covariates, fitted
+    per sex and smoking status by multivariate.fit_strata.
+
+    The coefficients of a parameter are held as one array per term indexed
+    by stratum code, so a batch of rows from any mix of strata is predicted
+    with a single gather and row-wise dot product.
+    """
+
+    def __init__(self, table: pd.DataFrame):
+        # The coefficients sit between the intercept and the residual SD
+        columns = list(table.columns)
+        covariates = columns[columns.index("Intercept") + 1:
+                             columns.index("Residual SD")]
+        self.covariates = covariates
+        self.sexes = list(CATEGORIES["sex"].categories)
+        n_strata = len(self.sexes) * len(SMOKING_LABELS)
+        self.intercept, self.coef, self.residual_sd = {}, {}, {}
+        codes = self.stratum_codes(table["Sex"], table["Smoking Status"])
+        for param, rows in table.groupby("Parameter").indices.items():
+            at = codes[rows]
+            self.intercept[param] = np.full(n_strata, np.nan)
+            self.intercept[param][at] = table["Intercept"].to_numpy()[rows]
+            self.coef[param] = np.full((n_strata, len(covariates)), np.nan)
+            self.coef[param][at] = table[covariates].to_numpy()[rows]
+            self.residual_sd[param] = np.full(n_strata, np.nan)
+            self.residual_sd[param][at] = table["Residual SD"].to_numpy()[rows]
+
+    @classmethod
+    def from_csv(cls, path: Path) -> "StrataModel":
+        return cls(pd.read_csv(path))
+
+    @property
+    def params(self) -> list:
+        return list(self.intercept)
+
+    def stratum_codes(self, sex, smoking_status) -> np.ndarray:
+        """
+        Return the stratum code of every row, -1 for unknown labels.
+        """
+        sex = pd.Categorical(np.asarray(sex, dtype=object),
+                             categories=self.sexes).codes
+        smoking = pd.Categorical(np.asarray(smoking_status, dtype=object),
+                                 categories=SMOKING_LABELS).codes
+        return np.where((sex < 0) | (smoking < 0), -1,
+                        sex * len(SMOKING_LABELS) + smoking)
+
+    def predict(self, param: str, x: np.ndarray,
+                codes: np.ndarray) -> np.ndarray:
+        """
+        Predict param for every row from its covariates.
+
+        Parameters:
+        param (str): The bronchial parameter.
+        x (np.ndarray): (n, k) covariates, in the order of self.covariates.
+        codes (np.ndarray): (n,) stratum codes from stratum_codes.
+
+        Returns:
+        np.ndarray: (n,) predictions, NaN for unknown strata or missing
+                    covariates.
+        """
+        known = codes >= 0
+        intercept = np.where(known, self.intercept[param][codes], np.nan)
+        coef = self.coef[param][codes]
+        coef[~known] = np.nan
+        return intercept + np.einsum("ij,ij->i", coef, x)
+
+
+class Scorer:
+    """
+    Scores new scans against the reference equations and the reference
+    population, without the cohort.
+
+    Every artifact is optional: the stratum equations of
+    multivariate.fit_strata, the reference index, the multivariate models
+    and the univariate fits of univariate_vars. Each residual z-score
+    beyond z_limit flags its parameter as unhealthy.
+    """
+
+    def __init__(self,
+                 model: StrataModel = None,
+                 index: ReferenceIndex = None,
+                 linear: list = (),
+                 univariate: UnivariateModels = None,
+                 univariate_vars: list = (),
+                 z_limit: float = Z_LIMIT):
+        self.model = model
+        self.index = index
+        self.linear = list(linear)
+        self.univariate = univariate
+        self.univariate_vars = list(univariate_vars)
+        self.z_limit = z_limit
+
+    @classmethod
+    def load(cls, models_dir: Path, **kwargs) -> "Scorer":
+        """
+        Load the artifacts found in models_dir: multivariate_strata.csv,
+        reference_index.npz, multivariate_model_*.npz and
+        univariate_models.npz.
+
+        Parameters:
+        models_dir (Path): The directory holding the artifacts.
+        kwargs: univariate_vars and z_limit, see Scorer.
+
+        Returns:
+        Scorer: The scorer.
+
+        Raises:
+        ValueError: If models_dir holds none of the artifacts.
+        """
+        models_dir = Path(models_dir)
+        model = index = univariate = None
+        if (models_dir / STRATA_MODELS).exists():
+            model = StrataModel.from_csv(models_dir / STRATA_MODELS)
+        if (models_dir / REFERENCE_INDEX).exists():
+            index = ReferenceIndex.load(models_dir / REFERENCE_INDEX)
+        linear = []
+        for path in sorted(models_dir.glob(LINEAR_MODELS)):
+            # Keyed by the artifact, as the plain and normalised models of a
+            # variable share their dependent variable
+            linear.append(load_artifact(path))
+            linear[-1].name = path.stem[len(LINEAR_PREFIX):]
+        if (models_dir / UNIVARIATE_MODELS).exists():
+            univariate = load_artifact(models_dir / UNIVARIATE_MODELS)
+        if model is None and index is None and not linear and \
+                univariate is None:
+            raise ValueError(f"No models to score with in {models_dir}")
+        logger.info(
+            f"Loaded {len(model.params) if model else 0} stratum equations, "
+            f"{len(linear)} multivariate models, "
+            f"{'univariate fits, ' if univariate else ''}"
+            f"{len(index.params) if index else 0} reference distributions")
+        return cls(model, index, linear, univariate, **kwargs)
+
+    @property
+    def bps(self) -> list:
+        """
+        The bronchial parameters scored.
+        """
+        params = {}
+        if self.model is not None:
+            params.update(dict.fromkeys(self.model.params))
+        if self.univariate is not None:
+            params.update(dict.fromkeys(self.univariate.bps))
+        if self.index is not None:
+            params.update(dict.fromkeys(self.index.params))
+        return [param for param in params if param.startswith("bp_")]
+
+    @property
+    def labels(self) -> list:
+        """
+        The label columns read, the categorical variables of the models.
+        """
+        labels = dict.fromkeys(["sex", "smoking_status", "age_5yr"])
+        for model in self.linear:
+            labels.update(dict.fromkeys(model.levels))
+        return list(labels)
+
+    @property
+    def numeric(self) -> list:
+        """
+        The numeric columns read.
+        """
+        columns = dict.fromkeys(["age", "height", "weight", "bmi"])
+        if self.model is not None:
+            columns.update(dict.fromkeys(self.model.covariates +
+                                         self.model.params))
+        for model in self.linear:
+            columns.update(dict.fromkeys(
+                [var for var in model.variables if var not in model.levels] +
+                [model.dependent]))
+        if self.univariate is not None:
+            columns.update(dict.fromkeys(self.univariate_vars +
+                                         self.univariate.bps))
+        if self.index is not None:
+            columns.update(dict.fromkeys(self.index.params))
+        return list(columns)
+
+    def prepare(self, rows: pd.DataFrame) -> pd.DataFrame:
+        """
+        Check and coerce a batch of new scans before it is scored: the
+        label columns become text and the numeric columns read must hold
+        numbers, so a malformed request is rejected on its own instead of
+        failing the batch it is scored in. Other columns are left as they
+        are.
+
+        Parameters:
+        rows (pd.DataFrame): One scan per row, see score.
+
+        Returns:
+        pd.DataFrame: The rows, with float values and text labels.
+
+        Raises:
+        ValueError: If a column read by the models is not numeric.
+        """
+        rows = rows.reset_index(drop=True)
+        for col in [col for col in self.labels if col in rows]:
+            rows[col] = rows[col].astype(object).where(
+                rows[col].isna(), rows[col].astype(str))
+        for col in [col for col in self.numeric if col in rows]:
+            try:
+                rows[col] = pd.to_numeric(rows[col]).astype(float)
+            except (ValueError, TypeError):
+                raise ValueError(f"{col} must be numeric") from None
+        return rows
+
+    def _residual(self, scores: dict, name: str, y: np.ndarray,
+                  predicted: np.ndarray, sd: np.ndarray):
+        # Predicted value, residual z-score and the healthy/unhealthy flag
+        z = (y - predicted) / sd
+        scores[f"{name}_predicted"] = predicted
+        scores[f"{name}_residual_z"] = z
+        scores[f"{name}_status"] = pd.Categorical(
+            np.where(np.isnan(z), None,
+                     np.where(np.abs(z) > self.z_limit, "unhealthy",
+                              "healthy")),
+            dtype=CATEGORIES["healthy"])
+
+    def score(self, rows: pd.DataFrame) -> pd.DataFrame:
+        """
+        Score a batch of new scans.
+
+        Parameters:
+        rows (pd.DataFrame): One scan per row, with sex, smoking_status,
+                             age, height (m), weight and the bp_* values,
+                             plus the variables of the multivariate models.
+                             bmi and age_5yr are derived when absent.
+
+        Returns:
+        pd.DataFrame: For every parameter of the equations found in rows,
+                      {param}_predicted, {param}_residual_z (the residual
+                      over the residual SD) and {param}_status (healthy or
+                      unhealthy), suffixed with _{var} for the univariate
+                      fits on var, named after the artifact for the
+                      multivariate models (e.g. fev1_pp_normalised), and
+                      for every parameter of the reference index,
+                      {param}_percentile and {param}_zscore. The patientID
+                      column is passed through when present.
+        """
+        rows = rows.reset_index(drop=True)
+        if "bmi" not in rows:
+            rows["bmi"] = rows["weight"] / rows["height"]**2
+        if "age_5yr" not in rows:
+            rows["age_5yr"] = pd.cut(rows["age"], bins=AGE_5YR_BINS,
+                                     labels=AGE_5YR_LABELS, right=False)
+
+        scores = {}
+        if "patientID" in rows:
+            scores["patientID"] = rows["patientID"]
+        if self.model is not None:
+            codes = self.model.stratum_codes(rows["sex"],
+                                             rows["smoking_status"])
+            x = rows[self.model.covariates].to_numpy(dtype=float)
+            known = codes >= 0
+            for param in self.model.params:
+                if param not in rows:
+                    continue
+                sd = np.where(known, self.model.residual_sd[param][codes],
+                              np.nan)
+                self._residual(scores, param,
+                               rows[param].to_numpy(dtype=float),
+                               self.model.predict(param, x, codes), sd)
+        for model in self.linear:
+            if not set(model.variables + [model.dependent]) <= set(rows):
+                continue
+            self._residual(scores, model.name,
+                           rows[model.dependent].to_numpy(dtype=float),
+                           model.predict(rows), model.residual_sd)
+        if self.univariate is not None:
+            for var in self.univariate_vars:
+                if var not in rows or var not in self.univariate.i_vars:
+                    continue
+                for param in self.univariate.bps:
+                    if param not in rows:
+                        continue
+                    predicted = self.univariate.predict(
+                        var, param, rows[var], rows["sex"])
+                    sd = self.univariate.residual_sd(var, param, rows["sex"])
+                    self._residual(scores, f"{param}_{var}",
+                                   rows[param].to_numpy(dtype=float),
+                                   predicted, sd)
+        scores = pd.DataFrame(scores, index=rows.index)
+        if self.index is not None:
+            scores = pd.concat([scores, self.index.score(rows)], axis=1)
+        return scores
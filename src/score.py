@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+import argparse
+import logging
+import logging.config
+from pathlib import Path
+
+from data.util.dataframe import normalise_bps
+from data.util.store import iter_chunks
+from models.scoring import Z_LIMIT, Scorer
+
+src_dir = Path(__file__).resolve().parent
+logging.config.fileConfig(src_dir / "logging.conf")
+logger = logging.getLogger("BronchialParameters")
+
+
+class ChunkWriter:
+    """
+    Append scored chunks to a csv or Parquet file.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        if self.path.suffix not in (".csv", ".parquet"):
+            raise ValueError(f"Cannot write {path}: not a csv or parquet file")
+        self.writer = None
+        self.rows = 0
+
+    def write(self, chunk):
+        if self.path.suffix == ".csv":
+            chunk.to_csv(self.path, mode="a" if self.rows else "w",
+                         header=not self.rows, index=False)
+        else:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if self.writer is None:
+                self.writer = pq.ParquetWriter(self.path, table.schema)
+            self.writer.write_table(table)
+        self.rows += len(chunk)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+def main(args):
+    scorer = Scorer.load(args.models_dir,
+                         univariate_vars=args.univariate_vars.split(","),
+                         z_limit=args.z_limit)
+    writer = ChunkWriter(args.out_file)
+    try:
+        for i, chunk in enumerate(iter_chunks(args.in_file, args.chunk_size)):
+            # Scale as analyse.py --normalised does before fitting
+            if args.normalised:
+                chunk = normalise_bps(
+                    chunk, [bp for bp in scorer.bps if bp in chunk])
+            writer.write(scorer.score(chunk))
+            logger.debug(f"Scored chunk {i}, {writer.rows} rows so far")
+    finally:
+        writer.close()
+    logger.info(f"Scored {writer.rows} scans into {args.out_file}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Score a file of new scans against the reference "
+        "equations, one chunk at a time.")
+    parser.add_argument("in_file",
+                        type=Path,
+                        help="Scans to score, csv, parquet or feather.")
+    parser.add_argument("out_file",
+                        type=Path,
+                        help="Scores destination, csv or parquet.")
+    parser.add_argument("--models_dir",
+                        type=Path,
+                        default=src_dir.parent / "models",
+                        help="Directory holding the model artifacts. "
+                        "Default: models/.")
+    parser.add_argument("--chunk_size",
+                        type=int,
+                        default=100000,
+                        help="Rows read and scored at a time. "
+                        "Default: 100000.")
+    parser.add_argument("--univariate_vars",
+                        type=str,
+                        default="height",
+                        help="Comma separated independent variables whose "
+                        "univariate fits are scored. Default: height.")
+    parser.add_argument("--z_limit",
+                        type=float,
+                        default=Z_LIMIT,
+                        help="Residual z-score beyond which a parameter is "
+                        f"flagged unhealthy. Default: {Z_LIMIT}.")
+    parser.add_argument("--normalised",
+                        action="store_true",
+                        help="Normalise the bps to height, for models fitted "
+                        "with analyse.py --normalised.")
+    args = parser.parse_args()
+    main(args)
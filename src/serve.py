@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+import argparse
+import asyncio
+import json
+import logging
+import logging.config
+from pathlib import Path
+
+import pandas as pd
+
+from data.util.dataframe import normalise_bps
+from models.scoring import Z_LIMIT, Scorer
+
+src_dir = Path(__file__).resolve().parent
+logging.config.fileConfig(src_dir / "logging.conf")
+logger = logging.getLogger("BronchialParameters")
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found",
+           405: "Method Not Allowed", 500: "Internal Server Error"}
+
+
+class MicroBatcher:
+    """
+    Gather the rows of concurrent requests into one batch, so they are scored
+    with a single vectorised evaluation.
+
+    A batch is closed when it holds max_rows rows or max_delay seconds after
+    its first request arrived. It is scored in a worker thread while the
+    next one gathers. Every request is checked with prepare before it joins
+    a batch, and if a batch still fails its requests are scored one at a
+    time, so a bad request only fails itself.
+    """
+
+    def __init__(self, score, max_rows: int = 4096, max_delay: float = 0.002,
+                 prepare=None):
+        self.score = score
+        self.prepare = prepare
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.queue = asyncio.Queue()
+
+    async def submit(self, rows: pd.DataFrame) -> pd.DataFrame:
+        """
+        Score rows as part of the next batch.
+
+        Raises:
+        Exception: Whatever prepare or score raise for these rows.
+        """
+        if self.prepare is not None:
+            rows = self.prepare(rows)
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((rows, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            size = len(batch[0][0])
+            deadline = loop.time() + self.max_delay
+            while size < self.max_rows:
+                try:
+                    item = await asyncio.wait_for(self.queue.get(),
+                                                  deadline - loop.time())
+                except asyncio.TimeoutError:
+                    break
+                batch.append(item)
+                size += len(item[0])
+
+            try:
+                rows = pd.concat([rows for rows, _ in batch],
+                                 ignore_index=True)
+                scores = await loop.run_in_executor(None, self.score, rows)
+            except Exception:
+                logger.exception(f"Scoring a batch of {len(batch)} requests "
+                                 "failed, scoring them one at a time")
+                await self._score_each(batch)
+                continue
+            logger.debug(f"Scored {len(batch)} requests, {size} rows")
+
+            start = 0
+            for rows, future in batch:
+                if not future.done():
+                    future.set_result(
+                        scores.iloc[start:start + len(rows)].reset_index(
+                            drop=True))
+                start += len(rows)
+
+    async def _score_each(self, batch: list):
+        loop = asyncio.get_running_loop()
+        for rows, future in batch:
+            try:
+                scores = await loop.run_in_executor(None, self.score, rows)
+            except Exception as error:
+                if not future.done():
+                    future.set_exception(error)
+                continue
+            if not future.done():
+                future.set_result(scores.reset_index(drop=True))
+
+
+async def _read_request(reader: asyncio.StreamReader):
+    # Request line, headers and body of one HTTP/1.1 request, None at EOF
+    line = await reader.readline()
+    if not line:
+        return None
+    method, target, _ = line.decode("latin-1").split(" ", 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", 0))
+    body = await reader.readexactly(length) if length else b""
+    return method, target, headers, body
+
+
+def _response(status: int, body: str, close: bool) -> bytes:
+    body = body.encode()
+    head = (f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'close' if close else 'keep-alive'}\r\n\r\n")
+    return head.encode("latin-1") + body
+
+
+async def _handle(batcher: MicroBatcher, method: str, target: str,
+                  body: bytes):
+    if target != "/score":
+        return 404, json.dumps({"error": f"No such endpoint {target}"})
+    if method != "POST":
+        return 405, json.dumps({"error": "Use POST"})
+    try:
+        rows = json.loads(body)
+        if isinstance(rows, dict):
+            rows = rows["rows"]
+        if not isinstance(rows, list) or not all(
+                isinstance(row, dict) for row in rows):
+            raise TypeError("The body must be a list of rows")
+        scores = await batcher.submit(pd.DataFrame.from_records(rows))
+    except (ValueError, KeyError, TypeError) as error:
+        return 400, json.dumps({"error": f"{type(error).__name__}: {error}"})
+    except Exception as error:
+        logger.exception(f"Scoring a request to {target} failed")
+        return 500, json.dumps({"error": f"{type(error).__name__}: {error}"})
+    return 200, scores.to_json(orient="records")
+
+
+def serve_connection(batcher: MicroBatcher):
+    """
+    Return a connection handler answering POST /score requests.
+
+    The body is a JSON list of scan rows (or {"rows": [...]}). The response
+    is the list of their scores, in the same order, with null for values
+    that cannot be scored.
+    """
+    async def handle(reader: asyncio.StreamReader,
+                     writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    request = await _read_request(reader)
+                except (ValueError, asyncio.IncompleteReadError):
+                    writer.write(_response(400, '{"error": "Bad request"}',
+                                           close=True))
+                    break
+                if request is None:
+                    break
+                method, target, headers, body = request
+                close = headers.get("connection", "").lower() == "close"
+                status, payload = await _handle(batcher, method, target, body)
+                writer.write(_response(status, payload, close))
+                await writer.drain()
+                if close:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+    return handle
+
+
+async def main(args):
+    scorer = Scorer.load(args.models_dir,
+                         univariate_vars=args.univariate_vars.split(","),
+                         z_limit=args.z_limit)
+    prepare = scorer.prepare
+    if args.normalised:
+        # Scale as analyse.py --normalised does before fitting, once the
+        # values of the request are checked
+        def prepare(rows):
+            rows = scorer.prepare(rows)
+            return normalise_bps(rows,
+                                 [bp for bp in scorer.bps if bp in rows])
+    batcher = MicroBatcher(scorer.score, args.max_batch,
+                           args.max_delay / 1000, prepare=prepare)
+    batching = asyncio.create_task(batcher.run())
+
+    handle = serve_connection(batcher)
+    if args.socket is not None:
+        server = await asyncio.start_unix_server(handle, path=args.socket,
+                                                  backlog=1024)
+        logger.info(f"Scoring on unix socket {args.socket}")
+    else:
+        server = await asyncio.start_server(handle, args.host, args.port,
+                                            backlog=1024)
+        logger.info(f"Scoring on http://{args.host}:{args.port}/score")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        batching.cancel()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Score new scans against the reference equations.")
+    parser.add_argument("models_dir",
+                        type=Path,
+                        help="Directory holding the model artifacts.")
+    parser.add_argument("--host",
+                        default="127.0.0.1",
+                        help="Address to listen on. Default: 127.0.0.1.")
+    parser.add_argument("--port",
+                        type=int,
+                        default=8000,
+                        help="Port to listen on. Default: 8000.")
+    parser.add_argument("--socket",
+                        type=str,
+                        default=None,
+                        help="Listen on this unix socket instead of a port.")
+    parser.add_argument("--max_batch",
+                        type=int,
+                        default=4096,
+                        help="Rows scored together at most. Default: 4096.")
+    parser.add_argument("--max_delay",
+                        type=float,
+                        default=2.0,
+                        help="Milliseconds a request waits for others to "
+                        "join its batch. Default: 2.")
+    parser.add_argument("--univariate_vars",
+                        type=str,
+                        default="height",
+                        help="Comma separated independent variables whose "
+                        "univariate fits are scored. Default: height.")
+    parser.add_argument("--z_limit",
+                        type=float,
+                        default=Z_LIMIT,
+                        help="Residual z-score beyond which a parameter is "
+                        f"flagged unhealthy. Default: {Z_LIMIT}.")
+    parser.add_argument("--normalised",
+                        action="store_true",
+                        help="Normalise the bps to height, for models fitted "
+                        "with analyse.py --normalised.")
+    args = parser.parse_args()
+    try:
+        asyncio.run(main(args))
+    except KeyboardInterrupt:
+        pass
@@ -1,60 +1,188 @@
+from functools import partial
+from pathlib import Path
+import json
+import logging
+import numpy as np
+import pandas as pd
 from pynomo.nomographer import Nomographer
 
-N_params_2 = {
-    'u_min': 45,
-    'u_max': 90,
-    'function': lambda u: -0.0036*u,
-    'title': r'$Age$',
-    'tick_levels': 2,
-    'tick_text_levels': 1,
-}
-
-N_params_1 = {
-    'u_min': 16.0,
-    'u_max': 31.0,
-    'function': lambda u: -0.0114*u,
-    'title': r'$BMI$',
-    'tick_levels': 2,
-    'tick_text_levels': 1,
-    # 'scale_type': 'linear_smart',
-}
-
-N_params_3 = {
-    'u_min': 3.3,
-    'u_max': 3.65,
-    'function': lambda u: u-2.9632,
-    'title': r'$Pi10$',
-    'tick_levels': 3,
-    'tick_text_levels': 2,
-}
-
-block_1_params = {
-    'block_type': 'type_1',
-    'width': 16.0,
-    'height': 8.0,
-    'f1_params': N_params_1,
-    'f2_params': N_params_2,
-    'f3_params': N_params_3,
-    'isopleth_values': [[17, 45, "x"], [30, 80, "x"]]
-}
-
-main_params = {
-    'filename':
-    'test_nomo.pdf',
-    'paper_height':
-    10.0,
-    'paper_width':
-    16.0,
-    'block_params': [block_1_params],
-    'tranformations': [('rotate', 0.01), ('scale paper')],
-    'title_str':
-    r'$Pi10=c + b1*Age + b2*Height$',
-    'extra_texts': [{
-        'x': 2.50,
-        'y': 9.0,
-        'text': 'Female Never Smoker',
-        'width': 5,
-    }]
-}
-
-Nomographer(main_params)
+from data.util.schema import CATEGORIES, SMOKING_LABELS
+from data.util.tasks import keyed, needs, reads, writes
+from models.linear.multivariate import nomogram_covariates
+
+logger = logging.getLogger("BronchialParameters")
+
+scale_titles = {"bmi": "BMI", "age": "Age"}
+
+
+def _label(name: str) -> str:
+    return name.replace("bp_", "").replace("_", " ").title()
+
+
+def _filename(param: str, sex: str, smoking_status: str) -> str:
+    return f"{param}_{sex.lower()}_{smoking_status}_nomogram.pdf"
+
+
+def nomogram_params(fit: dict, param: str, sex: str, smoking_status: str,
+                    filename: str) -> dict:
+    """
+    Build the pynomo parameters of a nomogram of the stratum model
+    param = Intercept + b1 * BMI + b2 * Age.
+
+    The type 1 block draws f1(BMI) + f2(Age) + f3(param) = 0, with the
+    covariate scales spanning the range covered by the fit.
+
+    Parameters:
+    fit (dict): The stratum fit, as returned by fit_stratum.
+    param (str): The dependent bronchial parameter.
+    sex (str): Sex of the stratum.
+    smoking_status (str): Smoking status of the stratum.
+    filename (str): The PDF to write.
+
+    Returns:
+    dict: The main parameters of the Nomographer.
+    """
+    scales = []
+    predicted = [fit["Intercept"]] * 2
+    for var in nomogram_covariates:
+        low, high = fit[f"{var}_min"], fit[f"{var}_max"]
+        coef = fit[var]
+        # Bounds of the parameter over the corners of the covariate ranges
+        predicted[0] += min(coef * low, coef * high)
+        predicted[1] += max(coef * low, coef * high)
+        scales.append({
+            "u_min": low,
+            "u_max": high,
+            "function": lambda u, coef=coef: -coef * u,
+            "title": rf"${scale_titles.get(var, _label(var))}$",
+            "tick_levels": 2,
+            "tick_text_levels": 1,
+        })
+    intercept = fit["Intercept"]
+    scales.append({
+        "u_min": predicted[0],
+        "u_max": predicted[1],
+        "function": lambda u: u - intercept,
+        "title": rf"${_label(param)}$",
+        "tick_levels": 3,
+        "tick_text_levels": 2,
+    })
+
+    block_params = {
+        "block_type": "type_1",
+        "width": 16.0,
+        "height": 8.0,
+        "f1_params": scales[0],
+        "f2_params": scales[1],
+        "f3_params": scales[2],
+    }
+    terms = " ".join(f"{fit[var]:+.4f} {scale_titles.get(var, _label(var))}"
+                     for var in nomogram_covariates)
+    return {
+        "filename": filename,
+        "paper_height": 10.0,
+        "paper_width": 16.0,
+        "block_params": [block_params],
+        "transformations": [("rotate", 0.01), ("scale paper")],
+        "title_str": rf"${_label(param)} = {intercept:.4f} {terms}$",
+        "extra_texts": [{
+            "x": 2.50,
+            "y": 9.0,
+            "text": f"{sex} {_label(smoking_status)} (N = {fit['N']})",
+            "width": 5,
+        }],
+    }
+
+
+# Columns of multivariate_strata.csv naming the stratum of a fit
+STRATUM_COLUMNS = ["Sex", "Smoking Status", "Parameter"]
+# Relative change of a coefficient below which a nomogram is not redrawn
+TOLERANCE = 1e-9
+
+
+def stratum_fit(strata: Path, param: str, sex: str, smoking_status: str,
+                **_) -> dict:
+    """
+    Read the fit of one stratum from the multivariate_strata.csv written by
+    multivariate.fit_strata.
+
+    Returns:
+    dict: The fit, as returned by fit_stratum, or None if the stratum was
+          too small to fit.
+    """
+    table = pd.read_csv(strata)
+    rows = table[(table["Sex"] == sex) &
+                 (table["Smoking Status"] == smoking_status) &
+                 (table["Parameter"] == param)]
+    if rows.empty:
+        return None
+    fit = rows.drop(columns=STRATUM_COLUMNS).iloc[0].to_dict()
+    fit["N"] = int(fit["N"])
+    return fit
+
+
+def _key(fit: dict) -> str:
+    # Coefficients to 9 significant digits, so refits of an unchanged
+    # stratum give the same key
+    if fit is None:
+        return repr(None)
+    return repr({name: f"{value:.9g}" for name, value in fit.items()})
+
+
+def _unchanged(stored: Path, fit: dict) -> bool:
+    # Whether the fit the nomogram was drawn from matches this one
+    if not stored.exists():
+        return False
+    previous = json.loads(stored.read_text())
+    return previous.keys() == fit.keys() and all(
+        np.isclose(previous[name], value, rtol=TOLERANCE, atol=0)
+        for name, value in fit.items())
+
+
+@reads(lambda **_: [])
+@needs(lambda strata, **_: [strata])
+@writes(lambda param, sex, smoking_status, out_path, **_: [
+    out_path / _filename(param, sex, smoking_status),
+    (out_path / _filename(param, sex, smoking_status)).with_suffix(".json")])
+# Only a change of the stratum's coefficients redraws its nomogram
+@keyed(lambda data, **kwargs: _key(stratum_fit(**kwargs)))
+def plot_stratum(data: pd.DataFrame, param: str, sex: str,
+                 smoking_status: str, strata: Path, out_path: Path):
+    """
+    Draw the nomogram of the fit of param on BMI and age for one sex and
+    smoking status, read from strata, saved as
+    {param}_{sex}_{smoking_status}_nomogram.pdf in out_path. The fit is
+    stored alongside as json, and a nomogram whose fit has not changed is
+    not redrawn.
+    """
+    fit = stratum_fit(strata, param, sex, smoking_status)
+    if fit is None:
+        logger.warning(f"Too few {sex} {smoking_status} participants for a "
+                       f"{param} nomogram")
+        return
+    out_path.mkdir(parents=True, exist_ok=True)
+    filename = out_path / _filename(param, sex, smoking_status)
+    stored = filename.with_suffix(".json")
+    if filename.exists() and _unchanged(stored, fit):
+        logger.debug(f"{filename} is up to date")
+        return
+    Nomographer(nomogram_params(fit, param, sex, smoking_status,
+                                str(filename)))
+    stored.write_text(json.dumps(fit))
+
+
+def figures(bps: list, out_path: Path, strata: Path) -> list:
+    """
+    Returns one plot_stratum call per sex, smoking status and bp, each
+    taking the data as its only argument. The fits are read from strata,
+    the multivariate_strata.csv of the regression run.
+    """
+    out_path = out_path / "nomograms"
+    return [
+        partial(plot_stratum, param=param, sex=sex,
+                smoking_status=smoking_status, strata=strata,
+                out_path=out_path)
+        for param in bps
+        for sex in CATEGORIES["sex"].categories
+        for smoking_status in SMOKING_LABELS
+    ]
@@ -1,23 +1,104 @@
 #!/usr/bin/env python3
 
+from functools import partial
 from pathlib import Path
 import logging
 import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
 import scipy.stats as stats
-from tqdm import tqdm
 
 from data.util.dataframe import min_max_scale
+from data.util.tasks import reads, writes
 from .prettifiers import prettify_axes
+from .render import render
 
 logger = logging.getLogger("BronchialParameters")
 debug = (logger.level == logging.DEBUG)
 
+covariates = ["age", "height", "weight", "bmi"]
+
+
+@reads(lambda param, var, **_: [var, param, "smoking_status", "sex"])
+@writes(lambda param, var, out_path, **_: [
+    out_path / f"{param}_{var}_regression.png",
+    out_path / f"{param}_{var}_sex_regression.png"])
+def plot_pair(data: pd.DataFrame,
+              param: str,
+              var: str,
+              out_path: Path,
+              min_max_params: bool = False):
+    """
+    Draws the smoking status and the sex regression plots of one bronchial
+    parameter against one covariate, saved as {param}_{var}_regression.png
+    and {param}_{var}_sex_regression.png in out_path.
+    """
+    out_path.mkdir(parents=True, exist_ok=True)
+    sns.set_theme(style="whitegrid")
+    if min_max_params:
+        data = min_max_scale(data, list(dict.fromkeys([var, param])))
+    data_reg = data[[var, param, "smoking_status", "sex"]].dropna()
+    r, p = stats.pearsonr(data_reg[var], data_reg[param])
+
+    # Fixed seed for the bootstrapped confidence bands, so a figure is the
+    # same whichever process draws it
+    fig = sns.lmplot(
+        data=data_reg,
+        x=var,
+        y=param,
+        hue="smoking_status",
+        truncate=False,
+        scatter=debug,
+        scatter_kws={"alpha": 0.3},
+        seed=0,
+    )
+    logger.debug("Pearson for {} and {}: {}".format(var, param, r))
+    sns.despine(left=True)
+    if min_max_params:
+        fig.set(ylim=(0, 1))
+    prettify_axes(fig)
+    fig.fig.savefig(f"{str(out_path / param)}_{var}_regression.png",
+                    dpi=300)
+    plt.close()
+
+    fig2 = sns.lmplot(
+        data=data_reg,
+        x=var,
+        y=param,
+        hue="sex",
+        palette=sns.color_palette(["salmon", "lightblue"]),
+        truncate=False,
+        scatter=debug,
+        scatter_kws={"alpha": 0.3},
+        seed=0,
+    )
+    sns.despine(left=True)
+    if min_max_params:
+        fig2.set(ylim=(0, 1))
+    prettify_axes(fig2)
+    fig2.fig.savefig(
+        f"{str(out_path / param)}_{var}_sex_regression.png", dpi=300)
+    plt.close()
+
+
+def figures(bps: list, out_path: Path, min_max_params: bool = False) -> list:
+    """
+    Returns one plot_pair call per (bp, covariate) pair, each taking the data
+    as its only argument.
+    """
+    out_path = out_path / "regression"
+    return [
+        partial(plot_pair, param=param, var=var, out_path=out_path,
+                min_max_params=min_max_params)
+        for param in bps for var in covariates
+    ]
+
+
 def make_plots(data: pd.DataFrame,
                bps: list,
                out_path: Path,
-               min_max_params: bool = False):
+               min_max_params: bool = False,
+               workers: int = 1):
     """
     Creates scatter plots with linear regression fits to visualize the relationship between bronchial parameters (bp) and
     various demographic and anthropometric factors such as age, length, weight, and bmi. The plots are saved in a given
@@ -28,6 +109,7 @@ def make_plots(data: pd.DataFrame,
         smoking_status, and sex.
         bps (list): A list of strings containing the names of the bronchial parameters columns to be plotted.
         out_path (Path): A Path object pointing to the directory where the output plots will be saved.
+        workers (int): Number of processes the figures are rendered in.
 
     Returns:
         None
@@ -37,51 +119,4 @@ def make_plots(data: pd.DataFrame,
 
     """
 
-    sns.set_theme(style="whitegrid")
-    out_path = out_path / "regression"
-    out_path.mkdir(parents=True, exist_ok=True)
-
-    if min_max_params:
-        data = min_max_scale(data, ["age", "height", "weight", "bmi"] + bps)
-
-    for param in tqdm(bps):
-
-        for var in ["age", "height", "weight", "bmi"]:
-            data_reg = data[[var, param, "smoking_status", "sex"]].dropna()
-            r, p = stats.pearsonr(data_reg[var], data_reg[param])
-
-            fig = sns.lmplot(
-                data=data_reg,
-                x=var,
-                y=param,
-                hue="smoking_status",
-                truncate=False,
-                scatter=debug,
-                scatter_kws={"alpha": 0.3},
-            )
-            logger.debug("Pearson for {} and {}: {}".format(var, param, r))
-            sns.despine(left=True)
-            if min_max_params:
-                fig.set(ylim=(0, 1))
-            prettify_axes(fig)
-            fig.fig.savefig(f"{str(out_path / param)}_{var}_regression.png",
-                            dpi=300)
-            plt.close()
-
-            fig2 = sns.lmplot(
-                data=data_reg,
-                x=var,
-                y=param,
-                hue="sex",
-                palette=sns.color_palette(["salmon", "lightblue"]),
-                truncate=False,
-                scatter=debug,
-                scatter_kws={"alpha": 0.3},
-            )
-            sns.despine(left=True)
-            if min_max_params:
-                fig2.set(ylim=(0, 1))
-            prettify_axes(fig2)
-            fig2.fig.savefig(
-                f"{str(out_path / param)}_{var}_sex_regression.png", dpi=300)
-            plt.close()
+    render(data, figures(bps, out_path, min_max_params), workers)
@@ -0,0 +1,55 @@
+import logging
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import matplotlib
+from tqdm import tqdm
+
+logger = logging.getLogger("BronchialParameters")
+
+# Data the figures of this worker process are drawn from, set by init_worker
+_data = None
+
+
+def init_worker(data=None):
+    """
+    Prepare a process for rendering: select the non-interactive Agg backend
+    and keep a reference to the data the figures are drawn from.
+    """
+    global _data
+    matplotlib.use("Agg")
+    _data = data
+
+
+def _render(figure):
+    figure(_data)
+
+
+def render(data, figures: list, workers: int = 1):
+    """
+    Draw a list of independent figures, optionally in worker processes.
+
+    Each figure is a callable taking the data as its only argument (usually
+    a functools.partial of a module level plotting function) that saves
+    itself under a filename derived from its arguments, so the output files
+    do not depend on the number of workers or the order of completion.
+
+    Parameters:
+    data (pd.DataFrame): The data every figure is drawn from.
+    figures (list): The figure callables to render.
+    workers (int): Number of worker processes. 1 renders in this process.
+
+    Returns:
+    None
+    """
+    if workers == 1:
+        for figure in tqdm(figures):
+            figure(data)
+        return
+
+    # The data is handed to each worker once rather than pickled per figure
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=init_worker,
+                             initargs=(data, )) as pool:
+        futures = [pool.submit(_render, figure) for figure in figures]
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            future.result()
@@ -1,29 +1,41 @@
 #!/usr/bin/env python3
 
+from functools import partial
+
 import seaborn as sns
 import matplotlib.pyplot as plt
 
+from data.util.tasks import reads, writes
 from .prettifiers import prettify_axes
+from .render import render
 
 
-def make_plots(data, bps, out_path):
-    out_path = out_path / "violin"
+@reads(lambda param, **_: ["smoking_status", "sex", param])
+@writes(lambda param, out_path, **_: [out_path / f"{param}_violin.png"])
+def plot_param(data, param, out_path):
     out_path.mkdir(parents=True, exist_ok=True)
-
     sns.set_theme(style="whitegrid")
-    for param in bps:
-        fig = sns.violinplot(data=data,
-                             x="smoking_status",
-                             y=param,
-                             hue="sex",
-                             split=True,
-                             inner="quart",
-                             linewidth=1.5,
-                             palette={
-                                 "Male": "b",
-                                 "Female": "salmon"
-                             })
-        sns.despine(left=True)
-        prettify_axes(fig)
-        fig.get_figure().savefig(f"{str(out_path / param)}_violin.png", dpi=300)
-        plt.close()
+    fig = sns.violinplot(data=data,
+                         x="smoking_status",
+                         y=param,
+                         hue="sex",
+                         split=True,
+                         inner="quart",
+                         linewidth=1.5,
+                         palette={
+                             "Male": "b",
+                             "Female": "salmon"
+                         })
+    sns.despine(left=True)
+    prettify_axes(fig)
+    fig.get_figure().savefig(f"{str(out_path / param)}_violin.png", dpi=300)
+    plt.close()
+
+
+def figures(bps, out_path):
+    out_path = out_path / "violin"
+    return [partial(plot_param, param=param, out_path=out_path) for param in bps]
+
+
+def make_plots(data, bps, out_path, workers=1):
+    render(data, figures(bps, out_path), workers)
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from data.util.schema import (AGE_5YR_BINS, AGE_5YR_LABELS, PACK_YEAR_LABELS,
+                              SMOKING_LABELS, apply_schema)
+
+BPS = ["bp_pi10", "bp_wt_avg", "bp_la_avg", "bp_wap_avg"]
+
+
+def make_cohort(n: int = 600, seed: int = 0) -> pd.DataFrame:
+    """
+    A synthetic cohort with the columns the analyses read, the bps depending
+    linearly on the covariates.
+    """
+    rng = np.random.default_rng(seed)
+    sex = rng.choice(["Female", "Male"], n)
+    male = sex == "Male"
+    age = rng.uniform(45, 85, n)
+    height = rng.normal(1.65, 0.08, n) + 0.12 * male
+    weight = rng.normal(75, 12, n) + 8 * male
+    smoking = rng.choice(SMOKING_LABELS, n)
+    frame = pd.DataFrame({
+        "patientID": np.arange(100000, 100000 + n),
+        "sex": sex,
+        "age": age,
+        "height": height,
+        "weight": weight,
+        "bmi": weight / height**2,
+        "smoking_status": smoking,
+        "current_smoker": smoking == "current_smoker",
+        "pack_year_categories": rng.choice(PACK_YEAR_LABELS, n),
+        "age_5yr": pd.cut(age, bins=AGE_5YR_BINS, labels=AGE_5YR_LABELS,
+                          right=False).astype(str),
+        "tac": rng.normal(60, 10, n),
+        "fev1_pp": rng.normal(95, 12, n) - 0.2 * age,
+        "fev1_fvc": rng.normal(0.75, 0.06, n),
+    })
+    for i, bp in enumerate(BPS):
+        frame[bp] = (1 + i + 0.01 * age + 0.5 * height + 0.005 * weight +
+                     0.2 * male + rng.normal(0, 0.1, n))
+    # Missing values in a few rows, as in the real data
+    frame.loc[rng.choice(n, 20, replace=False), "bp_wt_avg"] = np.nan
+    frame.loc[rng.choice(n, 10, replace=False), "tac"] = np.nan
+    return apply_schema(frame)
+
+
+@pytest.fixture
+def cohort() -> pd.DataFrame:
+    return make_cohort()
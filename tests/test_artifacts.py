@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+import pytest
+import statsmodels.formula.api as smf
+
+from models.artifacts import (ARTIFACT_VERSION, LinearModel, load_artifact,
+                              save_artifact)
+from models.linear.multivariate import save_fit
+
+
+def _data(n: int = 120, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    data = pd.DataFrame({
+        "sex": rng.choice(["Female", "Male"], n),
+        "age": rng.uniform(45, 85, n),
+    })
+    data["y"] = (1.0 + 0.02 * data["age"] + 0.3 * (data["sex"] == "Male") +
+                 rng.normal(0, 0.1, n))
+    return data
+
+
+def _save(model, path, ranges=None):
+    fit = {"coef": model.params.to_numpy(), "cov": model.cov_params(),
+           "scale": model.scale, "df_resid": model.df_resid,
+           "nobs": model.nobs}
+    save_fit(path, fit, "y", model.params.index.tolist(),
+             {"sex": ["Female", "Male"]}, "hash", ranges)
+
+
+def test_linear_model_matches_statsmodels(tmp_path):
+    data = _data()
+    model = smf.ols("y ~ sex + age", data=data).fit()
+    _save(model, tmp_path / "model.npz")
+    loaded = load_artifact(tmp_path / "model.npz")
+
+    assert isinstance(loaded, LinearModel)
+    assert loaded.variables == ["sex", "age"]
+    np.testing.assert_allclose(loaded.predict(data), model.predict(data))
+    np.testing.assert_allclose(loaded.standard_error(data),
+                               model.get_prediction(data).se_mean)
+    np.testing.assert_allclose(loaded.residual_sd, np.sqrt(model.scale))
+    # Labels outside the levels of the fit predict missing values
+    other = data.head(2).assign(sex=["Other", "Male"])
+    assert np.isnan(loaded.predict(other)).tolist() == [True, False]
+
+
+def test_scaled_model_predicts_in_original_units(tmp_path):
+    data = _data()
+    ranges = {col: (data[col].min(), data[col].max()) for col in ("age", "y")}
+    scaled = data.assign(**{
+        col: (data[col] - low) / (high - low)
+        for col, (low, high) in ranges.items()})
+    model = smf.ols("y ~ sex + age", data=scaled).fit()
+    _save(model, tmp_path / "model.npz", ranges)
+    loaded = load_artifact(tmp_path / "model.npz")
+
+    low, high = ranges["y"]
+    np.testing.assert_allclose(loaded.predict(data),
+                               model.predict(scaled) * (high - low) + low)
+    np.testing.assert_allclose(loaded.residual_sd,
+                               np.sqrt(model.scale) * (high - low))
+
+
+def test_other_versions_and_kinds_are_rejected(tmp_path):
+    path = tmp_path / "model.npz"
+    save_artifact(path, "forest", {}, "hash")
+    with pytest.raises(ValueError, match="unknown model kind"):
+        load_artifact(path)
+    np.savez(path, version=np.array(ARTIFACT_VERSION + 1),
+             kind=np.array(LinearModel.kind))
+    with pytest.raises(ValueError, match="version"):
+        load_artifact(path)
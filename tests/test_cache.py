@@ -0,0 +1,65 @@
+import os
+from functools import partial
+
+import pandas as pd
+
+from data.util.cache import ResultCache, frame_hash
+
+calls = []
+
+
+def describe(data, column, out_path):
+    calls.append(column)
+    data[column].describe().to_csv(out_path / f"{column}.csv")
+
+
+def _frame() -> pd.DataFrame:
+    return pd.DataFrame({"a": [1.0, 2.0, 3.0], "b": [4, 5, 6]})
+
+
+def test_frame_hash_follows_values_and_dtypes():
+    df = _frame()
+    assert frame_hash(df) == frame_hash(_frame())
+    assert frame_hash(df) != frame_hash(df.assign(a=[1.0, 2.0, 3.5]))
+    assert frame_hash(df) != frame_hash(df.astype({"b": float}))
+    assert frame_hash(df) != frame_hash(df.set_axis([1, 2, 3]))
+
+
+def test_key_ignores_the_output_directory(tmp_path):
+    cache = ResultCache(tmp_path / "cache", max_bytes=1 << 20)
+    key = cache.key(partial(describe, column="a", out_path=tmp_path), "data")
+    assert key == cache.key(
+        partial(describe, column="a", out_path=tmp_path / "other"), "data")
+    assert key != cache.key(
+        partial(describe, column="b", out_path=tmp_path), "data")
+    assert key != cache.key(
+        partial(describe, column="a", out_path=tmp_path), "other data")
+
+
+def test_results_are_reused(tmp_path):
+    cache = ResultCache(tmp_path / "cache", max_bytes=1 << 20)
+    calls.clear()
+    for out_path in (tmp_path / "first", tmp_path / "second"):
+        out_path.mkdir()
+        func = partial(describe, column="a", out_path=out_path)
+        cache.run(func, _frame(), frame_hash(_frame()))
+    assert calls == ["a"]
+    assert ((tmp_path / "second" / "a.csv").read_text() ==
+            (tmp_path / "first" / "a.csv").read_text())
+
+
+def test_evict_removes_the_least_recently_used(tmp_path):
+    cache = ResultCache(tmp_path / "cache", max_bytes=1 << 20)
+    out_path = tmp_path / "out"
+    out_path.mkdir()
+    for i, column in enumerate(["a", "b"]):
+        func = partial(describe, column=column, out_path=out_path)
+        cache.run(func, _frame(), "data")
+        entry = cache.cache_dir / cache.key(func, "data")
+        os.utime(entry, (i, i))
+    size = sum(f.stat().st_size for f in cache.cache_dir.rglob("*.csv"))
+
+    cache.max_bytes = size - 1
+    cache.evict()
+    kept = [entry.name for entry in cache.cache_dir.iterdir()]
+    assert kept == [cache.key(func, "data")]
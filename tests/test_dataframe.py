@@ -0,0 +1,64 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from data.util.dataframe import coalesce_columns, derive_smoking_status
+
+FLAGS = ["never_smoker", "ever_smoker", "current_smoker", "ex_smoker"]
+
+
+def test_coalesce_columns_matches_nested_fillna():
+    rng = np.random.default_rng(1)
+    values = rng.normal(size=(50, 3))
+    values[rng.random((50, 3)) < 0.4] = np.nan
+    df = pd.DataFrame(values, columns=["a", "b", "c"])
+    df["other"] = 1.0
+
+    result = coalesce_columns(df, {"a": ["a", "b", "c"], "d": ["c", "b"]})
+
+    expected_a = df["a"].fillna(df["b"].fillna(df["c"]))
+    expected_d = df["c"].fillna(df["b"])
+    pd.testing.assert_series_equal(result["a"], expected_a, check_names=False)
+    pd.testing.assert_series_equal(result["d"], expected_d, check_names=False)
+    assert list(result) == ["a", "other", "d"]
+    # The input is left as it was
+    assert list(df) == ["a", "b", "c", "other"]
+
+
+def test_coalesce_columns_keeps_sources():
+    df = pd.DataFrame({"a": [np.nan, 1.0], "b": [2.0, 3.0]})
+    result = coalesce_columns(df, {"c": ["a", "b"]}, drop=False)
+    assert list(result) == ["a", "b", "c"]
+    assert result["c"].tolist() == [2.0, 1.0]
+
+
+def _expected_status(never, ever, current, ex) -> str:
+    # The rules of the former per-row derivation
+    if (never is None and current is True) or ever is True or ex is True:
+        never = False
+    if never is None and None not in (ever, current, ex):
+        never = True
+    for status, answer in [("current_smoker", current), ("ex_smoker", ex),
+                           ("never_smoker", never)]:
+        if answer is True:
+            return status
+    return None
+
+
+def test_smoking_status_of_every_combination_of_answers():
+    answers = list(itertools.product([True, False, None], repeat=4))
+    df = pd.DataFrame(answers, columns=FLAGS, dtype=object)
+    result = derive_smoking_status(df)
+
+    expected = [_expected_status(*row) for row in answers]
+    assert result["smoking_status"].tolist() == expected
+    assert (result[FLAGS].dtypes == "boolean").all()
+    # Only never_smoker is filled in or overridden
+    others = FLAGS[1:]
+    given = df[others].notna().to_numpy()
+    np.testing.assert_array_equal(
+        result[others].to_numpy()[given], df[others].to_numpy()[given])
+    assert (result[others].isna() == df[others].isna()).all().all()
+    # The input is left as it was
+    assert list(df) == FLAGS
@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+from sklearn.tree import DecisionTreeClassifier
+
+from models.clustering.decision_tree import (MISSING_BIN, HistForest, HistTree,
+                                             bin_columns, cross_validate)
+
+
+def _data(n: int = 600, seed: int = 0) -> tuple:
+    # The class follows the first two features, the third is noise
+    rng = np.random.default_rng(seed)
+    x = rng.normal(size=(n, 3))
+    y = (x[:, 0] > 0.3).astype(int) + (x[:, 1] > 0.5)
+    x[rng.random(x.shape) < 0.02] = np.nan
+    return x, y
+
+
+def test_bins_follow_the_order_of_the_values():
+    x, _ = _data()
+    codes = bin_columns(x, max_bins=16)
+    assert (codes[np.isnan(x)] == MISSING_BIN).all()
+    for j in range(x.shape[1]):
+        present = ~np.isnan(x[:, j])
+        order = np.argsort(x[present, j])
+        assert (np.diff(codes[present, j][order].astype(int)) >= 0).all()
+        assert codes[present, j].max() < 16
+
+
+def test_first_split_matches_sklearn():
+    x, y = _data()
+    codes = bin_columns(x)
+    tree = HistTree(max_depth=1, min_samples_leaf=20).fit(codes, y, 3)
+    expected = DecisionTreeClassifier(max_depth=1, min_samples_leaf=20).fit(
+        codes, y).tree_
+    assert tree.feature[0] == expected.feature[0]
+    assert tree.threshold[0] == int(expected.threshold[0])
+
+
+def test_trees_learn_the_rule():
+    x, y = _data()
+    codes = bin_columns(x)
+    tree = HistTree(min_samples_leaf=5).fit(codes, y, 3)
+    assert (tree.predict_proba(codes).argmax(axis=1) == y).mean() > 0.95
+    assert tree.importance[2] < 0.05 * tree.importance.sum()
+    forest = HistForest(n_trees=10, min_samples_leaf=5).fit(codes, y, 3)
+    proba = forest.predict_proba(codes)
+    np.testing.assert_allclose(proba.sum(axis=1), 1.0)
+    assert (proba.argmax(axis=1) == y).mean() > 0.9
+
+
+def test_cross_validate_writes_scores_and_importance(tmp_path):
+    x, y = _data()
+    data = pd.DataFrame(x, columns=["a", "b", "c"])
+    data["stage"] = np.array(["low", "mid", "high"])[y]
+    cross_validate(data, "stage", tmp_path, features=["a", "b", "c"])
+
+    scores = pd.read_csv(tmp_path / "tree_stage.csv")
+    assert scores["Model"].tolist() == ["Tree", "Forest"]
+    assert (scores["Accuracy"] > scores["Majority Baseline"]).all()
+    importance = pd.read_csv(tmp_path / "tree_stage_importance.csv",
+                             index_col="Feature")
+    np.testing.assert_allclose(importance.sum(), 1.0, atol=1e-3)
+    assert importance.idxmin().tolist() == ["c", "c"]
@@ -0,0 +1,38 @@
+import pandas as pd
+import pytest
+
+from features.descriptive.demographics import (calc_demographics,
+                                               update_demographics)
+
+PARAMS = ["age", "bmi", "bp_pi10", "bp_wt_avg"]
+
+
+def _tables(data, out_dir, shards: int, described=None) -> tuple:
+    out_dir.mkdir()
+    calc_demographics(data, PARAMS, out_dir, "smoking_status",
+                      described=described, shards=shards)
+    return (pd.read_csv(out_dir / "demographics.csv"),
+            pd.read_csv(out_dir / "demographics_all.csv", index_col=0))
+
+
+@pytest.mark.parametrize("described", [None, ["age", "tac", "bp_pi10"]])
+def test_sharded_tables_match_in_memory(cohort, tmp_path, described):
+    table, table_all = _tables(cohort, tmp_path / "one", 1, described)
+    sharded, sharded_all = _tables(cohort, tmp_path / "three", 3, described)
+    pd.testing.assert_frame_equal(sharded, table)
+    pd.testing.assert_frame_equal(sharded_all, table_all)
+    if described is not None:
+        assert list(table_all) == ["age", "tac", "bp_pi10"]
+
+
+def test_updates_match_the_whole_cohort(cohort, tmp_path):
+    table, table_all = _tables(cohort, tmp_path / "whole", 1)
+    out_dir = tmp_path / "updated"
+    out_dir.mkdir()
+    for batch in (cohort[:250], cohort[250:251], cohort[251:], cohort[:250]):
+        update_demographics(batch, PARAMS, out_dir, "smoking_status")
+    pd.testing.assert_frame_equal(
+        pd.read_csv(out_dir / "demographics.csv"), table)
+    pd.testing.assert_frame_equal(
+        pd.read_csv(out_dir / "demographics_all.csv", index_col=0),
+        table_all)
@@ -0,0 +1,32 @@
+import numpy as np
+import pandas as pd
+
+from data.expand_bps import GENERATIONS, expand_bps, parse_generations
+
+
+def test_generations_are_split_into_floats():
+    df = pd.DataFrame({
+        "bp_wt": ["1.5;2;3", " 4 ; ;6", None, ";".join(["1"] * 11)],
+        # A column with one generation is read as numbers
+        "bp_la": [1.0, np.nan, 3.0, 4.0],
+    })
+    values = parse_generations(df, ["bp_wt", "bp_la"])
+    assert values.shape == (4, 2, GENERATIONS)
+    np.testing.assert_array_equal(values[0, 0, :4], [1.5, 2.0, 3.0, np.nan])
+    np.testing.assert_array_equal(values[1, 0, :3], [4.0, np.nan, 6.0])
+    assert np.isnan(values[2, 0]).all()
+    # Generations past the ninth are ignored
+    np.testing.assert_array_equal(values[3, 0], np.ones(GENERATIONS))
+    np.testing.assert_array_equal(values[:, 1, 0], [1.0, np.nan, 3.0, 4.0])
+    assert np.isnan(values[:, 1, 1:]).all()
+
+
+def test_expanded_columns_replace_the_delimited_ones():
+    df = pd.DataFrame({"patientID": [7, 8], "bp_wt": ["1;2", "3"]},
+                      index=[10, 11])
+    expanded = expand_bps(df, ["bp_wt"])
+    assert list(expanded) == ["patientID"] + [
+        f"bp_wt_{gen}" for gen in range(GENERATIONS)]
+    assert expanded.index.tolist() == [10, 11]
+    assert expanded["bp_wt_1"].tolist()[0] == 2.0
+    assert np.isnan(expanded["bp_wt_1"].tolist()[1])
@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from data.util.dataframe import get_group, normalise_bps
+from data.util.schema import CATEGORIES, apply_schema
+from models.clustering.kmeans import cluster, group_chunks, profile_params
+
+CENTRES = [0.0, 5.0, 10.0]
+
+
+def _dataset(path, n: int = 450, seed: int = 0):
+    # Participants in three well separated profile clusters, a third of them
+    # with a diagnosis, written to a csv as the analyses read it
+    rng = np.random.default_rng(seed)
+    blob = np.arange(n) % len(CENTRES)
+    frame = pd.DataFrame({
+        "patientID": np.arange(100000, 100000 + n),
+        "GOLD_stage": "0",
+        "copd_diagnosis": rng.random(n) < 0.3,
+        "asthma_diagnosis": False,
+        "cancer_type": "",
+        "height": rng.normal(1.7, 0.1, n),
+    })
+    for param in profile_params:
+        frame[param] = np.take(CENTRES, blob) + rng.normal(0, 0.3, n)
+    frame.loc[rng.choice(n, 15, replace=False), "bp_pi10"] = np.nan
+    frame.to_csv(path, index=False)
+    return blob
+
+
+@pytest.mark.parametrize("health_stat", ["healthy", "all"])
+def test_chunks_match_the_loaded_group(tmp_path, health_stat):
+    source = tmp_path / "cohort.csv"
+    _dataset(source)
+    # bp_wt_avg is not read, it is left out of the normalisation
+    normalise = ["bp_pi10", "tac", "bp_wt_avg"]
+    chunks = pd.concat(group_chunks(source, 64, ["patientID"] + profile_params,
+                                    health_stat, normalise))
+
+    labels = {col: str for col in CATEGORIES}
+    expected = get_group(apply_schema(pd.read_csv(source, dtype=labels)),
+                         health_stat)
+    expected = normalise_bps(expected, ["bp_pi10", "tac"])
+    pd.testing.assert_frame_equal(chunks, expected[list(chunks)],
+                                  check_dtype=False)
+
+
+def test_clusters_are_recovered(tmp_path):
+    source = tmp_path / "cohort.csv"
+    blob = _dataset(source)
+    cluster(None, tmp_path, source, health_stat="all", n_clusters=3,
+            chunk_size=100)
+
+    assignments = pd.read_csv(tmp_path / "kmeans_assignments.csv")
+    centroids = pd.read_csv(tmp_path / "kmeans_centroids.csv")
+    # Every participant with the whole profile, each blob in one cluster
+    blob = pd.Series(blob, index=100000 + np.arange(len(blob)))
+    labels = blob[assignments["patientID"]].to_numpy()
+    assert len(assignments) == len(blob) - 15
+    for i in range(len(CENTRES)):
+        assert assignments["Cluster"][labels == i].nunique() == 1
+    assert centroids["N"].sum() == len(assignments)
+    np.testing.assert_allclose(np.sort(centroids["bp_wt_3"]), CENTRES,
+                               atol=0.1)
+
+
+def test_normalised_centroids_are_per_height(tmp_path):
+    source = tmp_path / "cohort.csv"
+    _dataset(source)
+    cluster(None, tmp_path, source, health_stat="all", n_clusters=3,
+            chunk_size=100, normalise=["bp_pi10", "bp_wt_avg"])
+
+    data = pd.read_csv(source).set_index("patientID")
+    assignments = pd.read_csv(tmp_path / "kmeans_assignments.csv")
+    centroids = pd.read_csv(tmp_path / "kmeans_centroids.csv")
+    rows = data.loc[assignments["patientID"]]
+    expected = (rows["bp_pi10"] / rows["height"]).groupby(
+        assignments["Cluster"].to_numpy()).mean()
+    np.testing.assert_allclose(centroids["bp_pi10"], expected, atol=0.02)
+    np.testing.assert_allclose(
+        centroids["bp_wt_3"],
+        rows["bp_wt_3"].groupby(assignments["Cluster"].to_numpy()).mean(),
+        atol=0.02)
@@ -0,0 +1,28 @@
+import numpy as np
+
+from models.clustering.knn import neighbours, standardise, vote
+
+
+def test_neighbours_match_brute_force():
+    rng = np.random.default_rng(0)
+    x = standardise(rng.normal(size=(300, 5)))
+    ind = neighbours(x, k=7, leaf_size=8)
+
+    distances = np.linalg.norm(x[:, None] - x[None, :], axis=-1)
+    np.fill_diagonal(distances, np.inf)
+    expected = np.argsort(distances, axis=1)[:, :7]
+    np.testing.assert_array_equal(ind, expected)
+
+
+def test_duplicate_rows_are_not_their_own_neighbours():
+    x = np.array([[0.0, 0.0], [0.0, 0.0], [1.0, 1.0], [3.0, 3.0]])
+    ind = neighbours(x, k=2)
+    assert (ind != np.arange(len(x))[:, None]).all()
+    assert set(ind[0]) == {1, 2} and set(ind[1]) == {0, 2}
+
+
+def test_vote_takes_the_most_common_label():
+    labels = np.array([0, 1, 1, 2])
+    ind = np.array([[1, 2, 3], [0, 3, 2], [0, 3, 1]])
+    # Ties go to the lowest code
+    assert vote(labels, ind, 3).tolist() == [1, 0, 0]
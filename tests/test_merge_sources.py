@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from data.merge_sources import merge_sources
+
+
+def _sources(tmp_path) -> list:
+    # The same participants, their IDs stored as integers, floats and text
+    first = tmp_path / "first.csv"
+    pd.DataFrame({"patientID": [1, 2, 3], "age": [60, 70, 80],
+                  "sex": ["Male", "Female", "Male"]}).to_csv(first,
+                                                             index=False)
+    second = tmp_path / "second.feather"
+    pd.DataFrame({"patientID": [3.0, 1.0, 4.0], "fev1": [2.5, 3.0, 1.0],
+                  "age": [0, 0, 0]}).to_feather(second)
+    third = tmp_path / "third.csv"
+    pd.DataFrame({"patientID": ["2", "3"], "tac": [300.0, 310.0]}).to_csv(
+        third, index=False)
+    return [first, second, third]
+
+
+def test_sources_are_left_joined_on_patient_id(tmp_path):
+    merged = merge_sources(_sources(tmp_path),
+                           ["patientID", "tac", "age", "fev1", "sex"])
+    assert list(merged) == ["tac", "age", "fev1", "sex"]
+    assert merged.index.tolist() == [1, 2, 3]
+    # A variable comes from the first source holding it
+    assert merged["age"].tolist() == [60, 70, 80]
+    np.testing.assert_array_equal(merged["fev1"], [3.0, np.nan, 2.5])
+    np.testing.assert_array_equal(merged["tac"], [np.nan, 300.0, 310.0])
+
+
+def test_unknown_variable_is_an_error(tmp_path):
+    with pytest.raises(ValueError, match="height"):
+        merge_sources(_sources(tmp_path), ["patientID", "age", "height"])
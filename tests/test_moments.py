@@ -0,0 +1,122 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from data.util.moments import (Extent, Moments, SortedValues, accumulate,
+                               load_statistics, merge, runs_dir,
+                               save_statistics)
+
+QUANTILES = [0.0, 0.025, 0.25, 0.5, 0.75, 0.975, 1.0]
+
+
+def _parts(seed: int = 0) -> list:
+    rng = np.random.default_rng(seed)
+    # Rounded values, so the runs share ties
+    return [np.round(rng.normal(size=(size, 3)), 1) for size in (40, 1, 0, 25)]
+
+
+def test_moments_merge_matches_whole_sample():
+    parts = _parts()
+    merged = Moments.of(parts[0])
+    for part in parts[1:]:
+        merged = merged.merge(Moments.of(part))
+    whole = np.concatenate(parts)
+
+    assert merged.n == len(whole)
+    np.testing.assert_allclose(merged.mean, whole.mean(axis=0))
+    np.testing.assert_allclose(merged.var, whole.var(axis=0, ddof=1))
+    np.testing.assert_allclose(merged.comoment / (len(whole) - 1),
+                               np.cov(whole, rowvar=False))
+
+
+def test_moments_affine_and_select():
+    whole = np.concatenate(_parts())
+    shift, scale = np.array([1.0, -2.0, 0.5]), np.array([2.0, 3.0, 0.25])
+    moments = Moments.of(whole).affine(shift, scale)
+    expected = Moments.of((whole - shift) / scale)
+    np.testing.assert_allclose(moments.total, expected.total, atol=1e-9)
+    np.testing.assert_allclose(moments.comoment, expected.comoment)
+
+    selected = Moments.of(whole).select([2, 0])
+    expected = Moments.of(whole[:, [2, 0]])
+    np.testing.assert_allclose(selected.total, expected.total)
+    np.testing.assert_allclose(selected.comoment, expected.comoment)
+
+
+def test_extent_merge():
+    parts = [np.array([[1.0, np.nan], [3.0, 2.0]]), np.array([[-1.0, 5.0]])]
+    extent = Extent.of(parts[0]).merge(Extent.of(parts[1]))
+    assert extent.low.tolist() == [-1.0, 2.0]
+    assert extent.high.tolist() == [3.0, 5.0]
+
+
+def test_sorted_values_merge_matches_pandas_quantile():
+    parts = [part[:, 0] for part in _parts()]
+    parts[0][:5] = np.nan
+    merged = SortedValues.of(parts[0])
+    for part in parts[1:]:
+        merged = merged.merge(SortedValues.of(part))
+    whole = pd.Series(np.concatenate(parts))
+
+    assert len(merged) == whole.count()
+    np.testing.assert_array_equal(merged.quantile(QUANTILES),
+                                  whole.quantile(QUANTILES).to_numpy())
+    assert np.isnan(SortedValues.of([]).quantile([0.5])).all()
+
+
+def test_merge_dicts_keeps_unshared_keys():
+    a = {"x": Extent.of([1.0]), "y": Extent.of([2.0])}
+    b = {"x": Extent.of([3.0])}
+    merged = merge(a, b)
+    assert merged["x"].high.tolist() == [3.0]
+    assert merged["y"] is a["y"]
+
+
+def test_save_and_load_statistics(tmp_path):
+    parts = _parts()
+    stats = {
+        "all": {
+            None: {"moments": Moments.of(parts[0]),
+                   "values": SortedValues.of(parts[0][:, 1])},
+            "Male": {"extent": Extent.of(parts[1])},
+        }
+    }
+    path = tmp_path / "state.npz"
+    save_statistics(path, stats, {"note": "test"})
+    loaded, meta = load_statistics(path)
+
+    assert meta == {"note": "test"}
+    np.testing.assert_array_equal(loaded["all"][None]["moments"].comoment,
+                                  stats["all"][None]["moments"].comoment)
+    np.testing.assert_array_equal(
+        loaded["all"][None]["values"].quantile(QUANTILES),
+        stats["all"][None]["values"].quantile(QUANTILES))
+    np.testing.assert_array_equal(loaded["all"]["Male"]["extent"].high,
+                                  stats["all"]["Male"]["extent"].high)
+
+
+def test_accumulate_matches_in_memory(tmp_path):
+    path = tmp_path / "state.npz"
+    parts = [part[:, 0] for part in _parts()]
+
+    def batch(values):
+        return lambda _: {"values": SortedValues.of(values),
+                          "moments": Moments.of(values)}
+
+    for i, values in enumerate(parts):
+        stats, meta = accumulate(path, {"x": 1}, f"batch{i}", batch(values))
+    # A batch merged before is skipped
+    stats, meta = accumulate(path, {"x": 1}, "batch0", batch(parts[0]))
+    # Every save writes one file of new runs, empty batches none
+    assert len(list(runs_dir(path).iterdir())) == 3
+
+    whole = pd.Series(np.concatenate(parts))
+    stats, meta = load_statistics(path)
+    assert meta["batches"] == ["batch0", "batch1", "batch2", "batch3"]
+    assert stats["moments"].n == len(whole)
+    np.testing.assert_allclose(stats["moments"].mean[0], whole.mean())
+    np.testing.assert_array_equal(stats["values"].quantile(QUANTILES),
+                                  whole.quantile(QUANTILES).to_numpy())
+
+    with pytest.raises(ValueError):
+        accumulate(path, {"x": 2}, "batch4", batch(parts[0]))
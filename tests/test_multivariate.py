@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from data.util.moments import Moments
+from models.artifacts import load_artifact
+from models.linear import multivariate
+
+
+def _fits(data, tmp_path, shards: int, min_max_params: bool = False):
+    out_path = tmp_path / f"shards{shards}"
+    out_path.mkdir()
+    multivariate.fit_analyse(data, ["fev1_pp"], out_path, min_max_params,
+                             shards=shards)
+    suffix = "_normalised" if min_max_params else ""
+    return load_artifact(out_path / f"multivariate_model_fev1_pp{suffix}.npz")
+
+
+@pytest.mark.parametrize("min_max_params", [False, True])
+def test_sharded_fit_matches_in_memory(cohort, tmp_path, min_max_params):
+    in_memory = _fits(cohort, tmp_path, 1, min_max_params)
+    sharded = _fits(cohort, tmp_path, 3, min_max_params)
+    assert sharded.terms == in_memory.terms
+    assert sharded.levels == in_memory.levels
+    np.testing.assert_allclose(sharded.coef, in_memory.coef, atol=1e-10)
+    np.testing.assert_allclose(sharded.cov, in_memory.cov, atol=1e-12)
+
+
+def test_sharded_fit_drops_unobserved_levels(cohort, tmp_path):
+    # Without the reference level, the next level becomes the reference
+    data = cohort[cohort["pack_year_categories"] != "0"]
+    in_memory = _fits(data, tmp_path, 1)
+    sharded = _fits(data, tmp_path, 3)
+    assert "pack_year_categories[T.1-10]" not in sharded.terms
+    assert sharded.terms == in_memory.terms
+    assert sharded.levels["pack_year_categories"] == ["1-10", "10-20", "20+"]
+    np.testing.assert_allclose(sharded.coef, in_memory.coef, atol=1e-10)
+
+
+def test_ols_from_moments_rejects_collinear_columns():
+    rng = np.random.default_rng(0)
+    x = rng.normal(size=(50, 2))
+    values = np.column_stack([x, x.sum(axis=1), rng.normal(size=50)])
+    with pytest.raises(ValueError):
+        multivariate.ols_from_moments(Moments.of(values))
@@ -0,0 +1,68 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from visualization import nomograms
+
+FIT = {"Intercept": 2.0, "bmi": 0.05, "age": -0.01, "bmi_min": 18.0,
+       "bmi_max": 35.0, "age_min": 45.0, "age_max": 85.0,
+       "Residual SD": 0.1, "N": 120}
+
+
+@pytest.fixture
+def strata(tmp_path):
+    path = tmp_path / "multivariate_strata.csv"
+    pd.DataFrame([{"Sex": "Male", "Smoking Status": "ex_smoker",
+                   "Parameter": "bp_pi10", **FIT}]).to_csv(path, index=False)
+    return path
+
+
+def test_stratum_fit(strata):
+    assert nomograms.stratum_fit(strata, "bp_pi10", "Male",
+                                 "ex_smoker") == FIT
+    assert nomograms.stratum_fit(strata, "bp_pi10", "Female",
+                                 "ex_smoker") is None
+
+
+def test_key_ignores_rounding_noise():
+    noisy = {**FIT, "bmi": FIT["bmi"] * (1 + 1e-12)}
+    assert nomograms._key(noisy) == nomograms._key(FIT)
+    assert nomograms._key({**FIT, "bmi": 0.06}) != nomograms._key(FIT)
+
+
+def test_scales_solve_the_stratum_equation():
+    params = nomograms.nomogram_params(FIT, "bp_pi10", "Male", "ex_smoker",
+                                       "out.pdf")
+    block = params["block_params"][0]
+    f1, f2, f3 = (block[f"f{i}_params"] for i in (1, 2, 3))
+    assert (f1["u_min"], f1["u_max"]) == (18.0, 35.0)
+    bmi, age = 27.0, 60.0
+    predicted = FIT["Intercept"] + FIT["bmi"] * bmi + FIT["age"] * age
+    np.testing.assert_allclose(
+        f1["function"](bmi) + f2["function"](age) + f3["function"](predicted),
+        0.0, atol=1e-12)
+    # The parameter scale spans the predictions over the covariate ranges
+    assert f3["u_min"] == pytest.approx(2.0 + 0.05 * 18 - 0.01 * 85)
+    assert f3["u_max"] == pytest.approx(2.0 + 0.05 * 35 - 0.01 * 45)
+
+
+def test_unchanged_fit_is_not_redrawn(strata, tmp_path, monkeypatch):
+    drawn = []
+    monkeypatch.setattr(nomograms, "Nomographer",
+                        lambda params: drawn.append(params["filename"]))
+    out_path = tmp_path / "nomograms"
+    out_path.mkdir()
+    pdf = out_path / "bp_pi10_male_ex_smoker_nomogram.pdf"
+    pdf.touch()
+    pdf.with_suffix(".json").write_text(json.dumps(FIT))
+
+    nomograms.plot_stratum(None, "bp_pi10", "Male", "ex_smoker", strata,
+                           out_path)
+    assert drawn == []
+    pdf.with_suffix(".json").write_text(json.dumps({**FIT, "bmi": 0.06}))
+    nomograms.plot_stratum(None, "bp_pi10", "Male", "ex_smoker", strata,
+                           out_path)
+    assert drawn == [str(pdf)]
+    assert json.loads(pdf.with_suffix(".json").read_text()) == FIT
@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+import pyreadstat
+import pytest
+
+from data.read_spss import project_columns, read_spss
+
+
+def _write_sav(path, with_key: bool = True):
+    df = pd.DataFrame({
+        "patientID": [3.0, 1.0, 2.0],
+        "age": [70.0, 999.0, 60.0],
+        "smoker": ["yes", "", "no"],
+        "unused": [1.0, 2.0, 3.0],
+    })
+    if not with_key:
+        df = df.drop(columns="patientID")
+    # 999 is a user defined missing value code
+    pyreadstat.write_sav(df, str(path), missing_ranges={"age": [999.0]})
+
+
+def test_listed_variables_are_read_sorted_by_patient(tmp_path):
+    path = tmp_path / "survey.sav"
+    _write_sav(path)
+    variables = ["smoker", "height", "age"]
+    assert project_columns(path, variables) == ["patientID", "smoker", "age"]
+
+    df = read_spss(path, variables)
+    assert list(df) == ["patientID", "smoker", "age"]
+    assert df["patientID"].tolist() == [1.0, 2.0, 3.0]
+    # The missing value code and the empty string are read as missing
+    np.testing.assert_array_equal(df["age"], [np.nan, 60.0, 70.0])
+    assert df["smoker"].isna().tolist() == [True, False, False]
+
+
+def test_file_without_patient_id_is_an_error(tmp_path):
+    path = tmp_path / "survey.sav"
+    _write_sav(path, with_key=False)
+    with pytest.raises(ValueError, match="patientID"):
+        read_spss(path, ["age"])
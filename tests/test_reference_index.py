@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from features.descriptive.reference_index import (STRATA, ReferenceIndex,
+                                                  build_index)
+
+BPS = ["bp_pi10", "bp_wt_avg"]
+
+
+def test_scores_match_pandas_per_stratum(cohort):
+    index = build_index(cohort, BPS)
+    new = cohort.sample(100, random_state=0).copy()
+    new["bp_pi10"] += 0.05
+    scores = index.score(new)
+
+    groups = cohort.groupby(STRATA, observed=True)
+    for row, (_, scan) in enumerate(new.iterrows()):
+        reference = groups.get_group(tuple(scan[key] for key in STRATA))
+        for bp in BPS:
+            values = reference[bp].dropna()
+            percentile = scores[f"{bp}_percentile"].iloc[row]
+            zscore = scores[f"{bp}_zscore"].iloc[row]
+            if np.isnan(scan[bp]):
+                assert np.isnan(percentile) and np.isnan(zscore)
+                continue
+            np.testing.assert_allclose(
+                percentile,
+                stats.percentileofscore(values, scan[bp], kind="mean"))
+            np.testing.assert_allclose(
+                zscore, (scan[bp] - values.mean()) / values.std())
+
+
+def test_unknown_strata_score_missing(cohort):
+    index = build_index(cohort, BPS)
+    new = cohort.head(3).copy()
+    new["smoking_status"] = new["smoking_status"].astype(object)
+    new.loc[new.index[0], "smoking_status"] = "unknown"
+    scores = index.score(new)
+    assert scores.iloc[0].isna().all()
+    assert scores.iloc[1:]["bp_pi10_percentile"].notna().all()
+
+
+def test_save_and_load(cohort, tmp_path):
+    index = build_index(cohort, BPS)
+    index.save(tmp_path / "reference_index.npz")
+    loaded = ReferenceIndex.load(tmp_path / "reference_index.npz")
+    pd.testing.assert_frame_equal(loaded.score(cohort), index.score(cohort))
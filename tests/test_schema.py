@@ -0,0 +1,39 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+from data.util.schema import apply_schema, schema_dtypes
+
+
+def test_schema_dtypes():
+    dtypes = schema_dtypes(["sex", "copd_diagnosis", "bp_wt_3", "bp_wt_avg",
+                            "age"])
+    assert list(dtypes) == ["sex", "copd_diagnosis", "bp_wt_3"]
+    assert dtypes["copd_diagnosis"] == "boolean"
+    assert dtypes["bp_wt_3"] == "float32"
+
+
+def test_apply_schema_casts_the_known_columns():
+    df = pd.DataFrame({
+        "smoking_status": ["ex_smoker", "never_smoker", None],
+        "current_smoker": [False, True, None],
+        "bp_wt_3": [1.234, 2.5, np.nan],
+        "bp_wt_avg": [1.234, 2.5, np.nan],
+    })
+    result = apply_schema(df)
+    assert result["smoking_status"].cat.ordered
+    assert result["smoking_status"].tolist()[:2] == ["ex_smoker",
+                                                    "never_smoker"]
+    assert result["current_smoker"].dtype == "boolean"
+    assert result["current_smoker"].isna().tolist() == [False, False, True]
+    assert result["bp_wt_3"].dtype == np.float32
+    assert result["bp_wt_avg"].dtype == np.float64
+
+
+def test_unknown_labels_are_missing_with_a_warning(caplog):
+    df = pd.DataFrame({"GOLD_stage": ["0", "GOLD-2", "GOLD-9", None]})
+    with caplog.at_level(logging.WARNING, logger="BronchialParameters"):
+        result = apply_schema(df)
+    assert result["GOLD_stage"].isna().tolist() == [False, False, True, True]
+    assert "GOLD_stage" in caplog.text and "GOLD-9" in caplog.text
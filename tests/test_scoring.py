@@ -0,0 +1,84 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+import pytest
+import statsmodels.formula.api as smf
+
+import score
+from features.descriptive.reference_index import create_index
+from models.linear import multivariate
+from models.scoring import Z_LIMIT, Scorer
+
+BPS = ["bp_pi10", "bp_wt_avg"]
+
+
+@pytest.fixture
+def models_dir(cohort, tmp_path):
+    multivariate.fit_strata(cohort, BPS, tmp_path)
+    for min_max_params in (False, True):
+        multivariate.fit_analyse(cohort, ["fev1_pp"], tmp_path,
+                                 min_max_params)
+    create_index(cohort, BPS, tmp_path)
+    return tmp_path
+
+
+def test_stratum_equations_match_the_saved_fits(cohort, models_dir):
+    scores = Scorer.load(models_dir).score(cohort)
+    table = pd.read_csv(models_dir / "multivariate_strata.csv")
+    for _, fit in table.iterrows():
+        rows = ((cohort["sex"] == fit["Sex"]) &
+                (cohort["smoking_status"] == fit["Smoking Status"])).to_numpy()
+        param = fit["Parameter"]
+        expected = (fit["Intercept"] + fit["bmi"] * cohort["bmi"][rows] +
+                    fit["age"] * cohort["age"][rows])
+        np.testing.assert_allclose(scores[f"{param}_predicted"][rows],
+                                   expected)
+        np.testing.assert_allclose(
+            scores[f"{param}_residual_z"][rows],
+            (cohort[param][rows] - expected) / fit["Residual SD"])
+
+
+def test_multivariate_scores_match_statsmodels(cohort, models_dir):
+    scores = Scorer.load(models_dir).score(cohort)
+    data = cohort.astype({"current_smoker": bool})
+    model = smf.ols("fev1_pp ~ " + " + ".join(multivariate.independent_vars),
+                    data=data).fit()
+    # Every artifact is scored under its own name
+    np.testing.assert_allclose(scores["fev1_pp_predicted"],
+                               model.predict(data))
+    np.testing.assert_allclose(scores["fev1_pp_normalised_predicted"],
+                               model.predict(data))
+
+
+def test_unknown_labels_score_missing(cohort, models_dir):
+    scorer = Scorer.load(models_dir)
+    rows = scorer.prepare(cohort.head(4).astype(object))
+    rows.loc[0, "pack_year_categories"] = "40+"
+    rows.loc[1, "sex"] = "Other"
+    scores = scorer.score(rows)
+    assert np.isnan(scores["fev1_pp_predicted"][:2]).all()
+    assert scores["bp_pi10_predicted"][:2].isna().tolist() == [False, True]
+    assert scores["fev1_pp_predicted"][2:].notna().all()
+
+
+def test_prepare_rejects_text_values(cohort, models_dir):
+    scorer = Scorer.load(models_dir)
+    rows = cohort.head(2).astype(object)
+    rows.loc[rows.index[0], "age"] = "sixty"
+    with pytest.raises(ValueError, match="age"):
+        scorer.prepare(rows)
+
+
+def test_chunked_scores_match_scoring_at_once(cohort, models_dir, tmp_path):
+    scans = tmp_path / "scans.csv"
+    cohort.to_csv(scans, index=False)
+    args = argparse.Namespace(in_file=scans, out_file=tmp_path / "scores.csv",
+                              models_dir=models_dir, chunk_size=128,
+                              univariate_vars="height", z_limit=Z_LIMIT,
+                              normalised=False)
+    score.main(args)
+    chunked = pd.read_csv(args.out_file)
+    expected = Scorer.load(models_dir).score(pd.read_csv(scans))
+    numeric = [col for col in expected if expected[col].dtype.kind == "f"]
+    np.testing.assert_allclose(chunked[numeric], expected[numeric])
@@ -0,0 +1,77 @@
+import asyncio
+import json
+
+import pandas as pd
+import pytest
+
+from serve import MicroBatcher, _handle
+
+
+def score(rows: pd.DataFrame) -> pd.DataFrame:
+    if (rows["x"] < 0).any():
+        raise RuntimeError("Cannot score negative values")
+    return pd.DataFrame({"y": rows["x"] * 2}, index=rows.index)
+
+
+def prepare(rows: pd.DataFrame) -> pd.DataFrame:
+    return rows.assign(x=pd.to_numeric(rows["x"]))
+
+
+async def _gather(batcher: MicroBatcher, requests: list) -> list:
+    batching = asyncio.create_task(batcher.run())
+    try:
+        return await asyncio.gather(
+            *(batcher.submit(pd.DataFrame({"x": values}))
+              for values in requests),
+            return_exceptions=True)
+    finally:
+        batching.cancel()
+
+
+def test_batched_scores_match_scoring_each_request():
+    requests = [[1.0, 2.0], [3.0], [4.0, 5.0, 6.0]]
+    batcher = MicroBatcher(score, max_rows=4, max_delay=0.05)
+    results = asyncio.run(_gather(batcher, requests))
+    for values, result in zip(requests, results):
+        expected = score(pd.DataFrame({"x": values}))
+        pd.testing.assert_frame_equal(result, expected)
+
+
+def test_failing_request_only_fails_itself():
+    requests = [[1.0], [-1.0], [3.0]]
+    batcher = MicroBatcher(score, max_delay=0.05)
+    results = asyncio.run(_gather(batcher, requests))
+    assert isinstance(results[1], RuntimeError)
+    assert results[0]["y"].tolist() == [2.0]
+    assert results[2]["y"].tolist() == [6.0]
+
+
+def test_malformed_request_is_rejected_before_batching():
+    requests = [[1.0], ["one"], [3.0]]
+    batcher = MicroBatcher(score, max_delay=0.05, prepare=prepare)
+    results = asyncio.run(_gather(batcher, requests))
+    assert isinstance(results[1], ValueError)
+    assert results[2]["y"].tolist() == [6.0]
+
+
+@pytest.mark.parametrize("body, status", [
+    ([{"x": 1}], 200),
+    ({"rows": [{"x": 1}]}, 200),
+    ("text", 400),
+    ([{"x": "one"}], 400),
+    ([{"x": -1}], 500),
+])
+def test_handle_status(body, status):
+    async def handle():
+        batcher = MicroBatcher(score, max_delay=0.01, prepare=prepare)
+        batching = asyncio.create_task(batcher.run())
+        try:
+            return await _handle(batcher, "POST", "/score",
+                                 json.dumps(body).encode())
+        finally:
+            batching.cancel()
+
+    result, payload = asyncio.run(handle())
+    assert result == status
+    if status == 200:
+        assert json.loads(payload) == [{"y": 2}]
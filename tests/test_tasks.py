@@ -0,0 +1,101 @@
+import os
+from functools import partial
+
+import pytest
+
+from data.util import tasks
+from data.util.tasks import needs, reads, writes
+
+
+@reads(lambda column, **_: [column])
+@writes(lambda out, **_: [out])
+def produce(data, column, out):
+    out.write_text(column)
+
+
+@reads(lambda **_: [])
+@writes(lambda out, **_: [out])
+@needs(lambda source, **_: [source])
+def consume(data, source, out):
+    out.write_text(source.read_text() + "+")
+
+
+@reads(lambda **_: None)
+@writes(lambda out, **_: [out])
+def everything(data, out):
+    out.write_text("all")
+
+
+def run_task(task):
+    task.func(None)
+
+
+def _graph(tmp_path) -> list:
+    first, second = tmp_path / "first.txt", tmp_path / "second.txt"
+    # Listed out of order, the dependency comes from needs
+    return [
+        tasks.Task("b", "data", partial(consume, source=first, out=second)),
+        tasks.Task("a", "data", partial(produce, column="x", out=first)),
+    ]
+
+
+def test_declared_columns():
+    funcs = [partial(produce, column="x", out=None),
+             partial(produce, column="y", out=None),
+             partial(consume, source=None, out=None)]
+    assert tasks.declared_columns(funcs) == ["x", "y"]
+    assert tasks.declared_columns(
+        funcs + [partial(everything, out=None)]) is None
+
+
+def test_plan_runs_missing_outputs_in_order(tmp_path):
+    graph = _graph(tmp_path)
+    todo = tasks.plan(graph)
+    assert [task.group for task in todo] == ["a", "b"]
+
+    tasks.run(todo, run_task)
+    assert (tmp_path / "second.txt").read_text() == "x+"
+    assert tasks.plan(graph) == []
+    assert len(tasks.plan(graph, force=True)) == 2
+
+
+def test_plan_reruns_dependents_of_stale_tasks(tmp_path):
+    graph = _graph(tmp_path)
+    tasks.run(tasks.plan(graph), run_task)
+    # An input newer than the outputs makes the task and its dependents stale
+    source = tmp_path / "input.csv"
+    source.write_text("")
+    later = os.stat(tmp_path / "second.txt").st_mtime + 10
+    os.utime(source, (later, later))
+    graph = [tasks.Task(task.group, task.frame, task.func, inputs=[source])
+             for task in graph]
+    assert len(tasks.plan(graph)) == 2
+
+
+def test_run_in_parallel_matches_serial(tmp_path):
+    graph = _graph(tmp_path)
+    tasks.run(tasks.plan(graph), run_task, jobs=2)
+    assert (tmp_path / "second.txt").read_text() == "x+"
+
+
+def test_dependency_cycle_is_an_error(tmp_path):
+    path = tmp_path / "loop.txt"
+    graph = [tasks.Task("a", "data", partial(consume, source=path, out=path))]
+    with pytest.raises(ValueError):
+        tasks.topological_order(graph)
+
+
+def test_changed_arguments_force_a_rerun(tmp_path):
+    graph = _graph(tmp_path)
+    tasks.run(tasks.plan(graph), run_task)
+    # Same outputs, another column: the stamp differs
+    first, second = tmp_path / "first.txt", tmp_path / "second.txt"
+    graph = [
+        tasks.Task("b", "data", partial(consume, source=first, out=second)),
+        tasks.Task("a", "data", partial(produce, column="y", out=first)),
+    ]
+    todo = tasks.plan(graph)
+    assert [task.group for task in todo] == ["a", "b"]
+    tasks.run(todo, run_task)
+    assert second.read_text() == "y+"
+    assert tasks.plan(graph) == []
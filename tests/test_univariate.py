@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+import statsmodels.api as sm
+
+from data.util.moments import merge
+from models.linear.univariate import (batch_ols, fit_analyse_batch,
+                                      ols_from_moments, pairwise_moments,
+                                      update_fits)
+
+
+def _data(n: int = 200, seed: int = 0) -> tuple:
+    # Three covariates and two responses depending on them, with missing
+    # values scattered over both
+    rng = np.random.default_rng(seed)
+    x = rng.normal(size=(n, 3)) * [10, 0.1, 5] + [65, 1.7, 60]
+    y = x @ rng.normal(size=(3, 2)) + rng.normal(size=(n, 2))
+    x[rng.random(x.shape) < 0.05] = np.nan
+    y[rng.random(y.shape) < 0.05] = np.nan
+    return x, y
+
+
+def test_batch_ols_matches_statsmodels():
+    x, y = _data()
+    fits = batch_ols(x, y)
+    for i in range(x.shape[1]):
+        for j in range(y.shape[1]):
+            rows = ~np.isnan(x[:, i]) & ~np.isnan(y[:, j])
+            model = sm.OLS(y[rows, j], sm.add_constant(x[rows, i])).fit()
+            assert fits["n"][i, j] == model.nobs
+            np.testing.assert_allclose(
+                [fits["intercept"][i, j], fits["slope"][i, j]], model.params)
+            np.testing.assert_allclose(fits["rsquared"][i, j], model.rsquared)
+            np.testing.assert_allclose(fits["pvalue"][i, j], model.pvalues[1])
+            np.testing.assert_allclose(fits["scale"][i, j], model.scale)
+            np.testing.assert_allclose(fits["cov"][i, j], model.cov_params())
+
+
+
+def test_merged_moments_match_batch_ols():
+    x, y = _data()
+    merged = merge(pairwise_moments(x[:80], y[:80]),
+                   pairwise_moments(x[80:], y[80:]))
+    fits, expected = ols_from_moments(merged), batch_ols(x, y)
+    for stat in ("n", "intercept", "slope", "scale", "cov"):
+        np.testing.assert_allclose(fits[stat], expected[stat])
+
+
+def test_updates_match_the_whole_cohort(cohort, tmp_path):
+    i_vars, bps = ["age", "height"], ["bp_pi10", "bp_wt_avg"]
+    (tmp_path / "whole").mkdir()
+    (tmp_path / "updated").mkdir()
+    fit_analyse_batch(cohort, bps, i_vars, tmp_path / "whole")
+    for batch in (cohort[:300], cohort[300:]):
+        update_fits(batch, bps, i_vars, tmp_path / "updated")
+    for i_var in i_vars:
+        name = f"univariate_analysis_wrt_{i_var}.csv"
+        pd.testing.assert_frame_equal(
+            pd.read_csv(tmp_path / "updated" / name),
+            pd.read_csv(tmp_path / "whole" / name))